@@ -0,0 +1,110 @@
+"""Typed codecs vs JSON vs pickle for every declared control message.
+
+json is today's path: Protocol.encode_message on send, Protocol.decode_frame
+on receive. pickle uses the highest protocol on the same dict (never for
+untrusted peers; it is here as the fastest stdlib baseline). Bytes go
+into JSON base64'd, as v1 MEDIA does.
+
+Besides throughput, tracemalloc counts what one decoded message keeps
+alive (blocks and bytes, i.e. what the GC and allocator see per message)
+and the peak transient memory of a single encode and decode.
+
+Run from NewStructure/:  python -m benchmarks.bench_codec
+"""
+import argparse
+import base64
+import os
+import pickle
+import time
+import tracemalloc
+from shared import codec
+from shared.protocols import Protocol
+
+SDP_LINE = "a=rtcp-fb:96 nack pli\r\n"
+
+
+def samples():
+    """(message type, fields) for each declared message"""
+    return [
+        (codec.JOIN, dict(username='alice-0042', room='standup', protocol=2)),
+        (codec.JOIN_ACK, dict(status='success', protocol=2, stream_id=1042, session='3f0c9a7e5b1d4c2a8e6f0b9d',
+                              resume_grace=30.0)),
+        (codec.LEAVE, dict(username='alice-0042')),
+        (codec.MEDIA, dict(kind=1, flags=0, stream=1042, seq=90210, timestamp_us=1_700_000_000_000_000,
+                           data=os.urandom(1200))),
+        (codec.CALL, dict(caller='alice-0042', target='bob-0007', sdp=SDP_LINE * 160)),
+        (codec.ANSWER, dict(answerer='bob-0007', target='alice-0042', sdp=SDP_LINE * 160)),
+        (codec.END, dict(user='alice-0042', target='bob-0007')),
+        (codec.USERLIST, dict(version=4821, users=[f"user-{i:04d}" for i in range(200)])),
+    ]
+
+
+def as_dict(message_type, fields):
+    message = {'type': message_type.name, **fields}
+    if 'data' in message:
+        message['data'] = base64.b64encode(message['data']).decode('ascii')
+    return message
+
+
+def rate(fn, args, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return repeat / (time.perf_counter() - start)
+
+
+def retained(fn, arg, count: int = 1000):
+    """(blocks, bytes) kept alive per call while the results are held"""
+    results = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(count):
+        results.append(fn(arg))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    # The results list itself is not the decoder's doing
+    return (blocks - 1) / count, (size - results.__sizeof__()) / count
+
+
+def peak(fn, arg) -> int:
+    """Peak transient bytes of one call"""
+    fn(arg)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn(arg)
+    _, top = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return top
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Typed codec vs JSON vs pickle")
+    parser.add_argument('--repeat', type=int, default=20000, help='Calls per throughput measurement')
+    args = parser.parse_args()
+
+    print(f"{'message':<9} {'':<6} {'bytes':>6} {'enc/s':>10} {'dec/s':>10} {'blocks':>7} {'kept B':>7} "
+          f"{'enc peak':>9} {'dec peak':>9}")
+    for message_type, fields in samples():
+        message = as_dict(message_type, fields)
+        typed = message_type.encode(**fields)
+        framed = Protocol.encode_message(message)
+        pickled = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        assert codec.CONTROL.decode(typed)[1] == message_type.record(**fields) or message_type is codec.MEDIA
+        encoders = {
+            'codec': (lambda f: message_type.encode(**f), fields, codec.CONTROL.decode, typed),
+            'json': (Protocol.encode_message, message, Protocol.decode_frame, framed),
+            'pickle': (lambda m: pickle.dumps(m, pickle.HIGHEST_PROTOCOL), message, pickle.loads, pickled),
+        }
+        for label, (encode, value, decode, encoded) in encoders.items():
+            enc = rate(encode, (value,), args.repeat)
+            dec = rate(decode, (encoded,), args.repeat)
+            blocks, kept = retained(decode, encoded)
+            print(f"{message_type.name if label == 'codec' else '':<9} {label:<6} {len(encoded):>6} {enc:>10.0f} "
+                  f"{dec:>10.0f} {blocks:>7.1f} {kept:>7.0f} {peak(encode, value):>9} {peak(decode, encoded):>9}")
+
+
+if __name__ == "__main__":
+    main()
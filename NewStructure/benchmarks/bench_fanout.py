@@ -0,0 +1,86 @@
+"""Fan-out cost per forwarded MEDIA message as the room grows.
+
+Compares the old relay (encode_message once per recipient) with the
+encode-once path in ConnectionManager.process_message, which forwards the
+frame received from the sender to every recipient.
+
+Run from NewStructure/:  python -m benchmarks.bench_fanout
+"""
+import argparse
+import contextlib
+import os
+import time
+from shared import protocols
+from server.connection_manager import ConnectionManager, DEFAULT_ROOM
+from server.send_queue import SendQueue, PRIORITY_VIDEO
+
+
+class StubConnection:
+    """Stands in for a Connection: queues and immediately drains sends"""
+
+    def __init__(self, name: str):
+        self.username = name
+        self.addr = (name, 0)
+        self.send_queue = SendQueue()
+        self.frame_received_at = 0.0
+
+    def send(self, data: bytes, priority: int = 0):
+        self.send_queue.push(data, priority)
+        self.send_queue.pop()
+
+
+def legacy_fanout(message: dict, sender, recipients):
+    for user, sock in recipients:
+        if sock is not sender:
+            sock.send(protocols.Protocol.encode_message(message), PRIORITY_VIDEO)
+
+
+def run(room_size: int, payload_size: int, iterations: int):
+    manager = ConnectionManager('127.0.0.1', 0, '', '')
+    conns = [StubConnection(f"user{i}") for i in range(room_size)]
+    for conn in conns:
+        manager.clients[conn.username] = conn
+        manager.rooms.add_user(DEFAULT_ROOM, conn)
+    sender = conns[0]
+    message = {
+        'type': 'MEDIA',
+        'from': sender.username,
+        'data': 'x' * payload_size,
+        'timestamp': time.time(),
+    }
+    raw = protocols.Protocol.encode_message(message)
+    recipients = list(manager.clients.items())
+    forwards = (room_size - 1) * iterations
+
+    start = time.process_time()
+    for _ in range(iterations):
+        legacy_fanout(message, sender, recipients)
+    legacy = time.process_time() - start
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.process_time()
+        for _ in range(iterations):
+            manager.process_message(message, sender, raw)
+        shared = time.process_time() - start
+
+    for loop in manager.loops:
+        loop._close()
+    return legacy / forwards * 1e6, shared / forwards * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay fan-out benchmark")
+    parser.add_argument('--sizes', default='2,5,10,20,50', help='Comma-separated room sizes')
+    parser.add_argument('--payload', type=int, default=8192, help='MEDIA data size in bytes')
+    parser.add_argument('--iterations', type=int, default=2000, help='Inbound messages per size')
+    args = parser.parse_args()
+
+    print(f"payload={args.payload}B iterations={args.iterations}")
+    print(f"{'room':>6} {'legacy us/fwd':>14} {'shared us/fwd':>14} {'speedup':>8}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        legacy, shared = run(size, args.payload, args.iterations)
+        print(f"{size:>6} {legacy:>14.2f} {shared:>14.2f} {legacy / shared:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Encode/decode throughput of v1 JSON media vs v2 binary media framing.
+
+v1 is today's path: binary payload base64'd into a dict, encode_message on
+send, decode_message plus base64 decode on receive. v2 packs the fixed
+header and decodes with a memoryview over the received frame.
+
+Run from NewStructure/:  python -m benchmarks.bench_protocol
+"""
+import argparse
+import base64
+import os
+import time
+from shared import protocols
+from shared.protocols import Protocol, MEDIA_VIDEO
+
+
+def v1_encode(payload: bytes, seq: int) -> bytes:
+    return Protocol.encode_message({
+        'type': 'MEDIA',
+        'kind': 'video',
+        'stream': 1,
+        'seq': seq,
+        'timestamp': time.time(),
+        'data': base64.b64encode(payload).decode('ascii'),
+    })
+
+
+def v1_decode(frame: bytes) -> bytes:
+    message = Protocol.decode_message(frame[Protocol.HEADER_SIZE:])
+    return base64.b64decode(message['data'])
+
+
+def v2_encode(payload: bytes, seq: int) -> bytes:
+    return Protocol.encode_media(MEDIA_VIDEO, 1, seq, int(time.time() * 1e6), payload)
+
+
+def v2_decode(frame: bytes) -> memoryview:
+    return Protocol.decode_media(frame).payload
+
+
+def measure(func, args_list, repeat: int) -> float:
+    """Operations per second over repeat passes of args_list"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for args in args_list:
+            func(*args)
+    elapsed = time.perf_counter() - start
+    return repeat * len(args_list) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Protocol v1 vs v2 microbenchmark")
+    parser.add_argument('--sizes', default='64,1024,16384,65536', help='Payload sizes in bytes')
+    parser.add_argument('--count', type=int, default=200, help='Distinct frames per size')
+    parser.add_argument('--repeat', type=int, default=20, help='Passes over the frames')
+    args = parser.parse_args()
+
+    print(f"protocol v{protocols.PROTOCOL_VERSION} media header = {Protocol.MEDIA_HEADER_SIZE} bytes")
+    print(f"{'size':>7} {'v1 enc/s':>11} {'v2 enc/s':>11} {'v1 dec/s':>11} {'v2 dec/s':>11} "
+          f"{'v1 bytes':>9} {'v2 bytes':>9}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        payloads = [(os.urandom(size), seq) for seq in range(args.count)]
+        v1_frames = [(v1_encode(p, seq),) for p, seq in payloads]
+        v2_frames = [(v2_encode(p, seq),) for p, seq in payloads]
+        v1_enc = measure(v1_encode, payloads, args.repeat)
+        v2_enc = measure(v2_encode, payloads, args.repeat)
+        v1_dec = measure(v1_decode, v1_frames, args.repeat)
+        v2_dec = measure(v2_decode, v2_frames, args.repeat)
+        print(f"{size:>7} {v1_enc:>11.0f} {v2_enc:>11.0f} {v1_dec:>11.0f} {v2_dec:>11.0f} "
+              f"{len(v1_frames[0][0]):>9} {len(v2_frames[0][0]):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Handshakes per second with full TLS handshakes vs session resumption.
+
+Starts a ConnectionManager in a child process. Each connect performs the
+handshake, then a JOIN/JOIN_ACK round trip so the TLS 1.3 ticket is
+delivered, then closes. The resumed run offers the saved session on every
+connect the way NetworkHandler does.
+
+Run from NewStructure/:  python -m benchmarks.bench_tls_resume
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import socket
+import statistics
+import time
+from shared import protocols, ssl_utils
+from shared.framing import FrameReader
+
+
+def _serve(port: int, certfile: str, keyfile: str):
+    from server.connection_manager import ConnectionManager
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ConnectionManager('127.0.0.1', port, certfile, keyfile).start()
+
+
+def run(port: int, certfile: str, count: int, resume: bool):
+    """Returns (connects/sec, handshake times, connects that resumed)"""
+    context = ssl_utils.create_ssl_context(certfile, None, server_side=False)
+    cache = ssl_utils.SessionCache()
+    key = ('127.0.0.1', port)
+    handshakes = []
+    resumed = 0
+    start = time.perf_counter()
+    for i in range(count):
+        sock = socket.create_connection(key)
+        handshake_start = time.perf_counter()
+        ssl_sock = ssl_utils.wrap_socket(sock, context, session=cache.get(key) if resume else None)
+        handshakes.append(time.perf_counter() - handshake_start)
+        resumed += ssl_sock.session_reused
+        ssl_sock.sendall(protocols.Protocol.create_control_message('JOIN', username=f"bench-{i}"))
+        FrameReader(ssl_sock).read_frame()
+        if resume:
+            cache.save(key, ssl_sock)
+        ssl_sock.close()
+    elapsed = time.perf_counter() - start
+    return count / elapsed, handshakes, resumed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TLS full vs resumed handshake benchmark")
+    parser.add_argument('--port', type=int, default=5099, help='Port for the benchmark server')
+    parser.add_argument('--cert', default='ssl/cert.pem', help='SSL certificate file')
+    parser.add_argument('--key', default='ssl/key.pem', help='SSL key file')
+    parser.add_argument('--count', type=int, default=300, help='Connects per run')
+    args = parser.parse_args()
+
+    server = multiprocessing.Process(target=_serve, args=(args.port, args.cert, args.key), daemon=True)
+    server.start()
+    time.sleep(1.0)
+    try:
+        run(args.port, args.cert, 10, resume=False)
+        print(f"{'mode':>8} {'connects/s':>11} {'p50 ms':>8} {'p99 ms':>8} {'resumed':>9}")
+        for resume in (False, True):
+            rate, handshakes, resumed = run(args.port, args.cert, args.count, resume)
+            handshakes.sort()
+            p99 = handshakes[min(len(handshakes) - 1, int(0.99 * len(handshakes)))]
+            print(f"{'resumed' if resume else 'full':>8} {rate:>11.0f} "
+                  f"{statistics.median(handshakes) * 1000:>8.2f} {p99 * 1000:>8.2f} "
+                  f"{resumed:>4}/{args.count}")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
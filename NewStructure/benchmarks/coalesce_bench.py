@@ -0,0 +1,114 @@
+"""Syscalls and TLS records per control message: one sendall each vs CoalescingWriter.
+
+A loopback TLS server thread drains the connection with large recvs; an
+SSL read never spans records, so its recv count is the number of records
+that arrived. Messages are USER_JOINED notifications sent in bursts, the
+way a join storm fans them out. Write syscalls come from /proc/self/io
+(Linux only).
+
+Run from NewStructure/:  python -m benchmarks.coalesce_bench
+"""
+import argparse
+import socket
+import threading
+import time
+from shared import ssl_utils
+from shared.coalesce import CoalescingWriter
+from shared.protocols import Protocol
+
+
+def write_syscalls() -> int:
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('syscw:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return -1
+
+
+class Sink:
+    """TLS server thread counting records and bytes received"""
+
+    def __init__(self, certfile: str, keyfile: str):
+        self.context = ssl_utils.new_ssl_context(certfile, keyfile, server_side=True)
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        self.records = 0
+        self.bytes = 0
+        self.done = threading.Event()
+        self.expected = 0
+
+    def serve_one(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        sock, _ = self.listener.accept()
+        conn = self.context.wrap_socket(sock, server_side=True)
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            self.records += 1
+            self.bytes += len(data)
+            if self.bytes >= self.expected:
+                self.done.set()
+        conn.close()
+
+
+def run(certfile: str, keyfile: str, messages, burst: int, gap: float, coalesce: bool):
+    """Returns (seconds, write syscalls, records received, sends) for one connection"""
+    sink = Sink(certfile, keyfile)
+    sink.expected = sum(len(m) for m in messages)
+    sink.serve_one()
+    context = ssl_utils.new_ssl_context(certfile, None, server_side=False)
+    sock = context.wrap_socket(socket.create_connection(('127.0.0.1', sink.port)))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    writer = CoalescingWriter(sock) if coalesce else None
+
+    syscalls = write_syscalls()
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        if writer is not None:
+            writer.write(message)
+        else:
+            sock.sendall(message)
+        if gap and (i + 1) % burst == 0:
+            time.sleep(gap)
+    if writer is not None:
+        writer.flush()
+    sink.done.wait(30)
+    elapsed = time.perf_counter() - start
+    syscalls = write_syscalls() - syscalls if syscalls >= 0 else -1
+    sends = writer.sends if writer is not None else len(messages)
+    if writer is not None:
+        writer.close()
+    sock.close()
+    sink.listener.close()
+    return elapsed, syscalls, sink.records, sends
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message sendall vs coalesced writes over TLS")
+    parser.add_argument('--cert', default='ssl/cert.pem', help='SSL certificate file')
+    parser.add_argument('--key', default='ssl/key.pem', help='SSL key file')
+    parser.add_argument('--count', type=int, default=20000, help='Messages per run')
+    parser.add_argument('--bursts', default='1,10,100', help='Messages sent back to back before a pause')
+    parser.add_argument('--gap', type=float, default=0.001, help='Pause between bursts in seconds')
+    args = parser.parse_args()
+
+    messages = [Protocol.create_control_message('USER_JOINED', username=f"user-{i}", room='bench')
+                for i in range(args.count)]
+    print(f"{args.count} messages of ~{len(messages[0])} bytes, {args.gap * 1000:.1f}ms between bursts")
+    print(f"{'burst':>6} {'mode':>9} {'msg/s':>9} {'sends/msg':>10} {'syscw/msg':>10} {'records/msg':>12}")
+    for burst in (int(b) for b in args.bursts.split(',')):
+        for coalesce in (False, True):
+            elapsed, syscalls, records, sends = run(args.cert, args.key, messages, burst, args.gap, coalesce)
+            syscw = f"{syscalls / args.count:.3f}" if syscalls >= 0 else 'n/a'
+            print(f"{burst:>6} {'coalesce' if coalesce else 'sendall':>9} {args.count / elapsed:>9.0f} "
+                  f"{sends / args.count:>10.3f} {syscw:>10} {records / args.count:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
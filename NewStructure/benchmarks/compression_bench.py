@@ -0,0 +1,197 @@
+"""Size and CPU cost of compressing signalling payloads, with and without the preset dictionary.
+
+Payloads are generated the way the servers see them: fnew relays SDP
+offers/answers and ICE candidates as JSON, and both apps send user lists.
+Session-specific fields (ICE credentials, fingerprints, SSRCs, msids,
+names) are random, so only the boilerplate the dictionary holds repeats.
+
+Run from NewStructure/:  python -m benchmarks.compression_bench
+"""
+import argparse
+import json
+import random
+import string
+import time
+import uuid
+from shared import compression
+from shared.compression import Compressor
+
+
+def _token(size: int) -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits + '+/', k=size))
+
+
+# A Chrome offer as captured, with its session-specific fields as placeholders
+SDP_TEMPLATE = """v=0
+o=- {session} 2 IN IP4 127.0.0.1
+s=-
+t=0 0
+a=group:BUNDLE 0 1
+a=extmap-allow-mixed
+a=msid-semantic: WMS {stream}
+m=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8 13 110 126
+c=IN IP4 0.0.0.0
+a=rtcp:9 IN IP4 0.0.0.0
+a=ice-ufrag:{ufrag}
+a=ice-pwd:{pwd}
+a=ice-options:trickle
+a=fingerprint:sha-256 {fingerprint}
+a=setup:{setup}
+a=mid:0
+a=extmap:1 urn:ietf:params:rtp-hdrext:ssrc-audio-level
+a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time
+a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01
+a=extmap:4 urn:ietf:params:rtp-hdrext:sdes:mid
+a=sendrecv
+a=msid:{stream} {audio_track}
+a=rtcp-mux
+a=rtpmap:111 opus/48000/2
+a=rtcp-fb:111 transport-cc
+a=fmtp:111 minptime=10;useinbandfec=1
+a=rtpmap:63 red/48000/2
+a=fmtp:63 111/111
+a=rtpmap:9 G722/8000
+a=rtpmap:0 PCMU/8000
+a=rtpmap:8 PCMA/8000
+a=rtpmap:13 CN/8000
+a=rtpmap:110 telephone-event/48000
+a=rtpmap:126 telephone-event/8000
+a=ssrc:{audio_ssrc} cname:{cname}
+a=ssrc:{audio_ssrc} msid:{stream} {audio_track}
+m=video 9 UDP/TLS/RTP/SAVPF 96 97 102 103 104 105 106 107 108 109 127 125 39 40 45 46 98 99 100 101 112 113 116 117 118
+c=IN IP4 0.0.0.0
+a=rtcp:9 IN IP4 0.0.0.0
+a=ice-ufrag:{ufrag}
+a=ice-pwd:{pwd}
+a=ice-options:trickle
+a=fingerprint:sha-256 {fingerprint}
+a=setup:{setup}
+a=mid:1
+a=extmap:14 urn:ietf:params:rtp-hdrext:toffset
+a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time
+a=extmap:13 urn:3gpp:video-orientation
+a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01
+a=extmap:5 http://www.webrtc.org/experiments/rtp-hdrext/playout-delay
+a=extmap:6 http://www.webrtc.org/experiments/rtp-hdrext/video-content-type
+a=extmap:7 http://www.webrtc.org/experiments/rtp-hdrext/video-timing
+a=extmap:8 http://www.webrtc.org/experiments/rtp-hdrext/color-space
+a=extmap:4 urn:ietf:params:rtp-hdrext:sdes:mid
+a=extmap:10 urn:ietf:params:rtp-hdrext:sdes:rtp-stream-id
+a=extmap:11 urn:ietf:params:rtp-hdrext:sdes:repaired-rtp-stream-id
+a=sendrecv
+a=msid:{stream} {video_track}
+a=rtcp-mux
+a=rtcp-rsize
+a=rtpmap:96 VP8/90000
+a=rtcp-fb:96 goog-remb
+a=rtcp-fb:96 transport-cc
+a=rtcp-fb:96 ccm fir
+a=rtcp-fb:96 nack
+a=rtcp-fb:96 nack pli
+a=rtpmap:97 rtx/90000
+a=fmtp:97 apt=96
+a=rtpmap:102 H264/90000
+a=rtcp-fb:102 goog-remb
+a=rtcp-fb:102 transport-cc
+a=rtcp-fb:102 ccm fir
+a=rtcp-fb:102 nack
+a=rtcp-fb:102 nack pli
+a=fmtp:102 level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=42001f
+a=rtpmap:103 rtx/90000
+a=fmtp:103 apt=102
+a=rtpmap:45 AV1/90000
+a=rtcp-fb:45 goog-remb
+a=rtcp-fb:45 transport-cc
+a=rtcp-fb:45 ccm fir
+a=rtcp-fb:45 nack
+a=rtcp-fb:45 nack pli
+a=fmtp:45 level-idx=5;profile=0;tier=0
+a=rtpmap:98 VP9/90000
+a=rtcp-fb:98 goog-remb
+a=rtcp-fb:98 transport-cc
+a=rtcp-fb:98 ccm fir
+a=rtcp-fb:98 nack
+a=rtcp-fb:98 nack pli
+a=fmtp:98 profile-id=0
+a=rtpmap:116 red/90000
+a=rtpmap:117 rtx/90000
+a=fmtp:117 apt=116
+a=rtpmap:118 ulpfec/90000
+a=ssrc-group:FID {video_ssrc} {rtx_ssrc}
+a=ssrc:{video_ssrc} cname:{cname}
+a=ssrc:{video_ssrc} msid:{stream} {video_track}
+a=ssrc:{rtx_ssrc} cname:{cname}
+a=ssrc:{rtx_ssrc} msid:{stream} {video_track}
+"""
+
+
+def sdp(kind: str) -> str:
+    """SDP_TEMPLATE with fresh session fields, CRLF line endings"""
+    text = SDP_TEMPLATE.format(
+        session=random.randrange(10 ** 18), stream=uuid.uuid4(), ufrag=_token(4), pwd=_token(24),
+        fingerprint=':'.join(f"{random.randrange(256):02X}" for _ in range(32)),
+        setup='actpass' if kind == 'offer' else 'active',
+        audio_track=uuid.uuid4(), video_track=uuid.uuid4(), cname=_token(16),
+        audio_ssrc=random.randrange(2 ** 32), video_ssrc=random.randrange(2 ** 32), rtx_ssrc=random.randrange(2 ** 32))
+    return text.replace("\n", "\r\n")
+
+
+def payloads(users: int):
+    name = lambda: random.choice(['alex', 'sam', 'priya', 'wei', 'maria', 'omar']) + str(random.randrange(1000))
+    offer = json.dumps({'caller': name(), 'offer': {'type': 'offer', 'sdp': sdp('offer')}}).encode()
+    answer = json.dumps({'answerer': name(), 'answer': {'type': 'answer', 'sdp': sdp('answer')}}).encode()
+    candidate = json.dumps({'candidate': {
+        'candidate': f"candidate:{random.randrange(2 ** 32)} 1 udp 2122260223 192.168.{random.randrange(256)}."
+                     f"{random.randrange(256)} {random.randrange(1024, 65536)} typ host generation 0 "
+                     f"ufrag {_token(4)} network-id 1",
+        'sdpMid': "0", 'sdpMLineIndex': 0}}).encode()
+    names = [name() for _ in range(users)]
+    return [
+        ('offer', offer),
+        ('answer', answer),
+        ('ice candidate', candidate),
+        (f'user list ({users}, fnew)', json.dumps({'version': 4821, 'users': names}).encode()),
+        (f'user list ({users}, Newnew)', "|".join(["USERS", "4821"] + names).encode()),
+    ]
+
+
+def measure(compressor: Compressor, data: bytes, repeat: int):
+    """(wire bytes, CPU microseconds per message)"""
+    out = compressor.compress(data)
+    start = time.process_time()
+    for _ in range(repeat):
+        compressor.compress(data)
+    elapsed = time.process_time() - start
+    return (len(out) if out is not None else len(data)), elapsed / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Signalling compression: plain deflate vs preset dictionary")
+    parser.add_argument('--users', type=int, default=50, help='Names in the user lists')
+    parser.add_argument('--repeat', type=int, default=2000, help='Compressions per measurement')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    plain = Compressor(dictionary=b'')
+    preset = Compressor()
+    print(f"dictionary {compression.DICTIONARY_VERSION}: {len(compression.DICTIONARY)} bytes, "
+          f"threshold {compression.THRESHOLD} bytes")
+    print(f"{'payload':<24} {'raw':>6} {'deflate':>8} {'+dict':>6} {'saved':>6} {'us':>6} {'us+dict':>8} "
+          f"{'inflate us':>10}")
+    for label, data in payloads(args.users):
+        plain_size, plain_us = measure(plain, data, args.repeat)
+        preset_size, preset_us = measure(preset, data, args.repeat)
+        deflated = preset.compress(data)
+        inflate_us = 0.0
+        if deflated is not None:
+            start = time.process_time()
+            for _ in range(args.repeat):
+                preset.decompress(deflated)
+            inflate_us = (time.process_time() - start) / args.repeat * 1e6
+        print(f"{label:<24} {len(data):>6} {plain_size:>8} {preset_size:>6} "
+              f"{1 - preset_size / len(data):>6.0%} {plain_us:>6.1f} {preset_us:>8.1f} {inflate_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""Drive a relay with thousands of synthetic clients and report what it delivered.
+
+Clients are spread over worker processes, each running one selector loop
+over non-blocking TLS sockets. Client i joins room i // room-size; every
+client sends media at --rate frames/sec (or only the first --senders of
+each room) and reads everything the relay forwards to it. Capture
+timestamps travel in the media header, so end-to-end latency is measured
+on receipt, and per-stream sequence gaps count frames the relay dropped.
+
+Run from NewStructure/ against a running server:
+    python -m benchmarks.loadgen --port 5000 --clients 2000 --room-size 10 --server-pid PID
+or let it start one:
+    python -m benchmarks.loadgen --spawn-server --loops 4 --clients 1000
+With --nodes N, client i connects to PORT + i % N, so every room spans the
+nodes of a cluster (--spawn-server starts a local one).
+"""
+import argparse
+import base64
+import contextlib
+import multiprocessing
+import os
+import random
+import selectors
+import signal
+import socket
+import ssl
+import time
+from array import array
+from typing import Dict, List, Optional
+from shared import protocols, ssl_utils
+from shared.framing import FrameReader
+from shared.protocols import Protocol
+
+LATENCY_SAMPLES = 200_000
+
+
+class SyntheticClient:
+    """One non-blocking relay client that sends on a schedule and tallies what it receives"""
+
+    def __init__(self, index: int, sock: ssl.SSLSocket, room: str, protocol: int, sender: bool):
+        self.index = index
+        self.sock = sock
+        self.room = room
+        self.protocol = protocol
+        self.sender = sender
+        self.reader = FrameReader(sock, buffer_size=16 * 1024)
+        self.stream_id = 0
+        self.joined = False
+        self.seq = 0
+        self.next_send = 0.0
+        self._pending: Optional[memoryview] = None
+        self.last_seq: Dict[int, int] = {}
+
+    def join(self):
+        self.write(Protocol.encode_message({
+            'type': 'JOIN', 'username': f"load-{self.index}", 'room': self.room,
+            'protocol': self.protocol,
+        }))
+
+    def write(self, data: bytes) -> bool:
+        """Send or buffer data; False if an earlier write is still pending"""
+        if self._pending is not None:
+            return False
+        self._pending = memoryview(data)
+        self.flush()
+        return True
+
+    def flush(self):
+        try:
+            while self._pending is not None:
+                sent = self.sock.send(self._pending)
+                self._pending = self._pending[sent:] if sent < len(self._pending) else None
+        except (ssl.SSLWantWriteError, ssl.SSLWantReadError, BlockingIOError):
+            pass
+
+    @property
+    def blocked(self) -> bool:
+        return self._pending is not None
+
+    def media_frame(self, payload: bytes) -> bytes:
+        timestamp_us = int(time.time() * 1e6)
+        seq = self.seq
+        self.seq += 1
+        if self.protocol >= protocols.PROTOCOL_V2:
+            return Protocol.encode_media(protocols.MEDIA_VIDEO, self.stream_id, seq, timestamp_us, payload)
+        return Protocol.encode_message({
+            'type': 'MEDIA', 'kind': 'video', 'stream': self.stream_id, 'seq': seq,
+            'timestamp': timestamp_us / 1e6, 'data': base64.b64encode(payload).decode('ascii'),
+        })
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.send_skipped = 0
+        self.received = 0
+        self.received_bytes = 0
+        self.gaps = 0
+        self.latencies = array('d')
+        self._seen = 0
+
+    def record_latency(self, latency: float):
+        # Reservoir sample so long runs keep bounded memory
+        self._seen += 1
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(latency)
+        else:
+            slot = random.randrange(self._seen)
+            if slot < LATENCY_SAMPLES:
+                self.latencies[slot] = latency
+
+
+def _on_frame(client: SyntheticClient, frame: memoryview, stats: Stats, measuring: bool):
+    if frame[0] == protocols.MEDIA_MAGIC:
+        media = Protocol.decode_media(frame)
+        stream_id, seq, timestamp = media.stream_id, media.seq, media.timestamp_us / 1e6
+    else:
+        message = Protocol.decode_frame(frame)
+        if message.get('type') == 'JOIN_ACK':
+            client.joined = True
+            client.protocol = message.get('protocol', protocols.PROTOCOL_V1)
+            client.stream_id = message.get('stream_id', 0)
+            return
+        if message.get('type') == 'PING':
+            client.write(Protocol.create_control_message('PONG'))
+            return
+        if message.get('type') != 'MEDIA':
+            return
+        stream_id, seq, timestamp = message.get('stream'), message.get('seq', 0), message.get('timestamp', 0)
+
+    last = client.last_seq.get(stream_id)
+    client.last_seq[stream_id] = seq
+    if not measuring:
+        return
+    if last is not None and seq > last + 1:
+        stats.gaps += seq - last - 1
+    stats.received += 1
+    stats.received_bytes += len(frame)
+    stats.record_latency(time.time() - timestamp)
+
+
+def _read(client: SyntheticClient, stats: Stats, measuring: bool) -> bool:
+    """Drain the socket; False once the server has closed it"""
+    try:
+        while True:
+            if client.reader.fill() == 0:
+                return False
+            for frame in client.reader.frames():
+                _on_frame(client, frame, stats, measuring)
+            if not client.sock.pending():
+                return True
+    except (ssl.SSLWantReadError, ssl.SSLWantWriteError, BlockingIOError):
+        return True
+    except (ConnectionError, ssl.SSLError, OSError):
+        return False
+
+
+def _connect(host: str, port: int, context: ssl.SSLContext) -> ssl.SSLSocket:
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    ssl_sock = ssl_utils.wrap_socket(sock, context)
+    ssl_sock.setblocking(False)
+    return ssl_sock
+
+
+def _run_process(indexes: List[int], args, barrier, results):
+    context = ssl_utils.create_ssl_context(args.cert, None, server_side=False)
+    selector = selectors.DefaultSelector()
+    stats = Stats()
+    clients = []
+    for index in indexes:
+        room_index, position = divmod(index, args.room_size)
+        sender = args.senders is None or position < args.senders
+        port = args.port + index % args.nodes
+        client = SyntheticClient(index, _connect(args.host, port, context),
+                                 f"load-{room_index}", args.protocol, sender)
+        selector.register(client.sock, selectors.EVENT_READ, client)
+        client.join()
+        clients.append(client)
+
+    # Collect JOIN_ACKs (and our stream ids) before anyone starts sending
+    deadline = time.monotonic() + 30
+    while not all(c.joined for c in clients) and time.monotonic() < deadline:
+        for key, _ in selector.select(0.1):
+            _read(key.data, stats, False)
+    barrier.wait()
+
+    payload = os.urandom(args.frame_size)
+    interval = 1.0 / args.rate
+    start = time.monotonic()
+    for client in clients:
+        client.next_send = start + random.random() * interval
+    stop_sending = start + args.duration
+    stop_reading = stop_sending + args.drain
+    senders = [c for c in clients if c.sender]
+    closed = 0
+
+    while True:
+        now = time.monotonic()
+        if now >= stop_reading:
+            break
+        if now < stop_sending:
+            for client in senders:
+                if client.next_send <= now:
+                    client.next_send += interval
+                    if client.blocked:
+                        stats.send_skipped += 1
+                        continue
+                    client.write(client.media_frame(payload))
+                    stats.sent += 1
+                    if client.blocked:
+                        selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+            timeout = max(0.0, min(c.next_send for c in senders) - time.monotonic()) if senders else 0.01
+        else:
+            timeout = 0.01
+        for key, mask in selector.select(min(timeout, 0.01)):
+            client = key.data
+            if mask & selectors.EVENT_WRITE:
+                client.flush()
+            if mask & selectors.EVENT_READ and not _read(client, stats, True):
+                selector.unregister(client.sock)
+                closed += 1
+                continue
+            if key.events & selectors.EVENT_WRITE and not client.blocked:
+                selector.modify(client.sock, selectors.EVENT_READ, client)
+
+    for client in clients:
+        with contextlib.suppress(OSError):
+            client.sock.close()
+    results.put({
+        'sent': stats.sent, 'send_skipped': stats.send_skipped, 'received': stats.received,
+        'received_bytes': stats.received_bytes, 'gaps': stats.gaps, 'closed': closed,
+        'senders': len(senders), 'latencies': stats.latencies.tobytes(),
+    })
+
+
+def _cpu_seconds(pid: int) -> float:
+    """utime + stime of pid and its descendants (e.g. --workers children), from /proc"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0.0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / ticks
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def _serve(args):
+    from server.connection_manager import ConnectionManager
+    from server.workers import run_workers
+    from server.cluster import run_local_cluster
+    options = dict(host=args.host, port=args.port, certfile=args.cert, keyfile=args.key,
+                   loops=args.loops, queue_depth=args.queue_depth)
+    if not args.rate_limits:
+        options.update(client_control_limit=None, client_media_limit=None,
+                       room_control_limit=None, room_media_limit=None)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if args.nodes > 1:
+            run_local_cluster(args.nodes, args.cluster_port, **options)
+        elif args.workers > 1:
+            run_workers(args.workers, **options)
+        else:
+            ConnectionManager(**options).start()
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic load generator for the relay")
+    parser.add_argument('--host', default='127.0.0.1', help='Server host address')
+    parser.add_argument('--port', type=int, default=5000, help='Server port')
+    parser.add_argument('--cert', default='ssl/cert.pem', help='SSL certificate file')
+    parser.add_argument('--key', default='ssl/key.pem', help='SSL key file (for --spawn-server)')
+    parser.add_argument('--clients', type=int, default=100, help='Total synthetic clients')
+    parser.add_argument('--room-size', type=int, default=10, help='Clients per room')
+    parser.add_argument('--senders', type=int, default=None, help='Senders per room (default: everyone)')
+    parser.add_argument('--frame-size', type=int, default=4096, help='Media payload bytes')
+    parser.add_argument('--rate', type=float, default=10.0, help='Frames/sec per sender')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of sending')
+    parser.add_argument('--drain', type=float, default=1.0, help='Seconds to keep reading afterwards')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Client processes')
+    parser.add_argument('--protocol', type=int, choices=(1, 2), default=protocols.PROTOCOL_VERSION,
+                        help='Wire protocol the clients request at JOIN')
+    parser.add_argument('--server-pid', type=int, default=None, help='Report CPU used by this server process')
+    parser.add_argument('--spawn-server', action='store_true', help='Start a ConnectionManager for the run')
+    parser.add_argument('--loops', type=int, default=1, help='Event loops for --spawn-server')
+    parser.add_argument('--workers', type=int, default=1, help='Workers for --spawn-server')
+    parser.add_argument('--queue-depth', type=int, default=256, help='Send queue depth for --spawn-server')
+    parser.add_argument('--rate-limits', action='store_true',
+                        help='Keep the default rate limits on --spawn-server (off, so loss measures the relay)')
+    parser.add_argument('--nodes', type=int, default=1, help='Cluster nodes on ports PORT..PORT+N-1')
+    parser.add_argument('--cluster-port', type=int, default=7000,
+                        help='First inter-node link port for --spawn-server --nodes')
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn_server:
+        # Not a daemon: with --workers the server forks children of its own
+        server = multiprocessing.Process(target=_serve, args=(args,))
+        server.start()
+        args.server_pid = server.pid
+        time.sleep(1.0)
+
+    processes = max(1, min(args.processes, args.clients))
+    barrier = multiprocessing.Barrier(processes + 1)
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_run_process,
+                                args=(list(range(p, args.clients, processes)), args, barrier, results))
+        for p in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    cpu_start = _cpu_seconds(args.server_pid) if args.server_pid else None
+    wall_start = time.monotonic()
+
+    totals = {'sent': 0, 'send_skipped': 0, 'received': 0, 'received_bytes': 0,
+              'gaps': 0, 'closed': 0, 'senders': 0}
+    latencies = array('d')
+    cpu_used = wall = 0.0
+    for received in range(len(workers)):
+        result = results.get()
+        if received == 0:
+            # Every process stops at the same time, so the run is over
+            wall = time.monotonic() - wall_start
+            if cpu_start is not None:
+                cpu_used = _cpu_seconds(args.server_pid) - cpu_start
+        chunk = array('d')
+        chunk.frombytes(result.pop('latencies'))
+        latencies.extend(chunk)
+        for key in totals:
+            totals[key] += result[key]
+    for worker in workers:
+        worker.join()
+    if server is not None:
+        # SIGINT lets run_workers shut its children down too
+        os.kill(server.pid, signal.SIGINT)
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
+
+    rooms = -(-args.clients // args.room_size)
+    senders_per_room = args.room_size if args.senders is None else min(args.senders, args.room_size)
+    expected = totals['sent'] * (args.room_size - 1)
+    ordered = sorted(latencies)
+    print(f"clients={args.clients} rooms={rooms} room_size={args.room_size} "
+          f"senders/room={senders_per_room} frame={args.frame_size}B rate={args.rate}/s "
+          f"protocol=v{args.protocol} processes={processes}")
+    print(f"sent        {totals['sent']:>10} ({totals['sent'] / args.duration:,.0f} msg/s, "
+          f"{totals['send_skipped']} skipped while the socket was full)")
+    print(f"delivered   {totals['received']:>10} ({totals['received'] / args.duration:,.0f} msg/s, "
+          f"{totals['received_bytes'] / args.duration / 1e6:,.1f} MB/s)")
+    if expected:
+        print(f"drops       {totals['gaps']:>10} seq gaps, "
+              f"{max(0, expected - totals['received'])} short of {expected} expected "
+              f"({max(0, expected - totals['received']) / expected:.2%})")
+    print("latency ms  " + "  ".join(
+        f"p{label}={_percentile(ordered, q) * 1000:.2f}"
+        for label, q in (('50', 0.5), ('90', 0.9), ('99', 0.99), ('99.9', 0.999))
+    ) + (f"  max={ordered[-1] * 1000:.2f}" if ordered else ""))
+    if totals['closed']:
+        print(f"closed      {totals['closed']:>10} connections dropped by the server")
+    if cpu_start is not None:
+        print(f"server cpu  {cpu_used:.2f}s over {wall:.2f}s ({cpu_used / wall:.0%} of one core)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,7 @@
 import argparse
-import socket
-import ssl
-import struct
 import threading
 import time
 from queue import Queue
-from typing import Optional, Callable
 
 import pyaudio
 import numpy as np
@@ -14,7 +10,9 @@ from PIL import Image, ImageTk
 import tkinter as tk
 from tkinter import ttk
 
-from shared import protocols, ssl_utils
+from client.async_network_handler import AsyncNetworkHandler
+from client.simulcast import SimulcastEncoder
+from shared import protocols
 
 
 class AudioHandler:
@@ -67,6 +65,8 @@ class VideoHandler:
     def __init__(self):
         self.cap = cv2.VideoCapture(0)
         self.frame_queue = Queue(maxsize=10)
+        # Most recent capture, for the publisher; the queue feeds the local preview
+        self.latest = None
         self.running = False
         self.width = 640
         self.height = 480
@@ -81,6 +81,7 @@ class VideoHandler:
         while self.running:
             ret, frame = self.cap.read()
             if ret:
+                self.latest = frame
                 if self.frame_queue.full():
                     self.frame_queue.get()
                 self.frame_queue.put(frame)
@@ -93,83 +94,15 @@ class VideoHandler:
         self.cap.release()
 
 
-class NetworkHandler:
-    def __init__(self, host: str, port: int, certfile: str):
-        self.host = host
-        self.port = port
-        self.certfile = certfile
-        self.socket: Optional[socket.socket] = None
-        self.ssl_socket: Optional[ssl.SSLSocket] = None
-        self.running = False
-        self.message_callback: Optional[Callable] = None
-
-    def connect(self):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        ssl_context = ssl_utils.create_ssl_context(
-            self.certfile, '../ssl/key.pem', server_side=False
-        )
-        try:
-            self.socket.connect((self.host, self.port))
-            self.ssl_socket = ssl_utils.wrap_socket(self.socket, ssl_context)
-            self.running = True
-            return True
-        except Exception as e:
-            print(f"Connection failed: {e}")
-            return False
-
-    def start_receiving(self, callback: Callable):
-        self.message_callback = callback
-        threading.Thread(target=self._receive_loop, daemon=True).start()
-
-    def _receive_loop(self):
-        try:
-            while self.running and self.ssl_socket:
-                header = self.ssl_socket.recv(protocols.Protocol.HEADER_SIZE)
-                if not header:
-                    break
-                msg_length = struct.unpack('!I', header)[0]
-                data = self.ssl_socket.recv(msg_length)
-                if not data:
-                    break
-                message = protocols.Protocol.decode_message(data)
-                if self.message_callback:
-                    self.message_callback(message)
-        except (ConnectionResetError, BrokenPipeError):
-            print("Disconnected from server")
-        except Exception as e:
-            print(f"Error receiving data: {e}")
-        finally:
-            self.disconnect()
-
-    def send_message(self, message: dict):
-        if self.ssl_socket and self.running:
-            try:
-                self.ssl_socket.sendall(protocols.Protocol.encode_message(message))
-            except Exception as e:
-                print(f"Failed to send message: {e}")
-                self.disconnect()
-
-    def disconnect(self):
-        self.running = False
-        if self.ssl_socket:
-            try:
-                self.ssl_socket.close()
-            except:
-                pass
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
-
-
 class VideoCallApp:
-    def __init__(self, root, username, server_host, server_port, certfile):
+    def __init__(self, root, username, server_host, server_port, certfile, simulcast=False):
         self.root = root
         self.username = username
+        self.simulcast = simulcast
         self.video = VideoHandler()
         self.audio = AudioHandler()
-        self.network = NetworkHandler(server_host, server_port, certfile)
+        # Sends never block, so a congested uplink can't freeze the Tk thread
+        self.network = AsyncNetworkHandler(server_host, server_port, certfile)
         self.connected = False
 
         self.setup_ui()
@@ -209,10 +142,14 @@ class VideoCallApp:
             self.network.send_message({
                 'type': 'JOIN',
                 'username': self.username,
-                'room': 'default'
+                'room': 'default',
+                'protocol': protocols.PROTOCOL_VERSION
             })
             self.network.start_receiving(self.handle_network_message)
-            self.start_dummy_media()
+            if self.simulcast:
+                self.start_simulcast()
+            else:
+                self.start_dummy_media()
         else:
             print("Failed to connect to server")
 
@@ -239,17 +176,29 @@ class VideoCallApp:
     def start_dummy_media(self):
         def send_dummy():
             while self.connected:
-                media_msg = {
-                    'type': 'MEDIA',
-                    'from': self.username,
-                    'data': 'dummy_frame_data',
-                    'timestamp': time.time()
-                }
-                self.network.send_message(media_msg)
+                # Skip the frame rather than queue it behind a backed-up uplink
+                if not self.network.congested:
+                    # Sized to the rate the receivers' feedback allows at 10 fps
+                    size = self.network.rate_controller.frame_bytes(10)
+                    self.network.send_media(bytes(size), kind='video')
                 time.sleep(0.1)
 
         threading.Thread(target=send_dummy, daemon=True).start()
 
+    def start_simulcast(self):
+        """Publish the camera as simulcast layers; the server picks one per receiver"""
+        encoder = SimulcastEncoder()
+
+        def publish():
+            while self.connected:
+                frame = self.video.latest
+                if frame is not None:
+                    # Every JPEG layer is a keyframe. While congested only the lowest layer goes out
+                    self.network.send_simulcast(encoder.encode(frame), keyframe=True)
+                time.sleep(0.1)
+
+        threading.Thread(target=publish, daemon=True).start()
+
     def toggle_mute(self):
         pass  # TODO: Implement mute/unmute logic
 
@@ -264,7 +213,7 @@ class VideoCallApp:
             'type': 'LEAVE',
             'username': self.username
         })
-        time.sleep(0.5)
+        # Sends whatever is still queued (the LEAVE) before closing
         self.network.disconnect()
         self.root.destroy()
 
@@ -275,10 +224,12 @@ def main():
     parser.add_argument('--port', type=int, default=5000, help='Server port')
     parser.add_argument('--cert', default='../ssl/cert.pem', help='SSL certificate file')
     parser.add_argument('--username', required=True, help='Your username')
+    parser.add_argument('--simulcast', action='store_true',
+                        help='Publish the camera as simulcast layers instead of dummy frames')
     args = parser.parse_args()
 
     root = tk.Tk()
-    app = VideoCallApp(root, args.username, args.host, args.port, args.cert)
+    app = VideoCallApp(root, args.username, args.host, args.port, args.cert, simulcast=args.simulcast)
     root.mainloop()
 
 
@@ -0,0 +1,388 @@
+"""asyncio transport for the client, with sends that never block
+
+NetworkHandler sends with a blocking sendall on whichever thread calls it,
+so a congested uplink stalls the Tk thread or the media thread.
+AsyncNetworkHandler has the same surface (connect, start_receiving,
+send_message, send_media, ...). I/O runs on an asyncio loop on its own
+thread. A send only queues the bytes and wakes the loop, which hands
+everything queued to the TLS transport in one write. That write is one
+batch of records, as CoalescingWriter would make it.
+
+Backpressure is the transport's write buffer:
+  - Above HIGH_WATER the connection is congested until the buffer drains
+    below LOW_WATER.
+  - While congested, send_media drops video frames and send_simulcast
+    sends only the lowest layer.
+  - Audio is dropped only past MAX_BUFFERED.
+  - Control messages are always queued, as in the server's SendQueue.
+Producers can read congested or pressure before encoding a frame, or
+block in wait_writable().
+"""
+import asyncio
+import concurrent.futures
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+from client.network_handler import NetworkHandler, RECONNECT_DELAY, MAX_RECONNECT_DELAY
+from shared import protocols, ssl_utils
+from shared.framing import FrameReader
+from shared.log import get_logger
+
+log = get_logger('client.network')
+
+# Transport write buffer limits; ~0.5s of video at the default start bitrate
+HIGH_WATER = 64 * 1024
+LOW_WATER = 16 * 1024
+# Past this even audio is dropped
+MAX_BUFFERED = 4 * HIGH_WATER
+CONNECT_TIMEOUT = 10.0
+# How long disconnect() waits for queued data (a LEAVE, say) to go out
+CLOSE_TIMEOUT = 2.0
+
+
+class _ServerProtocol(asyncio.Protocol):
+    """Feeds one TLS connection's bytes to the handler; runs on the loop thread"""
+
+    def __init__(self, handler: 'AsyncNetworkHandler'):
+        self.handler = handler
+        self.reader = FrameReader()
+        self.transport: Optional[asyncio.Transport] = None
+        self.closed = handler.loop.create_future()
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(HIGH_WATER, LOW_WATER)
+        # Nothing is read until there is a callback for it, as with the thread
+        if self.handler.message_callback is None:
+            transport.pause_reading()
+
+    def data_received(self, data: bytes):
+        self.reader.feed(data)
+        try:
+            for frame in self.reader.frames():
+                self.handler._handle_frame(frame)
+        except Exception as e:
+            log.error("Error receiving data: %s", e)
+            self.transport.abort()
+
+    def pause_writing(self):
+        self.handler.writable.clear()
+
+    def resume_writing(self):
+        self.handler.writable.set()
+
+    def connection_lost(self, exc: Optional[Exception]):
+        if not self.closed.done():
+            self.closed.set_result(None)
+        self.handler._on_connection_lost(self, exc)
+
+
+class _MediaProtocol(asyncio.DatagramProtocol):
+    def __init__(self, handler: 'AsyncNetworkHandler'):
+        self.handler = handler
+
+    def datagram_received(self, data: bytes, addr):
+        self.handler._handle_datagram(memoryview(data))
+
+    def error_received(self, exc: Exception):
+        # ICMP unreachable and the like; _bind_udp gives up on its own
+        log.debug("UDP media error: %s", exc)
+
+
+class AsyncNetworkHandler(NetworkHandler):
+    """NetworkHandler on an asyncio loop thread; thread-safe, and no call but
+    connect() and disconnect() ever blocks
+
+    Callbacks run on the loop thread, as they ran on the receive thread.
+    TLS sessions are cached but not resumed, because asyncio cannot offer a
+    saved session. A dropped connection still resumes the server-side
+    session with its token.
+    """
+
+    def __init__(self, host: str, port: int, certfile: str, keyfile: Optional[str] = None):
+        super().__init__(host, port, certfile, keyfile)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._connection: Optional[_ServerProtocol] = None
+        self._udp_transport: Optional[asyncio.DatagramTransport] = None
+        # Written by any thread, handed to the transport on the loop thread
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._drain_scheduled = False
+        self._lock = threading.Lock()
+        # Clear while the transport's buffer is over HIGH_WATER
+        self.writable = threading.Event()
+        self.media_dropped: Dict[str, int] = {kind: 0 for kind in protocols.MEDIA_TYPES}
+        # messages queued and the transport writes they went out in
+        self.messages = 0
+        self.writes = 0
+
+    # --- Loop thread ---
+
+    def _start_loop(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='client-network', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        loop = self.loop
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    def _in_loop(self) -> bool:
+        return self._thread is not None and threading.get_ident() == self._thread.ident
+
+    # --- Connection ---
+
+    def connect(self):
+        """Establish connection to server; blocks until connected or failed
+
+        Must not be called from a callback, which runs on the loop thread.
+        """
+        self._closing = False
+        self._start_loop()
+        return asyncio.run_coroutine_threadsafe(self._open_async(), self.loop).result()
+
+    async def _open_async(self) -> bool:
+        ssl_context = ssl_utils.create_ssl_context(self.certfile, self.keyfile, server_side=False)
+        try:
+            _, connection = await asyncio.wait_for(self.loop.create_connection(
+                lambda: _ServerProtocol(self), self.host, self.port, ssl=ssl_context, server_hostname=''
+            ), CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            log.warning("Connection failed: %s", e)
+            return False
+        self._connection = connection
+        self.ssl_socket = connection.transport.get_extra_info('ssl_object')
+        self.session_reused = self.ssl_socket.session_reused
+        self.writable.set()
+        self.running = True
+        return True
+
+    def start_receiving(self, callback: Callable):
+        """Deliver messages to callback, on the loop thread"""
+        self.message_callback = callback
+        self.loop.call_soon_threadsafe(self._resume_reading)
+
+    def _resume_reading(self):
+        connection = self._connection
+        if connection is not None and not connection.transport.is_closing():
+            connection.transport.resume_reading()
+
+    def _on_connection_lost(self, connection: _ServerProtocol, exc: Optional[Exception]):
+        if connection is not self._connection:
+            return
+        self._connection = None
+        # Producers waiting for room would otherwise wait out their timeout
+        self.writable.set()
+        if exc is not None:
+            log.info("Disconnected from server: %s", exc)
+        else:
+            log.info("Disconnected from server")
+        if self._closing:
+            return
+        if self.session_token is not None:
+            self.loop.create_task(self._resume_async())
+        else:
+            self._shut_down()
+
+    async def _resume_async(self):
+        """Reconnect and ask the server to re-attach the session; RESUME_ACK says if it did"""
+        self._close_udp()
+        deadline = time.monotonic() + self.resume_grace
+        delay = RECONNECT_DELAY
+        while not self._closing and time.monotonic() < deadline:
+            if await self._open_async():
+                log.info("Reconnected, resuming session")
+                self.send_message({
+                    'type': 'RESUME', 'token': self.session_token,
+                    'protocol': self._join_message.get('protocol', protocols.PROTOCOL_V1),
+                }, flush=True)
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        self._shut_down()
+
+    def _shut_down(self):
+        """The connection is gone for good; the loop keeps running until disconnect()"""
+        self._closing = True
+        self.running = False
+        self._close_udp()
+
+    def disconnect(self):
+        """Close the connection for good, sending whatever is queued first"""
+        self._closing = True
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            self.running = False
+            return
+        if self._in_loop():
+            loop.create_task(self._close_async()).add_done_callback(lambda _: loop.stop())
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_async(), loop).result(CLOSE_TIMEOUT + 1)
+        except (concurrent.futures.TimeoutError, RuntimeError):
+            pass
+        try:
+            loop.call_soon_threadsafe(loop.stop)
+        except RuntimeError:
+            # Already closed
+            pass
+        self._thread.join(CLOSE_TIMEOUT)
+
+    async def _close_async(self):
+        self._drain()
+        self.running = False
+        self._close_udp()
+        connection = self._connection
+        if connection is None:
+            return
+        ssl_utils.SESSION_CACHE.save(self.session_key, self.ssl_socket)
+        # close() sends what is buffered before the TLS shutdown
+        connection.transport.close()
+        try:
+            await asyncio.wait_for(asyncio.shield(connection.closed), CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            connection.transport.abort()
+
+    # --- UDP media ---
+
+    def _start_udp(self, port: int, token: int):
+        self.loop.create_task(self._open_udp(port, token))
+
+    async def _open_udp(self, port: int, token: int):
+        # A plain non-blocking socket, so producer threads can send on it directly
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            sock.connect((self.host, port))
+            self._udp_transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: _MediaProtocol(self), sock=sock)
+        except OSError as e:
+            sock.close()
+            log.warning("UDP media endpoint unreachable (%s), staying on TCP", e)
+            return
+        self.udp_socket = sock
+        await self._bind_udp_async(token)
+
+    async def _bind_udp_async(self, token: int):
+        """Resend the bind datagram until the server echoes it"""
+        bind = protocols.Protocol.encode_bind(self.stream_id, token)
+        for _ in range(10):
+            if not self.running or self._udp_transport is None:
+                return
+            self._udp_transport.sendto(bind)
+            await asyncio.sleep(0.2)
+            if self.udp_ready.is_set():
+                return
+        log.warning("UDP media endpoint unreachable, staying on TCP")
+
+    def _close_udp(self):
+        # udp_socket is left as is: a producer mid-send gets OSError and falls back to TLS
+        self.udp_ready.clear()
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+            self._udp_transport = None
+
+    # --- Sending ---
+
+    def _send(self, *parts: bytes, flush: bool = False):
+        """Queue one message for the loop; flush is implied, the loop writes on its next pass
+
+        All parts go in under one lock hold, so a media header and its
+        payload are never split by another thread's message.
+        """
+        if not self.running:
+            return
+        with self._lock:
+            self._pending.extend(parts)
+            for part in parts:
+                self._pending_bytes += len(part)
+            self.messages += 1
+            if self._drain_scheduled:
+                return
+            self._drain_scheduled = True
+        try:
+            self.loop.call_soon_threadsafe(self._drain)
+        except RuntimeError:
+            # The loop closed under us; disconnect() has already run
+            pass
+
+    def _drain(self):
+        """Hand everything queued to the transport as one write"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._pending_bytes = 0
+            self._drain_scheduled = False
+        connection = self._connection
+        if not pending or connection is None or connection.transport.is_closing():
+            return
+        connection.transport.write(pending[0] if len(pending) == 1 else b''.join(pending))
+        self.writes += 1
+
+    def flush(self):
+        """Queued messages go out on the loop's next pass anyway"""
+
+    @property
+    def buffered(self) -> int:
+        """Bytes queued here or in the transport, not yet sent"""
+        connection = self._connection
+        transport_bytes = connection.transport.get_write_buffer_size() if connection is not None else 0
+        return self._pending_bytes + transport_bytes
+
+    @property
+    def congested(self) -> bool:
+        return not self.writable.is_set() or self._pending_bytes >= HIGH_WATER
+
+    @property
+    def pressure(self) -> float:
+        """buffered as a fraction of HIGH_WATER; above 1.0 video is being dropped"""
+        return self.buffered / HIGH_WATER
+
+    def wait_writable(self, timeout: Optional[float] = None) -> bool:
+        """Block until the connection is no longer congested; False on timeout"""
+        return self.writable.wait(timeout) and self._pending_bytes < HIGH_WATER
+
+    def _admit(self, kind: str) -> bool:
+        if kind == 'audio':
+            admitted = self.buffered < MAX_BUFFERED
+        else:
+            admitted = not self.congested
+        if not admitted:
+            self.media_dropped[kind] += 1
+        return admitted
+
+    def send_media(self, payload: bytes, kind: str = 'video', timestamp: Optional[float] = None) -> bool:
+        """Send one media frame; False if it was dropped because the uplink is backed up
+
+        Frames sent over UDP skip the TLS buffer, so they are never dropped here.
+        """
+        if not self.udp_ready.is_set() and not self._admit(kind):
+            return False
+        super().send_media(payload, kind, timestamp)
+        return True
+
+    def send_simulcast(self, layers: Sequence[bytes], kind: str = 'video',
+                       timestamp: Optional[float] = None, keyframe: bool = True) -> int:
+        """Send the layers of one capture; returns how many went out
+
+        While congested only the lowest layer is sent. The server moves
+        subscribers down to it on its next keyframe.
+        """
+        if not self.udp_ready.is_set() and self.congested:
+            if self.buffered >= MAX_BUFFERED or not layers:
+                self.media_dropped[kind] += 1
+                return 0
+            layers = layers[:1]
+        super().send_simulcast(layers, kind, timestamp, keyframe)
+        return len(layers)
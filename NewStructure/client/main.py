@@ -1,97 +1,18 @@
-# from network_handler import NetworkHandler
 import argparse
 import threading
 import time
+from client.async_network_handler import AsyncNetworkHandler
+from client.network_handler import NetworkHandler
+from shared import log, protocols
 
-import socket
-import selectors
-import threading
-from typing import Optional, Callable
-from shared import protocols, ssl_utils
-
-class NetworkHandler:
-    def __init__(self, host: str, port: int, certfile: str):
-        self.host = host
-        self.port = port
-        self.certfile = certfile
-        
-        self.socket: Optional[socket.socket] = None
-        self.ssl_socket: Optional[ssl.SSLSocket] = None
-        self.running = False
-        self.message_callback: Optional[Callable] = None
-        
-    def connect(self):
-        """Establish connection to server"""
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        ssl_context = ssl_utils.create_ssl_context(self.certfile, '../ssl/key.pem', server_side=False)
-        
-        try:
-            self.socket.connect((self.host, self.port))
-            self.ssl_socket = ssl_utils.wrap_socket(self.socket, ssl_context)
-            self.running = True
-            return True
-        except Exception as e:
-            print(f"Connection failed: {e}")
-            return False
-    
-    def start_receiving(self, callback: Callable):
-        """Start thread to receive messages"""
-        self.message_callback = callback
-        receive_thread = threading.Thread(target=self._receive_loop, daemon=True)
-        receive_thread.start()
-    
-    def _receive_loop(self):
-        """Continuously receive messages from server"""
-        try:
-            while self.running and self.ssl_socket:
-                # Read header first
-                header = self.ssl_socket.recv(protocols.Protocol.HEADER_SIZE)
-                if not header:
-                    break
-                
-                msg_length = struct.unpack('!I', header)[0]
-                data = self.ssl_socket.recv(msg_length)
-                
-                if not data:
-                    break
-                    
-                message = protocols.Protocol.decode_message(data)
-                if self.message_callback:
-                    self.message_callback(message)
-                    
-        except (ConnectionResetError, BrokenPipeError):
-            print("Disconnected from server")
-        except Exception as e:
-            print(f"Error receiving data: {e}")
-        finally:
-            self.disconnect()
-    
-    def send_message(self, message: dict):
-        """Send a message to the server"""
-        if self.ssl_socket and self.running:
-            try:
-                self.ssl_socket.sendall(protocols.Protocol.encode_message(message))
-            except Exception as e:
-                print(f"Failed to send message: {e}")
-                self.disconnect()
-    
-    def disconnect(self):
-        """Close the connection"""
-        self.running = False
-        if self.ssl_socket:
-            try:
-                self.ssl_socket.close()
-            except:
-                pass
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
+message_log = log.get_logger('client.messages')
+media_log = log.get_logger('client.media').sampled(1000)
 
 class VideoCallClient:
-    def __init__(self, server_host: str, server_port: int, certfile: str, username: str):
-        self.network = NetworkHandler(server_host, server_port, certfile)
+    def __init__(self, server_host: str, server_port: int, certfile: str, username: str,
+                 transport: str = 'thread'):
+        handler = AsyncNetworkHandler if transport == 'asyncio' else NetworkHandler
+        self.network = handler(server_host, server_port, certfile)
         self.username = username
         self.connected = False
         
@@ -107,7 +28,8 @@ class VideoCallClient:
         join_msg = {
             'type': 'JOIN',
             'username': self.username,
-            'room': 'default'
+            'room': 'default',
+            'protocol': protocols.PROTOCOL_VERSION
         }
         self.network.send_message(join_msg)
         
@@ -126,10 +48,13 @@ class VideoCallClient:
     def handle_message(self, message: dict):
         """Handle incoming messages from server"""
         msg_type = message.get('type')
-        print(f"Received message: {message}")
+        if msg_type == 'MEDIA':
+            media_log.debug("Received MEDIA from stream %s", message.get('stream'), kind=message.get('kind'))
+        else:
+            message_log.debug("Received message: %s", message)
         
         if msg_type == 'JOIN_ACK':
-            print("Successfully joined the room")
+            message_log.info("Successfully joined the room")
         elif msg_type == 'MEDIA':
             # Handle incoming media (would be processed by video/audio handlers)
             pass
@@ -138,13 +63,11 @@ class VideoCallClient:
         """Start sending dummy media for testing"""
         def send_dummy():
             while self.connected:
-                media_msg = {
-                    'type': 'MEDIA',
-                    'from': self.username,
-                    'data': 'dummy_frame_data',
-                    'timestamp': time.time()
-                }
-                self.network.send_message(media_msg)
+                # Skip the frame rather than queue it behind a backed-up uplink
+                if not self.network.congested:
+                    # Sized to the rate the receivers' feedback allows at 10 fps
+                    size = self.network.rate_controller.frame_bytes(10)
+                    self.network.send_media(bytes(size), kind='video')
                 time.sleep(0.1)
                 
         media_thread = threading.Thread(target=send_dummy, daemon=True)
@@ -169,14 +92,24 @@ def main():
     parser.add_argument('--port', type=int, default=5000, help='Server port')
     parser.add_argument('--cert', default='../ssl/cert.pem', help='SSL certificate file')
     parser.add_argument('--username', required=True, help='Your username')
+    parser.add_argument('--transport', choices=('thread', 'asyncio'), default='thread',
+                        help='Blocking sends with a receive thread, or non-blocking asyncio sends')
+    parser.add_argument('--log', default=None, metavar='LEVEL,PREFIX=LEVEL,...',
+                        help='Log levels per subsystem, e.g. info,client.messages=debug')
     
     args = parser.parse_args()
+    if args.log:
+        try:
+            log.configure(args.log)
+        except ValueError as e:
+            parser.error(str(e))
     
     client = VideoCallClient(
         server_host=args.host,
         server_port=args.port,
         certfile=args.cert,
-        username=args.username
+        username=args.username,
+        transport=args.transport
     )
     
     client.start()
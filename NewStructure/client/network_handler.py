@@ -1,78 +1,360 @@
 import socket
-import selectors
+import ssl
 import threading
-from typing import Optional, Callable
-from ..shared import protocols, ssl_utils
+import time
+from typing import Dict, Optional, Callable, Sequence
+from shared import protocols, ssl_utils
+from shared.congestion import BandwidthEstimator, RateController, FEEDBACK_INTERVAL
+from shared.coalesce import CoalescingWriter
+from shared.framing import FrameReader
+from shared.log import get_logger
+
+log = get_logger('client.network')
+
+# Backoff between reconnect attempts while resuming a session
+RECONNECT_DELAY = 0.25
+MAX_RECONNECT_DELAY = 4.0
 
 class NetworkHandler:
-    def __init__(self, host: str, port: int, certfile: str):
+    def __init__(self, host: str, port: int, certfile: str, keyfile: Optional[str] = None):
         self.host = host
         self.port = port
         self.certfile = certfile
+        self.keyfile = keyfile
         self.socket: Optional[socket.socket] = None
         self.ssl_socket: Optional[ssl.SSLSocket] = None
         self.running = False
         self.message_callback: Optional[Callable] = None
-        
+        # Negotiated in JOIN/JOIN_ACK; stays v1 until the server agrees
+        self.protocol = protocols.PROTOCOL_V1
+        self.stream_id = 0
+        self._media_seq: Dict[int, int] = {}
+        # Batches small control messages into fewer TLS records; set per connection
+        self.writer: Optional[CoalescingWriter] = None
+        # Sessions only resume with the context (and credentials) that made them
+        self.session_key = (host, port, certfile, keyfile)
+        self.session_reused = False
+        # Optional UDP media channel, set up by request_udp()
+        self.udp_socket: Optional[socket.socket] = None
+        self.udp_ready = threading.Event()
+        # Receive side: one bandwidth estimate per incoming stream, reported
+        # to its sender; send side: the target bitrate those reports set
+        self.estimators: Dict[int, BandwidthEstimator] = {}
+        self.estimators_lock = threading.Lock()
+        self._last_feedback = 0.0
+        self.rate_controller = RateController()
+        # Issued in JOIN_ACK; a dropped connection is resumed with it for resume_grace seconds
+        self.session_token: Optional[str] = None
+        self.resume_grace = 0.0
+        self._join_message: Optional[dict] = None
+        self._udp_wanted = False
+        # Set by disconnect(); anything else that ends the connection is a drop
+        self._closing = False
+
     def connect(self):
         """Establish connection to server"""
+        self._closing = False
+        return self._open()
+
+    def _open(self):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        ssl_context = ssl_utils.create_ssl_context(self.certfile, None, server_side=False)
-        
+        ssl_context = ssl_utils.create_ssl_context(self.certfile, self.keyfile, server_side=False)
+
         try:
             self.socket.connect((self.host, self.port))
-            self.ssl_socket = ssl_utils.wrap_socket(self.socket, ssl_context)
+            session = ssl_utils.SESSION_CACHE.get(self.session_key)
+            self.ssl_socket = ssl_utils.wrap_socket(self.socket, ssl_context, session=session)
+            self.session_reused = self.ssl_socket.session_reused
+            self.writer = CoalescingWriter(self.ssl_socket, on_error=self._on_send_error)
             self.running = True
             return True
         except Exception as e:
-            print(f"Connection failed: {e}")
+            log.warning("Connection failed: %s", e)
             return False
-    
+
     def start_receiving(self, callback: Callable):
         """Start thread to receive messages"""
         self.message_callback = callback
         receive_thread = threading.Thread(target=self._receive_loop, daemon=True)
         receive_thread.start()
-    
+
     def _receive_loop(self):
-        """Continuously receive messages from server"""
+        """Continuously receive messages from server, resuming the session after a drop"""
+        while self._receive() and self._resume():
+            pass
+        self.disconnect()
+
+    def _receive(self) -> bool:
+        """Read until the connection ends; True if it dropped rather than being closed"""
         try:
-            while self.running and self.ssl_socket:
-                # Read header first
-                header = self.ssl_socket.recv(protocols.Protocol.HEADER_SIZE)
-                if not header:
-                    break
-                
-                msg_length = struct.unpack('!I', header)[0]
-                data = self.ssl_socket.recv(msg_length)
-                
-                if not data:
-                    break
-                    
-                message = protocols.Protocol.decode_message(data)
-                if self.message_callback:
-                    self.message_callback(message)
-                    
+            reader = FrameReader(self.ssl_socket)
+            for frame in reader:
+                if not self.running:
+                    return False
+                self._handle_frame(frame)
+
         except (ConnectionResetError, BrokenPipeError):
-            print("Disconnected from server")
+            log.info("Disconnected from server")
         except Exception as e:
-            print(f"Error receiving data: {e}")
-        finally:
-            self.disconnect()
-    
-    def send_message(self, message: dict):
-        """Send a message to the server"""
-        if self.ssl_socket and self.running:
+            log.error("Error receiving data: %s", e)
+        return not self._closing
+
+    def _handle_frame(self, frame: memoryview):
+        """Act on one frame from the server, then pass it to the callback"""
+        if protocols.Protocol.is_media_frame(frame):
+            message = self._media_message(protocols.Protocol.decode_media(frame))
+            self._on_media(message, len(frame))
+        else:
+            message = protocols.Protocol.decode_frame(frame)
+            if message.get('type') == 'MEDIA':
+                self._on_media(message, len(frame))
+            elif message.get('type') == 'PING':
+                self.send_message({'type': 'PONG'}, flush=True)
+            elif message.get('type') == 'FEEDBACK' and 'from' in message:
+                self.rate_controller.on_feedback(message['from'], message.get('bitrate', 0))
+            elif message.get('type') == 'JOIN_ACK':
+                self.protocol = message.get('protocol', protocols.PROTOCOL_V1)
+                self.stream_id = message.get('stream_id', 0)
+                self.session_token = message.get('session')
+                self.resume_grace = message.get('resume_grace', 0.0)
+                # The TLS 1.3 ticket has arrived by now
+                ssl_utils.SESSION_CACHE.save(self.session_key, self.ssl_socket)
+            elif message.get('type') == 'RESUME_ACK':
+                self._on_resume_ack(message)
+            elif message.get('type') == 'MEDIA_ENDPOINT' and message.get('status') == 'success':
+                self._start_udp(message['port'], message['token'])
+
+        if self.message_callback:
+            self.message_callback(message)
+
+    def _resume(self) -> bool:
+        """Reconnect and ask the server to re-attach the session; RESUME_ACK says if it did"""
+        if self.session_token is None or self._closing:
+            return False
+        self._close_sockets()
+        deadline = time.monotonic() + self.resume_grace
+        delay = RECONNECT_DELAY
+        while not self._closing and time.monotonic() < deadline:
+            if self._open():
+                log.info("Reconnected, resuming session")
+                self.send_message({
+                    'type': 'RESUME', 'token': self.session_token,
+                    'protocol': self._join_message.get('protocol', protocols.PROTOCOL_V1),
+                }, flush=True)
+                return True
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        return False
+
+    def _on_resume_ack(self, message: dict):
+        if message.get('status') == 'success':
+            self.protocol = message.get('protocol', protocols.PROTOCOL_V1)
+            self.stream_id = message.get('stream_id', self.stream_id)
+            ssl_utils.SESSION_CACHE.save(self.session_key, self.ssl_socket)
+        else:
+            # The server no longer knows the session (restart, grace over): join afresh
+            self.session_token = None
+            self.send_message(self._join_message)
+        if self._udp_wanted:
+            self.request_udp()
+
+    def request_udp(self):
+        """Ask the server for a UDP media endpoint; call after JOIN
+
+        Media keeps flowing over TLS until the endpoint has been bound.
+        """
+        self._udp_wanted = True
+        self.send_message({'type': 'MEDIA_REGISTER', 'transport': 'udp'})
+
+    def _start_udp(self, port: int, token: int):
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.connect((self.host, port))
+        threading.Thread(target=self._bind_udp, args=(token,), daemon=True).start()
+        threading.Thread(target=self._udp_receive_loop, daemon=True).start()
+
+    def _bind_udp(self, token: int):
+        """Resend the bind datagram until the server echoes it"""
+        bind = protocols.Protocol.encode_bind(self.stream_id, token)
+        for _ in range(10):
+            if not self.running:
+                return
             try:
-                self.ssl_socket.sendall(protocols.Protocol.encode_message(message))
-            except Exception as e:
-                print(f"Failed to send message: {e}")
-                self.disconnect()
-    
+                self.udp_socket.send(bind)
+            except OSError:
+                return
+            if self.udp_ready.wait(0.2):
+                return
+        log.warning("UDP media endpoint unreachable, staying on TCP")
+
+    def _udp_receive_loop(self):
+        buf = bytearray(protocols.MAX_DATAGRAM + 1)
+        view = memoryview(buf)
+        while self.running:
+            try:
+                n = self.udp_socket.recv_into(buf)
+            except OSError:
+                break
+            self._handle_datagram(view[:n])
+
+    def _handle_datagram(self, datagram: memoryview):
+        """One datagram from the UDP media endpoint; strays are ignored"""
+        n = len(datagram)
+        if n < protocols.Protocol.MEDIA_HEADER_SIZE or datagram[0] != protocols.MEDIA_MAGIC:
+            return
+        if datagram[1] == protocols.MEDIA_BIND:
+            self.udp_ready.set()
+            return
+        try:
+            message = self._media_message(protocols.Protocol.decode_media(datagram))
+        except ValueError:
+            return
+        self._on_media(message, n)
+        if self.message_callback:
+            self.message_callback(message)
+
+    def _on_media(self, message: dict, size: int):
+        """Feed the stream's bandwidth estimator and report estimates periodically"""
+        stream_id = message.get('stream')
+        if not isinstance(stream_id, int):
+            return
+        now = time.monotonic()
+        with self.estimators_lock:
+            estimator = self.estimators.get(stream_id)
+            if estimator is None:
+                estimator = self.estimators[stream_id] = BandwidthEstimator()
+            estimator.on_packet(message.get('seq', 0), int(message.get('timestamp', 0) * 1e6), size, now)
+            if now - self._last_feedback < FEEDBACK_INTERVAL:
+                return
+            self._last_feedback = now
+            reports = [est.feedback(sid, now) for sid, est in self.estimators.items()]
+        for report in reports:
+            self.send_message(report)
+
+    @staticmethod
+    def _media_message(media: protocols.MediaFrame) -> dict:
+        """Present v2 media to callbacks in the same shape as v1 MEDIA"""
+        return {
+            'type': 'MEDIA',
+            'kind': protocols.MEDIA_KINDS.get(media.msg_type, 'video'),
+            'stream': media.stream_id,
+            'seq': media.seq,
+            'timestamp': media.timestamp_us / 1e6,
+            'layer': media.flags & protocols.FLAG_LAYER_MASK,
+            # The reader reuses its buffer, so callbacks get their own copy
+            'data': bytes(media.payload),
+        }
+
+    def send_message(self, message: dict, flush: bool = False):
+        """Send a message to the server
+
+        Messages are coalesced for up to a couple of milliseconds; pass
+        flush for one that should not wait, or call flush() after a burst.
+        """
+        if message.get('type') == 'JOIN':
+            # Replayed if a dropped session can't be resumed
+            self._join_message = message
+        self._send(protocols.Protocol.encode_message(message), flush=flush or message.get('type') == 'LEAVE')
+
+    def flush(self):
+        """Send any coalesced messages now"""
+        writer = self.writer
+        if writer is not None:
+            writer.flush()
+
+    @property
+    def congested(self) -> bool:
+        """Whether media producers should skip frames; blocking sends never queue"""
+        return False
+
+    def send_media(self, payload: bytes, kind: str = 'video', timestamp: Optional[float] = None):
+        """Send one media frame, as v2 binary when negotiated and JSON otherwise"""
+        seq, timestamp_us = self._next_media(timestamp)
+        self._send_media(payload, protocols.MEDIA_TYPES[kind], seq, timestamp_us)
+
+    def send_simulcast(self, layers: Sequence[bytes], kind: str = 'video',
+                       timestamp: Optional[float] = None, keyframe: bool = True):
+        """Send every layer of one capture (lowest quality first, e.g. from
+        SimulcastEncoder.encode); the server forwards each subscriber one layer
+
+        v1 has no layers, so only the top one is sent.
+        """
+        seq, timestamp_us = self._next_media(timestamp)
+        msg_type = protocols.MEDIA_TYPES[kind]
+        # The relay thins layers per receiver, so only the fastest one bounds us
+        self.rate_controller.simulcast = True
+        if self.protocol < protocols.PROTOCOL_V2:
+            self._send_media(layers[-1], msg_type, seq, timestamp_us)
+            return
+        flags = protocols.FLAG_SIMULCAST | (protocols.FLAG_KEYFRAME if keyframe else 0)
+        for layer, payload in enumerate(layers):
+            self._send_media(payload, msg_type, seq, timestamp_us, flags | layer)
+
+    def _next_media(self, timestamp: Optional[float]):
+        seq = self._media_seq.get(self.stream_id, 0)
+        self._media_seq[self.stream_id] = seq + 1
+        return seq, int((timestamp if timestamp is not None else time.time()) * 1e6)
+
+    def _send_media(self, payload: bytes, msg_type: int, seq: int, timestamp_us: int, flags: int = 0):
+        stream_id = self.stream_id
+        if self.protocol >= protocols.PROTOCOL_V2:
+            header = protocols.Protocol.encode_media_header(
+                msg_type, stream_id, seq, timestamp_us, len(payload), flags
+            )
+            if self.udp_ready.is_set() and len(header) + len(payload) <= protocols.MAX_DATAGRAM:
+                try:
+                    self.udp_socket.send(header + payload)
+                    return
+                except OSError:
+                    pass
+            # Media goes out at once, carrying any control messages buffered before it;
+            # header and payload are queued together so nothing lands between them
+            self._send(header, payload, flush=True)
+        else:
+            media = protocols.MediaFrame(msg_type, flags, stream_id, seq, timestamp_us,
+                                         memoryview(payload))
+            self._send(protocols.Protocol.encode_message(protocols.Protocol.media_to_message(media)),
+                       flush=True)
+
+    def _send(self, *parts: bytes, flush: bool = False):
+        """Queue one message, given in one or more parts"""
+        writer = self.writer
+        if writer is not None and self.running:
+            writer.write_many(parts, flush)
+
+    def _on_send_error(self, error: Exception):
+        log.error("Failed to send message: %s", error)
+        if self.message_callback is None:
+            self.disconnect()
+        else:
+            # The receive thread notices and resumes the session
+            self._close_sockets()
+
     def disconnect(self):
-        """Close the connection"""
+        """Close the connection for good"""
+        self._closing = True
+        writer = self.writer
+        if writer is not None and self.running:
+            # Anything still coalescing (a LEAVE, say) goes out first
+            writer.flush()
         self.running = False
+        self._close_sockets()
+
+    def _close_sockets(self):
+        self.udp_ready.clear()
+        if self.writer is not None:
+            self.writer.close(flush=False)
+        if self.udp_socket:
+            try:
+                self.udp_socket.close()
+            except OSError:
+                pass
         if self.ssl_socket:
+            ssl_utils.SESSION_CACHE.save(self.session_key, self.ssl_socket)
+            try:
+                # Wakes the receive thread and sends FIN; close() alone waits for its recv
+                self.ssl_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             try:
                 self.ssl_socket.close()
             except:
@@ -81,4 +363,4 @@ class NetworkHandler:
             try:
                 self.socket.close()
             except:
-                pass
\ No newline at end of file
+                pass
@@ -0,0 +1,63 @@
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+
+class LayerSpec(NamedTuple):
+    scale: float
+    quality: int
+
+
+# Lowest layer first; index in this tuple is the layer id on the wire
+DEFAULT_LAYERS = (
+    LayerSpec(0.25, 40),
+    LayerSpec(0.5, 60),
+    LayerSpec(1.0, 80),
+)
+
+LayerEncoder = Callable[[object, LayerSpec], bytes]
+
+
+class SimulcastEncoder:
+    """Encodes one captured frame into every simulcast layer
+
+    Each layer is scaled from the next larger one rather than from the
+    full capture, so only the top layer pays for a full-size resize. The
+    per-layer encoder is pluggable; jpeg_encoder (OpenCV) is the default.
+    """
+
+    def __init__(self, layers: Sequence[LayerSpec] = DEFAULT_LAYERS,
+                 encoder: Optional[LayerEncoder] = None, resize: Optional[Callable] = None):
+        if not 1 <= len(layers) <= 3:
+            raise ValueError("Simulcast needs 1 to 3 layers")
+        self.layers = tuple(layers)
+        if encoder is None:
+            encoder, resize = jpeg_encoder()
+        self.encoder = encoder
+        self.resize = resize
+
+    def encode(self, frame) -> List[bytes]:
+        """Encoded layers of frame, lowest quality first"""
+        encoded: List[bytes] = [b''] * len(self.layers)
+        image, image_scale = frame, 1.0
+        for index in range(len(self.layers) - 1, -1, -1):
+            spec = self.layers[index]
+            if self.resize is not None and spec.scale != image_scale:
+                image = self.resize(image, spec.scale / image_scale)
+                image_scale = spec.scale
+            encoded[index] = self.encoder(image, spec)
+        return encoded
+
+
+def jpeg_encoder():
+    """OpenCV JPEG encoder and resizer; OpenCV is only needed if this is used"""
+    import cv2
+
+    def encode(image, spec: LayerSpec) -> bytes:
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, spec.quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return buffer.tobytes()
+
+    def resize(image, factor: float):
+        return cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+    return encode, resize
@@ -0,0 +1,182 @@
+import hashlib
+import hmac
+import multiprocessing
+import os
+import socket
+import ssl
+import threading
+from typing import List, Sequence, Tuple
+from shared import ssl_utils
+from server.connection_manager import ConnectionManager
+from server.worker_mesh import PeerLink, WorkerMesh, _recv_exact
+from shared.log import get_logger
+
+log = get_logger('server.cluster')
+
+HANDSHAKE_TIMEOUT = 5.0
+# Keepalive probes notice a dead peer host within about a minute
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+NONCE_SIZE = 16
+
+
+def parse_members(spec: str) -> List[Tuple[str, int]]:
+    """'host:port,host:port,...' -> [(host, port), ...], in node index order"""
+    members = []
+    for item in spec.split(','):
+        host, _, port = item.strip().rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f"Bad cluster member {item!r}, expected HOST:PORT")
+        members.append((host, int(port)))
+    return members
+
+
+class ClusterCredentials:
+    """Proof that a peer holds the cluster certificate and key
+
+    Links are TLS like client connections, which skip chain validation
+    (the certificates are self-signed). Instead the dialer pins the
+    acceptor's certificate to its own, and the acceptor challenges the
+    dialer for an HMAC keyed by a digest of the private key.
+    """
+
+    def __init__(self, certfile: str, keyfile: str):
+        with open(certfile) as f:
+            self.certificate = ssl.PEM_cert_to_DER_cert(f.read())
+        with open(keyfile, 'rb') as f:
+            self.secret = hashlib.sha256(b'videocall-cluster\0' + f.read()).digest()
+
+    def sign(self, nonce: bytes) -> bytes:
+        return hmac.new(self.secret, nonce, hashlib.sha256).digest()
+
+    def accept(self, sock: ssl.SSLSocket):
+        nonce = os.urandom(NONCE_SIZE)
+        sock.sendall(nonce)
+        answer = _recv_exact(sock, hashlib.sha256().digest_size)
+        if answer is None or not hmac.compare_digest(bytes(answer), self.sign(nonce)):
+            raise ConnectionError("peer failed the cluster challenge")
+
+    def dial(self, sock: ssl.SSLSocket):
+        if sock.getpeercert(binary_form=True) != self.certificate:
+            raise ConnectionError("peer presented a different certificate")
+        nonce = _recv_exact(sock, NONCE_SIZE)
+        if nonce is None:
+            raise ConnectionError("peer closed during the cluster challenge")
+        sock.sendall(self.sign(bytes(nonce)))
+
+
+class ClusterMesh(WorkerMesh):
+    """WorkerMesh across server nodes over TLS-over-TCP links
+
+    Every node is started with the same member list and its own index in
+    it. Links, room announcements and routing are those of the worker
+    mesh, so a room can span nodes and a frame still crosses at most one
+    inter-node hop. Nodes may start in any order and restart: the
+    higher-numbered side of each pair keeps redialing the lower one, and
+    room membership is re-announced whenever a link comes up.
+    """
+
+    def __init__(self, index: int, members: Sequence[Tuple[str, int]], certfile: str, keyfile: str):
+        super().__init__(index, len(members), socket_dir='')
+        if not 0 <= index < len(members):
+            raise ValueError(f"Node index {index} is not in the {len(members)}-member cluster")
+        if len(members) > 256:
+            raise ValueError("A cluster has at most 256 nodes (stream ids carry the node index)")
+        self.members = list(members)
+        self.credentials = ClusterCredentials(certfile, keyfile)
+        self.server_context = ssl_utils.new_ssl_context(certfile, keyfile, server_side=True)
+        self.client_context = ssl_utils.new_ssl_context(certfile, None, server_side=False)
+
+    @property
+    def port_offset(self) -> int:
+        # Nodes normally have a host each; run_local_cluster offsets ports itself
+        return 0
+
+    def start(self, manager):
+        self.manager = manager
+        listener = self._listen()
+        threading.Thread(target=self._accept_loop, args=(listener,), daemon=True).start()
+        # Peers may not be up yet; keep dialing in the background
+        for peer in range(self.index):
+            threading.Thread(target=self._connect, args=(peer, None), daemon=True).start()
+        host, port = self.members[self.index]
+        log.info("Cluster node %d linking on %s:%d (%d nodes)", self.index, host, port, len(self.members))
+
+    def _listen(self) -> socket.socket:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(self.members[self.index])
+        listener.listen(len(self.members))
+        return listener
+
+    def _dial(self, peer: int) -> socket.socket:
+        return socket.create_connection(self.members[peer], timeout=HANDSHAKE_TIMEOUT)
+
+    def _secure(self, sock: socket.socket, server_side: bool) -> socket.socket:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _set_keepalive(sock)
+        sock.settimeout(HANDSHAKE_TIMEOUT)
+        try:
+            if server_side:
+                secure = self.server_context.wrap_socket(sock, server_side=True)
+                self.credentials.accept(secure)
+            else:
+                secure = self.client_context.wrap_socket(sock)
+                self.credentials.dial(secure)
+        except OSError:
+            sock.close()
+            raise
+        secure.settimeout(None)
+        return secure
+
+    def _link_lost(self, link: PeerLink):
+        # The dialing side of the pair re-establishes the link
+        if link.peer_index < self.index and not any(
+                other.peer_index == link.peer_index for other in self.links):
+            threading.Thread(target=self._connect, args=(link.peer_index, None), daemon=True).start()
+
+
+def _set_keepalive(sock: socket.socket):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+def run_local_cluster(nodes: int, link_port: int, **manager_kwargs):
+    """Run a whole cluster on this machine, one process per node
+
+    Node i serves clients on port + i (and udp/metrics ports + i) and links
+    to the others over loopback, so multi-node rooms can be tested without
+    any broker or second host.
+    """
+    members = [('127.0.0.1', link_port + i) for i in range(nodes)]
+    processes = [
+        multiprocessing.Process(target=_node_main, args=(index, members, manager_kwargs),
+                                name=f"node-{index}")
+        for index in range(nodes)
+    ]
+    for process in processes:
+        process.start()
+    log.info("Started %d-node local cluster on ports %d-%d", nodes, manager_kwargs['port'],
+             manager_kwargs['port'] + nodes - 1)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        log.info("Shutting down cluster...")
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+def _node_main(index: int, members: List[Tuple[str, int]], manager_kwargs: dict):
+    kwargs = dict(manager_kwargs, port=manager_kwargs['port'] + index)
+    for key in ('udp_port', 'metrics_port'):
+        if kwargs.get(key) is not None:
+            kwargs[key] += index
+    mesh = ClusterMesh(index, members, kwargs['certfile'], kwargs['keyfile'])
+    ConnectionManager(mesh=mesh, **kwargs).start()
@@ -0,0 +1,305 @@
+import selectors
+import ssl
+import time
+from typing import Dict, Optional
+from shared import protocols
+from shared.framing import FrameReader
+from server.rate_limit import ClientLimits
+from server.send_queue import SendQueue, PRIORITY_CONTROL
+from server.simulcast import DrainMeter, LayerSelector
+from shared.log import get_logger
+
+log = get_logger('server.connection')
+
+# One TLS record; the reader grows past this only for larger frames
+READ_BUFFER_SIZE = 16 * 1024
+# Queued messages are written together up to one TLS record
+COALESCE_BYTES = 16 * 1024
+
+_PING = protocols.Protocol.create_control_message('PING')
+
+
+class Connection:
+    """Non-blocking TLS client connection owned by a single EventLoop"""
+
+    def __init__(self, sock: ssl.SSLSocket, addr: tuple, loop, manager,
+                 send_queue: Optional[SendQueue] = None, handshake_timeout: Optional[float] = None,
+                 heartbeat_interval: Optional[float] = None, idle_timeout: Optional[float] = None,
+                 limits: Optional[ClientLimits] = None):
+        self.sock = sock
+        self.addr = addr
+        self.loop = loop
+        self.manager = manager
+        self.username: Optional[str] = None
+        # Wire version agreed at JOIN; v1 peers get v2 media transcoded to JSON
+        self.protocol = protocols.PROTOCOL_V1
+        self.stream_id: Optional[int] = None
+        # Bound by a MEDIA_BIND datagram once the client has a UDP endpoint
+        self.udp_addr: Optional[tuple] = None
+        self.closed = False
+        self.reader = FrameReader(sock, buffer_size=READ_BUFFER_SIZE)
+        self.send_queue = send_queue or SendQueue()
+        # Messages currently being written (one send's worth); never dropped once started
+        self._sending: Optional[memoryview] = None
+        self._sending_count = 0
+        self._events = selectors.EVENT_READ
+        # Over its control limit the client is not read from until it is back in budget
+        self.limits = limits or ClientLimits()
+        self.reading_paused = False
+        self._resume_timer = None
+        # With a timeout the TLS handshake is still to be driven by the loop
+        self.handshaking = handshake_timeout is not None
+        self.handshake_timeout = handshake_timeout
+        self.accepted_at = time.perf_counter()
+        self._handshake_timer = None
+        # Silent for heartbeat_interval gets a PING; silent for idle_timeout is closed
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self._idle_timer = None
+        # Issued at JOIN when resumable; a closed connection buffers control for it
+        self.session = None
+        # Traffic counters, read by the metrics collector at scrape time
+        self.msgs_in = 0
+        self.bytes_in = 0
+        self.msgs_out = 0
+        self.bytes_out = 0
+        self.sends_out = 0
+        self.frame_received_at = 0.0
+        # Drain rate decides which simulcast layer this client is sent
+        self.drain = DrainMeter()
+        self.layers = LayerSelector(self.drain)
+
+    def attach(self):
+        """Register with the owning loop; must run on the loop thread"""
+        self.loop.register(self.sock, self._events, self)
+        if self.handshaking:
+            self._handshake_timer = self.loop.call_after(self.handshake_timeout, self._handshake_expired)
+            # The ClientHello has usually arrived already
+            self._do_handshake()
+        else:
+            self._start_heartbeat()
+
+    def handle_events(self, mask: int):
+        if self.handshaking:
+            self._do_handshake()
+            return
+        if mask & selectors.EVENT_READ and not self.reading_paused:
+            self._on_readable()
+        if mask & selectors.EVENT_WRITE and not self.closed:
+            self._flush()
+
+    def _do_handshake(self):
+        """Advance the TLS handshake without blocking the loop"""
+        try:
+            self.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            self._set_events(selectors.EVENT_READ)
+            return
+        except ssl.SSLWantWriteError:
+            self._set_events(selectors.EVENT_WRITE)
+            return
+        except (ssl.SSLError, OSError) as e:
+            log.warning("TLS handshake with %s failed: %s", self.addr, e)
+            self.manager.on_handshake_failed(self)
+            self.close()
+            return
+        self.handshaking = False
+        self._handshake_timer.cancel()
+        self.manager.on_handshake_complete(self, time.perf_counter() - self.accepted_at)
+        self._start_heartbeat()
+        self._flush()
+        if not self.closed and self.sock.pending():
+            self._on_readable()
+
+    def _handshake_expired(self):
+        if self.handshaking and not self.closed:
+            log.warning("TLS handshake with %s timed out", self.addr)
+            self.manager.on_handshake_failed(self)
+            self.close()
+
+    def _start_heartbeat(self):
+        if self.idle_timeout is not None:
+            self._idle_timer = self.loop.call_after(self.heartbeat_interval or self.idle_timeout,
+                                                    self._check_idle)
+
+    def _check_idle(self):
+        """Wheel callback; traffic only updates frame_received_at, never the timer"""
+        if self.closed:
+            return
+        idle = time.perf_counter() - max(self.frame_received_at, self.accepted_at)
+        if idle >= self.idle_timeout:
+            log.info("Client %s silent for %.1fs, closing", self.label(), idle)
+            self.manager.on_idle_timeout(self)
+            self.close()
+            return
+        interval = self.heartbeat_interval or self.idle_timeout
+        if idle >= interval:
+            self.send(_PING)
+            delay = min(interval, self.idle_timeout - idle)
+        else:
+            delay = min(interval, self.idle_timeout) - idle
+        self._idle_timer = self.loop.call_after(delay, self._check_idle)
+
+    def _on_readable(self):
+        try:
+            while True:
+                if self.reader.fill() == 0:
+                    self.close()
+                    return
+                self._dispatch_frames()
+                # TLS may hold decrypted bytes the selector can't see
+                if self.closed or self.reading_paused or not self.sock.pending():
+                    break
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError, BlockingIOError):
+            pass
+        except ValueError as e:
+            log.error("Error with client %s: %s", self.addr, e)
+            self.close()
+        except (ConnectionResetError, BrokenPipeError, ssl.SSLError, OSError):
+            log.info("Client %s disconnected abruptly", self.addr)
+            self.close()
+
+    def _dispatch_frames(self):
+        manager = self.manager
+        for frame in self.reader.frames():
+            if self.closed:
+                return
+            self.msgs_in += 1
+            self.bytes_in += len(frame)
+            self.frame_received_at = time.perf_counter()
+            try:
+                if frame[0] == protocols.MEDIA_MAGIC:
+                    # Keep the whole frame so fan-out can forward it verbatim
+                    if manager.admit_media(self, len(frame)):
+                        manager.process_media(bytes(frame), self)
+                    continue
+                message = protocols.Protocol.decode_frame(frame)
+                if message.get('type') == 'MEDIA':
+                    if manager.admit_media(self, len(frame)):
+                        manager.process_message(message, self, bytes(frame))
+                    continue
+                wait = manager.admit_control(self, len(frame))
+                manager.process_message(message, self, None)
+            except Exception as e:
+                log.error("Error with client %s: %s", self.addr, e)
+                continue
+            if wait:
+                # Later frames stay buffered in the reader until the budget refills
+                self._pause_reading(wait)
+                return
+
+    def _pause_reading(self, delay: float):
+        self.reading_paused = True
+        self._update_interest()
+        self._resume_timer = self.loop.call_later(delay, self._resume_reading)
+
+    def _resume_reading(self):
+        self._resume_timer = None
+        if self.closed:
+            return
+        self.reading_paused = False
+        self._update_interest()
+        try:
+            self._dispatch_frames()
+        except ValueError as e:
+            log.error("Error with client %s: %s", self.addr, e)
+            self.close()
+            return
+        if not self.closed and not self.reading_paused and self.sock.pending():
+            self._on_readable()
+
+    def send(self, data: bytes, priority: int = PRIORITY_CONTROL):
+        """Queue encoded bytes for delivery; safe to call from any thread"""
+        if self.closed:
+            session = self.session
+            if session is not None and session.parked and priority == PRIORITY_CONTROL:
+                # Replayed if the client resumes; stale media is not worth it
+                session.missed.append(data)
+            return
+        if self.loop.in_loop_thread():
+            self._queue(data, priority)
+        else:
+            self.loop.call_soon(self._queue, data, priority)
+
+    def _queue(self, data: bytes, priority: int):
+        if self.closed:
+            return
+        self.send_queue.push(data, priority)
+        if self._sending is None and not self.handshaking:
+            self._flush()
+
+    def _flush(self):
+        bytes_before = self.bytes_out
+        try:
+            while True:
+                if self._sending is None:
+                    # Whatever queued up since the last write goes out as one TLS record
+                    batch = self.send_queue.pop_batch(COALESCE_BYTES)
+                    if not batch:
+                        break
+                    self._sending = memoryview(batch[0] if len(batch) == 1 else b''.join(batch))
+                    self._sending_count = len(batch)
+                view = self._sending
+                sent = self.sock.send(view)
+                self.bytes_out += sent
+                if sent < len(view):
+                    self._sending = view[sent:]
+                    break
+                self._sending = None
+                self.msgs_out += self._sending_count
+                self.sends_out += 1
+        except (ssl.SSLWantWriteError, ssl.SSLWantReadError, BlockingIOError):
+            pass
+        except (ConnectionResetError, BrokenPipeError, ssl.SSLError, OSError):
+            log.info("Client %s disconnected abruptly", self.addr)
+            self.close()
+            return
+        # Anything still unsent means the socket pushed back
+        self.drain.record(self.bytes_out - bytes_before, self._sending is not None, time.monotonic())
+        self._update_interest()
+
+    def _update_interest(self):
+        events = 0 if self.reading_paused else selectors.EVENT_READ
+        if self._sending is not None or self.send_queue:
+            events |= selectors.EVENT_WRITE
+        self._set_events(events)
+
+    def _set_events(self, events: int):
+        if events != self._events:
+            # Selectors reject an empty event mask, so a paused idle socket leaves the selector
+            if not events:
+                self.loop.unregister(self.sock)
+            elif not self._events:
+                self.loop.register(self.sock, events, self)
+            else:
+                self.loop.modify(self.sock, events, self)
+            self._events = events
+
+    def label(self) -> str:
+        """Name used for this client in logs and metrics"""
+        if self.username is not None:
+            return self.username
+        return f"{self.addr[0]}:{self.addr[1]}"
+
+    def queue_stats(self) -> Dict[str, int]:
+        return self.send_queue.stats()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._handshake_timer is not None:
+            self._handshake_timer.cancel()
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        if self._resume_timer is not None:
+            self._resume_timer.cancel()
+        self._sending = None
+        self.send_queue.clear()
+        self.loop.unregister(self.sock)
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        log.info("Connection closed with %s", self.addr)
+        self.manager.on_disconnect(self)
@@ -1,101 +1,598 @@
 import socket
-import selectors
 import threading
-from typing import Dict
+import itertools
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from shared import protocols, ssl_utils
+from server.connection import Connection
+from server.event_loop import EventLoop
+from server.metrics import Metrics, Sample, serve_metrics
+from server.recorder import Recorder
+from server.rate_limit import ClientLimits, Limit, RoomLimits, CLIENT_CONTROL, CLIENT_MEDIA, ROOM_CONTROL, ROOM_MEDIA
+from server.room_manager import RoomManager
+from server.send_queue import SendQueue, DROP_OLDEST_VIDEO, PRIORITY_AUDIO, PRIORITY_CONTROL, PRIORITY_VIDEO
+from server.sessions import SessionStore, PARK, REPLACED
+from server.simulcast import LayerRates
+from server.udp_relay import UdpRelay
+from server.worker_mesh import WorkerMesh
+from shared.log import get_logger
+
+log = get_logger('server')
+message_log = get_logger('server.messages')
+# Media arrives at frame rate; one in this many is enough to see it flow
+media_log = get_logger('server.media').sampled(1000)
+
+DEFAULT_ROOM = 'default'
+# Keeps a slow client's backlog in its SendQueue, where it can be seen,
+# prioritized and dropped, instead of seconds of video in the kernel
+SEND_BUFFER_SIZE = 256 * 1024
+
+_SHED_CLIENT = (('scope', 'client'), ('kind', 'media'), ('action', 'shed'))
+_SHED_ROOM = (('scope', 'room'), ('kind', 'media'), ('action', 'shed'))
+_DELAYED_CLIENT = (('scope', 'client'), ('kind', 'control'), ('action', 'delayed'))
+_DELAYED_ROOM = (('scope', 'room'), ('kind', 'control'), ('action', 'delayed'))
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 class ConnectionManager:
-    def __init__(self, host: str, port: int, certfile: str, keyfile: str):
+    def __init__(self, host: str, port: int, certfile: str, keyfile: str, loops: int = 1,
+                 queue_depth: int = 256, drop_policy: str = DROP_OLDEST_VIDEO,
+                 reuse_port: bool = False, mesh: Optional[WorkerMesh] = None,
+                 metrics_port: Optional[int] = None, metrics_host: str = '127.0.0.1',
+                 handshake_timeout: float = 10.0, ticket_rotation: Optional[float] = 12 * 3600,
+                 udp_port: Optional[int] = None, heartbeat_interval: Optional[float] = 15.0,
+                 idle_timeout: Optional[float] = 45.0, resume_grace: Optional[float] = 30.0,
+                 client_control_limit: Optional[Limit] = CLIENT_CONTROL,
+                 client_media_limit: Optional[Limit] = CLIENT_MEDIA,
+                 room_control_limit: Optional[Limit] = ROOM_CONTROL,
+                 room_media_limit: Optional[Limit] = ROOM_MEDIA, record_dir: Optional[str] = None):
         self.host = host
         self.port = port
         self.certfile = certfile
         self.keyfile = keyfile
-        self.selector = selectors.DefaultSelector()
-        self.clients: Dict[str, socket.socket] = {}
+        self.queue_depth = queue_depth
+        self.drop_policy = drop_policy
+        self.reuse_port = reuse_port
+        self.handshake_timeout = handshake_timeout
+        self.ticket_rotation = ticket_rotation
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        # Sessions outlive their connection by this long so a client can resume
+        self.resume_grace = resume_grace
+        self.sessions = SessionStore()
+        # Token buckets in front of fan-out: media over a limit is shed,
+        # control over a limit holds off reading from the client
+        self.client_control_limit = client_control_limit
+        self.client_media_limit = client_media_limit
+        self.room_limits = RoomLimits(room_control_limit, room_media_limit)
+        # Each worker or node writes its own series; readers merge them
+        self.recorder = Recorder(record_dir, mesh.index if mesh else 0) if record_dir else None
+        self.udp_port = udp_port
+        self.udp: Optional[UdpRelay] = None
+        self.mesh = mesh
+        self.loops: List[EventLoop] = [EventLoop(f"loop-{i}") for i in range(max(1, loops))]
+        self._next_loop = itertools.cycle(self.loops)
+        self.clients: Dict[str, Connection] = {}
+        self.clients_lock = threading.Lock()
+        # stream id -> the local connection publishing it
+        self.streams: Dict[int, Connection] = {}
+        # Every attached connection, joined or not
+        self.connections: Set[Connection] = set()
+        self.rooms = RoomManager()
+        self.layer_rates = LayerRates()
+        # Stream ids are unique per worker; the worker index keeps them unique per server
+        self._stream_ids = itertools.count(((mesh.index if mesh else 0) << 24) + 1)
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.metrics = Metrics()
+        self._describe_metrics()
         self.running = False
-        
+
+    def _describe_metrics(self):
+        describe = self.metrics.describe
+        describe('videocall_active_connections', 'gauge', 'Open client connections')
+        describe('videocall_rooms', 'gauge', 'Rooms with at least one local member')
+        describe('videocall_tls_handshake_seconds', 'histogram',
+                 'Server-side TLS handshake duration, by session resumption')
+        describe('videocall_tls_handshake_failures_total', 'counter', 'TLS handshakes that failed')
+        describe('videocall_idle_reaped_total', 'counter', 'Connections closed for missing heartbeats')
+        describe('videocall_sessions_parked', 'gauge', 'Disconnected sessions waiting to be resumed')
+        describe('videocall_sessions_resumed_total', 'counter', 'Sessions resumed on a new connection')
+        describe('videocall_sessions_expired_total', 'counter', 'Parked sessions whose grace period ran out')
+        describe('videocall_rate_limited_total', 'counter',
+                 'Messages over a rate limit, by scope, kind and action (shed or delayed)')
+        describe('videocall_client_rate_limited_total', 'counter',
+                 'Messages from a client that were shed or delayed by a rate limit')
+        describe('videocall_rate_limit', 'gauge', 'Configured rate limits, per second')
+        describe('videocall_recorder_frames_total', 'counter', 'Media frames written to recordings')
+        describe('videocall_recorder_bytes_total', 'counter', 'Media bytes written to recordings')
+        describe('videocall_recorder_pending', 'gauge', 'Frames waiting for the recording writer')
+        describe('videocall_recorder_dropped_total', 'counter', 'Frames not recorded because the writer was behind')
+        describe('videocall_recorder_write_errors_total', 'counter', 'Frames lost to recording write errors')
+        describe('videocall_fanout_seconds', 'histogram',
+                 'Media frame received to queued for its last recipient')
+        describe('videocall_room_messages_in_total', 'counter', 'Media frames received from room members')
+        describe('videocall_room_bytes_in_total', 'counter', 'Media bytes received from room members')
+        describe('videocall_room_messages_out_total', 'counter', 'Media frames queued to room members')
+        describe('videocall_room_bytes_out_total', 'counter', 'Media bytes queued to room members')
+        describe('videocall_client_messages_in_total', 'counter', 'Frames received per client')
+        describe('videocall_client_bytes_in_total', 'counter', 'Bytes received per client')
+        describe('videocall_client_messages_out_total', 'counter', 'Frames written per client')
+        describe('videocall_client_bytes_out_total', 'counter', 'Bytes written per client')
+        describe('videocall_client_sends_total', 'counter',
+                 'Socket writes per client; several queued messages share one TLS record')
+        describe('videocall_client_queue_depth', 'gauge', 'Messages waiting in a client send queue')
+        describe('videocall_client_queue_dropped_total', 'counter', 'Messages dropped from a client send queue')
+        describe('videocall_client_drain_capacity_bytes', 'gauge',
+                 'Measured send rate (bytes/sec) a congested client drains at')
+        describe('videocall_send_queue_depth', 'gauge', 'Messages waiting in all send queues')
+        describe('videocall_udp_packets_in_total', 'counter', 'Datagrams received by the UDP relay')
+        describe('videocall_udp_packets_out_total', 'counter', 'Datagrams forwarded by the UDP relay')
+        describe('videocall_udp_packets_dropped_total', 'counter',
+                 'Datagrams the UDP relay discarded (unknown stream, bad source or header)')
+        self.metrics.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self) -> Iterator[Sample]:
+        """Per-connection values, read when the endpoint is scraped"""
+        with self.clients_lock:
+            connections = list(self.connections)
+        yield 'videocall_active_connections', (), len(connections)
+        yield 'videocall_rooms', (), self.rooms.room_count()
+        yield 'videocall_sessions_parked', (), self.sessions.parked()
+        total_depth = 0
+        for conn in connections:
+            labels = (('client', conn.label()),)
+            stats = conn.queue_stats()
+            total_depth += stats['depth']
+            yield 'videocall_client_messages_in_total', labels, conn.msgs_in
+            yield 'videocall_client_bytes_in_total', labels, conn.bytes_in
+            yield 'videocall_client_messages_out_total', labels, conn.msgs_out
+            yield 'videocall_client_bytes_out_total', labels, conn.bytes_out
+            yield 'videocall_client_sends_total', labels, conn.sends_out
+            yield 'videocall_client_queue_depth', labels, stats['depth']
+            if conn.limits.shed or conn.limits.delayed:
+                yield 'videocall_client_rate_limited_total', labels, conn.limits.shed + conn.limits.delayed
+            if conn.drain.capacity is not None:
+                yield 'videocall_client_drain_capacity_bytes', labels, conn.drain.capacity
+            yield 'videocall_client_queue_dropped_total', labels, sum(
+                value for key, value in stats.items() if key.endswith('_dropped'))
+        yield 'videocall_send_queue_depth', (), total_depth
+        for scope, kind, limit in (('client', 'control', self.client_control_limit),
+                                   ('client', 'media', self.client_media_limit),
+                                   ('room', 'control', self.room_limits.control_limit),
+                                   ('room', 'media', self.room_limits.media_limit)):
+            if limit is not None:
+                yield 'videocall_rate_limit', (('scope', scope), ('kind', kind), ('unit', 'messages')), limit.messages
+                yield 'videocall_rate_limit', (('scope', scope), ('kind', kind), ('unit', 'bytes')), limit.bytes
+        if self.recorder:
+            yield 'videocall_recorder_frames_total', (), self.recorder.frames
+            yield 'videocall_recorder_bytes_total', (), self.recorder.bytes
+            yield 'videocall_recorder_pending', (), self.recorder.pending()
+            yield 'videocall_recorder_write_errors_total', (), self.recorder.write_errors
+        if self.udp:
+            yield 'videocall_udp_packets_in_total', (), self.udp.packets_in
+            yield 'videocall_udp_packets_out_total', (), self.udp.packets_out
+            yield 'videocall_udp_packets_dropped_total', (), self.udp.packets_dropped
+
     def start(self):
         """Start the server and listen for connections"""
         self.running = True
+        _raise_fd_limit()
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            # Sibling workers bind the same port; the kernel spreads accepts
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_socket.bind((self.host, self.port))
-        server_socket.listen(5)
-        
-        ssl_context = ssl_utils.create_ssl_context(self.certfile, self.keyfile, server_side=True)
-        
-        print(f"Server listening on {self.host}:{self.port}")
-        
+        server_socket.listen(socket.SOMAXCONN)
+
+        contexts = ssl_utils.RotatingContext(self.certfile, self.keyfile, self.ticket_rotation)
+
+        for loop in self.loops:
+            loop.start()
+        if self.mesh:
+            self.mesh.start(self)
+        if self.recorder:
+            self.recorder.start()
+        if self.udp_port is not None:
+            # Workers each get their own port so a client's datagrams reach
+            # the worker holding its control connection
+            self.udp = UdpRelay(self.host, self.udp_port + (self.mesh.port_offset if self.mesh else 0), self)
+            self.udp.start()
+        if self.metrics_port is not None:
+            serve_metrics(self.metrics, self.metrics_host, self.metrics_port)
+
+        log.info("Server listening on %s:%d (%d event loops)", self.host, self.port, len(self.loops))
+
         try:
             while self.running:
+                # Only accept here; handshakes run on the event loops so a
+                # slow client or a reconnect storm never holds up the backlog
                 client_socket, addr = server_socket.accept()
-                print(f"New connection from {addr}")
-                
+                log.info("New connection from %s", addr)
+
                 try:
-                    ssl_socket = ssl_utils.wrap_socket(client_socket, ssl_context, server_side=True)
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(ssl_socket, addr),
-                        daemon=True
-                    )
-                    client_thread.start()
+                    client_socket.setblocking(False)
+                    # Small control/audio frames must not wait on Nagle + delayed ACK
+                    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+                    ssl_socket = ssl_utils.wrap_socket(client_socket, contexts.current(time.monotonic()),
+                                                       server_side=True,
+                                                       do_handshake_on_connect=False)
+                    self.add_connection(ssl_socket, addr, handshake=True)
                 except Exception as e:
-                    print(f"Error establishing SSL connection: {e}")
+                    log.warning("Error establishing SSL connection: %s", e)
                     client_socket.close()
         except KeyboardInterrupt:
-            print("Shutting down server...")
+            log.info("Shutting down server...")
         finally:
             server_socket.close()
-    
-    def handle_client(self, client_socket: socket.socket, addr: tuple):
-        """Handle communication with a single client"""
-        try:
-            while self.running:
-                # First read the header to get message length
-                header = client_socket.recv(protocols.Protocol.HEADER_SIZE)
-                if not header:
-                    break
-                
-                msg_length = struct.unpack('!I', header)[0]
-                data = client_socket.recv(msg_length)
-                
-                if not data:
-                    break
-                    
-                message = protocols.Protocol.decode_message(data)
-                self.process_message(message, client_socket, addr)
-                
-        except (ConnectionResetError, BrokenPipeError):
-            print(f"Client {addr} disconnected abruptly")
-        except Exception as e:
-            print(f"Error with client {addr}: {e}")
-        finally:
-            client_socket.close()
-            print(f"Connection closed with {addr}")
-    
-    def process_message(self, message: dict, client_socket: socket.socket, addr: tuple):
-        """Process incoming messages from clients"""
+            self.stop()
+
+    def stop(self):
+        self.running = False
+        if self.udp:
+            self.udp.stop()
+        for loop in self.loops:
+            loop.stop()
+        if self.recorder:
+            self.recorder.stop()
+
+    def add_connection(self, ssl_socket, addr: tuple, handshake: bool = False) -> Connection:
+        """Hand a connected socket to the next event loop
+
+        With handshake set, the loop completes the TLS handshake itself and
+        closes the connection if it takes longer than handshake_timeout.
+        """
+        loop = next(self._next_loop)
+        send_queue = SendQueue(max_depth=self.queue_depth, drop_policy=self.drop_policy)
+        limits = ClientLimits(self.client_control_limit, self.client_media_limit)
+        conn = Connection(ssl_socket, addr, loop, self, send_queue,
+                          self.handshake_timeout if handshake else None,
+                          self.heartbeat_interval, self.idle_timeout, limits)
+        with self.clients_lock:
+            self.connections.add(conn)
+        loop.call_soon(conn.attach)
+        return conn
+
+    def get_queue_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-client send queue depth and drop counters"""
+        with self.clients_lock:
+            clients = list(self.clients.items())
+        return {user: conn.queue_stats() for user, conn in clients}
+
+    def on_handshake_complete(self, conn: Connection, seconds: float):
+        resumed = 'true' if conn.sock.session_reused else 'false'
+        self.metrics.observe('videocall_tls_handshake_seconds', seconds, (('resumed', resumed),))
+
+    def on_idle_timeout(self, conn: Connection):
+        self.metrics.inc('videocall_idle_reaped_total')
+
+    def on_handshake_failed(self, conn: Connection):
+        self.metrics.inc('videocall_tls_handshake_failures_total')
+
+    def on_disconnect(self, conn: Connection):
+        """Forget a closed connection, or park its session for a resume"""
+        with self.clients_lock:
+            self.connections.discard(conn)
+        fate = self.sessions.detach(conn)
+        if fate == REPLACED:
+            # A resume already moved everything onto the new connection
+            return
+        if fate == PARK:
+            # Keep room, name and stream; only the UDP path is certainly gone
+            if self.udp:
+                self.udp.unregister(conn)
+                conn.udp_addr = None
+                # Routes leave out closed members, so others stop relaying to it
+                self.udp.room_changed(self.rooms.room_of(conn))
+            conn.session.expiry = conn.loop.call_after(self.resume_grace, self._expire_session,
+                                                       conn.session, conn)
+            return
+        self._forget(conn)
+
+    def _expire_session(self, session, conn: Connection):
+        if self.sessions.expire(session, conn):
+            self.metrics.inc('videocall_sessions_expired_total')
+            self._forget(conn)
+
+    def _forget(self, conn: Connection):
+        with self.clients_lock:
+            if conn.username is not None and self.clients.get(conn.username) is conn:
+                del self.clients[conn.username]
+            owned_stream = conn.stream_id is not None and self.streams.get(conn.stream_id) is conn
+            if owned_stream:
+                del self.streams[conn.stream_id]
+        if self.udp:
+            self.udp.unregister(conn)
+        if owned_stream:
+            self.layer_rates.forget(conn.stream_id)
+        self._leave_room(conn)
+
+    def _resume(self, conn: Connection, message: dict):
+        """Re-attach a session to conn in one round trip, replaying what it missed"""
+        token = message.get('token')
+        previous = self.sessions.claim(token, conn) if isinstance(token, str) else None
+        if previous is None:
+            conn.send(protocols.Protocol.create_control_message('RESUME_ACK', status='expired'))
+            return
+        conn.protocol = min(int(message.get('protocol', protocols.PROTOCOL_V1)),
+                            protocols.PROTOCOL_VERSION)
+        if previous is conn:
+            room = self.rooms.room_of(conn)
+        else:
+            conn.username = previous.username
+            conn.stream_id = previous.stream_id
+            # Swap membership in place: the room never looks empty, so no mesh churn
+            room = self.rooms.remove_user(previous)
+            if room is not None:
+                self.rooms.add_user(room, conn)
+            with self.clients_lock:
+                if self.clients.get(conn.username) is previous:
+                    self.clients[conn.username] = conn
+                if self.streams.get(conn.stream_id) is previous:
+                    self.streams[conn.stream_id] = conn
+            if self.udp:
+                self.udp.unregister(previous)
+                self.udp.room_changed(room)
+            if not previous.closed:
+                # The old path may be half-open; its loop closes it as REPLACED
+                previous.loop.call_soon(previous.close)
+            self.metrics.inc('videocall_sessions_resumed_total')
+        conn.send(protocols.Protocol.create_control_message(
+            'RESUME_ACK', status='success', protocol=conn.protocol, stream_id=conn.stream_id,
+            room=room, session=token
+        ))
+        missed = conn.session.missed
+        while missed:
+            conn.send(missed.popleft())
+
+    def _leave_room(self, conn: Connection):
+        room = self.rooms.remove_user(conn)
+        if room is not None and not self.rooms.get_users(room):
+            self.room_limits.forget(room)
+        if room is not None and self.mesh:
+            self.mesh.room_left(room)
+        if room is not None and self.udp:
+            self.udp.room_changed(room)
+
+    def deliver_to_room(self, room: str, data: bytes, priority: int,
+                        exclude: Optional[Connection] = None) -> int:
+        """Queue an encoded frame for every local client in room
+
+        Returns the number of recipients.
+        """
+        recipients, sent_bytes = self.deliver(self.rooms.get_users(room), data, priority, exclude)
+        if recipients:
+            labels = (('room', room),)
+            self.metrics.inc('videocall_room_messages_out_total', recipients, labels)
+            self.metrics.inc('videocall_room_bytes_out_total', sent_bytes, labels)
+        return recipients
+
+    def deliver(self, members: Iterable[Connection], data: bytes, priority: int,
+                exclude: Optional[Connection] = None) -> Tuple[int, int]:
+        """Send a frame to each member, returning (recipients, bytes)
+
+        v2 media goes by datagram to members with a UDP endpoint. For v1
+        clients it is transcoded to JSON at most once, and only if one is
+        present. Of a simulcast frame's layers each member gets only the
+        one its LayerSelector picks. Parked members (closed connections
+        waiting for a resume) are not recipients; they only keep control
+        frames in their session's missed buffer.
+        """
+        is_media = protocols.Protocol.is_media_frame(data)
+        udp = self.udp if is_media and len(data) <= protocols.MAX_DATAGRAM else None
+        simulcast = is_media and data[2] & protocols.FLAG_SIMULCAST
+        if simulcast:
+            flags = data[2]
+            _, _, _, stream_id, seq, _, _ = protocols.MEDIA_HEADER.unpack_from(data)
+            now = time.monotonic()
+            self.layer_rates.record(stream_id, flags & protocols.FLAG_LAYER_MASK, len(data), now)
+        legacy = None
+        recipients = 0
+        sent_bytes = 0
+        for other in members:
+            if other is exclude:
+                continue
+            if other.closed:
+                if priority == PRIORITY_CONTROL:
+                    other.send(data, priority)
+                continue
+            if simulcast and not other.layers.accept(stream_id, seq, flags, self.layer_rates, now):
+                continue
+            frame = data
+            if udp is not None and other.udp_addr is not None:
+                udp.send_to(frame, other.udp_addr)
+                recipients += 1
+                sent_bytes += len(frame)
+                continue
+            if is_media and other.protocol < protocols.PROTOCOL_V2:
+                if legacy is None:
+                    legacy = protocols.Protocol.media_to_legacy(data)
+                frame = legacy
+            try:
+                other.send(frame, priority)
+                recipients += 1
+                sent_bytes += len(frame)
+            except Exception:
+                log.warning("Failed to send to %s", other.username)
+        return recipients, sent_bytes
+
+    def send_to_stream(self, stream_id: int, data: bytes, local_only: bool = False):
+        """Send a control frame to whichever client publishes stream_id"""
+        conn = self.streams.get(stream_id)
+        if conn is not None:
+            conn.send(data)
+        elif self.mesh and not local_only:
+            self.mesh.send_to_stream(stream_id, data)
+
+    def admit_media(self, conn: Connection, size: int) -> bool:
+        """Charge a media frame to conn's and its room's limits; False means shed it"""
+        now = time.monotonic()
+        limiter = conn.limits.media
+        if limiter is not None and not limiter.allow(size, now):
+            conn.limits.shed += 1
+            self.metrics.inc('videocall_rate_limited_total', 1, _SHED_CLIENT)
+            return False
+        room = self.rooms.room_of(conn)
+        if room is not None and not self.room_limits.allow_media(room, size, now):
+            conn.limits.shed += 1
+            self.metrics.inc('videocall_rate_limited_total', 1, _SHED_ROOM)
+            return False
+        return True
+
+    def admit_control(self, conn: Connection, size: int) -> float:
+        """Charge a control message to conn's and its room's limits
+
+        Control is never dropped; the return value is how long to stop
+        reading from conn, which pushes back on the sender through TCP.
+        """
+        now = time.monotonic()
+        limiter = conn.limits.control
+        wait = limiter.charge(size, now) if limiter is not None else 0.0
+        labels = _DELAYED_CLIENT
+        room = self.rooms.room_of(conn)
+        if room is not None:
+            room_wait = self.room_limits.charge_control(room, size, now)
+            if room_wait > wait:
+                wait, labels = room_wait, _DELAYED_ROOM
+        if wait:
+            conn.limits.delayed += 1
+            self.metrics.inc('videocall_rate_limited_total', 1, labels)
+        return wait
+
+    def record(self, room: str, stream_id: int, data: bytes):
+        if not self.recorder.record(room, stream_id, data):
+            self.metrics.inc('videocall_recorder_dropped_total')
+
+    def _relay(self, room: str, data: bytes, priority: int, conn: Connection):
+        """Fan a media frame from conn out to its room, locally and across workers"""
+        labels = (('room', room),)
+        self.metrics.inc('videocall_room_messages_in_total', 1, labels)
+        self.metrics.inc('videocall_room_bytes_in_total', len(data), labels)
+        self.deliver_to_room(room, data, priority, exclude=conn)
+        if self.mesh:
+            self.mesh.publish(room, data, priority)
+        if self.recorder:
+            self.record(room, conn.stream_id, data)
+        self.metrics.observe('videocall_fanout_seconds', time.perf_counter() - conn.frame_received_at)
+
+    def process_media(self, frame: bytes, conn: Connection):
+        """Relay a v2 binary media frame to the sender's room without decoding it"""
+        media_log.debug("Received %d byte v2 frame from %s", len(frame), conn.label())
+        room = self.rooms.room_of(conn)
+        if room is None:
+            return
+        priority = PRIORITY_AUDIO if frame[1] == protocols.MEDIA_AUDIO else PRIORITY_VIDEO
+        self._relay(room, frame, priority, conn)
+
+    def process_message(self, message: dict, conn: Connection, raw: Optional[bytes] = None):
+        """Process incoming messages from clients
+
+        raw is the frame exactly as received; when given, MEDIA is forwarded
+        as-is instead of being re-encoded.
+        """
         msg_type = message.get('type')
-        print(f"Received message from {addr}: {message}")
-        
+        if msg_type == 'MEDIA':
+            media_log.debug("Received MEDIA from %s", conn.label(), kind=message.get('kind'))
+        else:
+            message_log.debug("Received %s from %s: %s", msg_type, conn.label(), message)
+
         if msg_type == 'JOIN':
             username = message.get('username')
-            self.clients[username] = client_socket
-            response = protocols.Protocol.create_control_message('JOIN_ACK', status='success')
-            client_socket.sendall(response)
-            
+            conn.username = username
+            with self.clients_lock:
+                self.clients[username] = conn
+            room = message.get('room', DEFAULT_ROOM)
+            previous = self.rooms.room_of(conn)
+            if previous != room:
+                self.rooms.add_user(room, conn)
+                if self.mesh:
+                    if previous is not None:
+                        self.mesh.room_left(previous)
+                    self.mesh.room_joined(room)
+                if self.udp:
+                    self.udp.room_changed(previous)
+                    self.udp.room_changed(room)
+            # Both sides switch to the highest version they share
+            conn.protocol = min(int(message.get('protocol', protocols.PROTOCOL_V1)),
+                                protocols.PROTOCOL_VERSION)
+            if conn.stream_id is None:
+                conn.stream_id = next(self._stream_ids)
+                with self.clients_lock:
+                    self.streams[conn.stream_id] = conn
+            extra = {}
+            if self.resume_grace:
+                session = conn.session or self.sessions.create(conn)
+                extra = dict(session=session.token, resume_grace=self.resume_grace)
+            response = protocols.Protocol.create_control_message(
+                'JOIN_ACK', status='success', protocol=conn.protocol, stream_id=conn.stream_id, **extra
+            )
+            conn.send(response)
+
+        elif msg_type == 'RESUME':
+            self._resume(conn, message)
+
+        elif msg_type == 'MEDIA_REGISTER':
+            # Datagrams carry v2 frames, so the stream must be joined at v2
+            if self.udp is None or conn.stream_id is None or conn.protocol < protocols.PROTOCOL_V2:
+                conn.send(protocols.Protocol.create_control_message('MEDIA_ENDPOINT', status='unavailable'))
+            else:
+                token = self.udp.register(conn)
+                conn.send(protocols.Protocol.create_control_message(
+                    'MEDIA_ENDPOINT', status='success', transport='udp', port=self.udp.port,
+                    token=token, stream_id=conn.stream_id
+                ))
+
+        elif msg_type == 'PING':
+            conn.send(protocols.Protocol.create_control_message('PONG'))
+
+        elif msg_type == 'FEEDBACK':
+            # A receiver's bandwidth estimate for one stream: it bounds the
+            # simulcast layer relayed to that receiver, and goes back to the
+            # sender's rate controller
+            stream_id = message.get('stream')
+            bitrate = message.get('bitrate')
+            if isinstance(stream_id, int) and isinstance(bitrate, (int, float)):
+                conn.layers.set_budget(stream_id, bitrate / 8, time.monotonic())
+                report = dict(message, **{'from': conn.stream_id})
+                self.send_to_stream(stream_id, protocols.Protocol.encode_message(report))
+
         elif msg_type == 'LEAVE':
-            username = message.get('username')
-            if username in self.clients:
-                del self.clients[username]
-                
+            # A connection only ever leaves as itself, whatever username it names
+            if message.get('username', conn.username) != conn.username:
+                log.warning("%s tried to LEAVE as %s", conn.label(), message.get('username'))
+                return
+            self.sessions.end(conn)
+            conn.udp_addr = None
+            # Releases name, stream, UDP token and room, as a disconnect does
+            self._forget(conn)
+            # A later JOIN on this connection starts afresh
+            conn.username = None
+            conn.stream_id = None
+
         elif msg_type == 'MEDIA':
             # Route media to other clients
             target = message.get('target', 'all')
-            if target == 'all':
-                for user, sock in self.clients.items():
-                    if sock != client_socket:
-                        try:
-                            sock.sendall(protocols.Protocol.encode_message(message))
-                        except:
-                            print(f"Failed to send to {user}")
\ No newline at end of file
+            priority = PRIORITY_AUDIO if message.get('kind') == 'audio' else PRIORITY_VIDEO
+            room = self.rooms.room_of(conn)
+            if target == 'all' and room is not None:
+                # Encode once; every recipient queues the same immutable buffer
+                data = raw if raw is not None else protocols.Protocol.encode_message(message)
+                self._relay(room, data, priority, conn)
+
+
+def _raise_fd_limit():
+    """Lift the soft open-file limit so one process can hold 10k+ sockets"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        target = hard if hard != resource.RLIM_INFINITY else 1 << 20
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
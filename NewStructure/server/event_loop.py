@@ -0,0 +1,163 @@
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, Tuple
+from shared.timer_wheel import TimerWheel, WheelTimer
+from shared.log import get_logger
+
+log = get_logger('server.loop')
+
+
+class TimerHandle:
+    """A callback scheduled with EventLoop.call_later"""
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when: float, callback: Callable, args: tuple):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    """Selector loop that multiplexes many non-blocking client sockets on one thread"""
+
+    def __init__(self, name: str = "loop"):
+        self.name = name
+        self.selector = selectors.DefaultSelector()
+        self.running = False
+        self.thread_id = None
+        self._thread = None
+        self._callbacks: Deque[Tuple[Callable, tuple]] = deque()
+        self._callbacks_lock = threading.Lock()
+        # Timers are only touched on the loop thread, so no lock
+        self._timers: List[Tuple[float, int, TimerHandle]] = []
+        self._timer_seq = itertools.count()
+        # Coarse per-connection timeouts; O(1) however many connections there are
+        self.wheel = TimerWheel()
+        # Self-pipe so other threads can interrupt select()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, None)
+
+    def start(self):
+        """Run the loop on a daemon thread"""
+        self.running = True
+        self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def in_loop_thread(self) -> bool:
+        return threading.get_ident() == self.thread_id
+
+    def call_soon(self, callback: Callable, *args):
+        """Schedule callback to run on the loop thread (thread-safe)"""
+        with self._callbacks_lock:
+            self._callbacks.append((callback, args))
+        self._wakeup()
+
+    def call_later(self, delay: float, callback: Callable, *args) -> TimerHandle:
+        """Run callback on the loop thread after delay seconds; loop thread only"""
+        handle = TimerHandle(time.monotonic() + delay, callback, args)
+        heapq.heappush(self._timers, (handle.when, next(self._timer_seq), handle))
+        return handle
+
+    def call_after(self, delay: float, callback: Callable, *args) -> WheelTimer:
+        """Like call_later, but on the timer wheel: up to one tick late, O(1); loop thread only"""
+        return self.wheel.schedule(delay, callback, *args)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            # Pipe already full means a wakeup is pending anyway
+            pass
+
+    def register(self, sock: socket.socket, events: int, handler):
+        self.selector.register(sock, events, handler)
+
+    def modify(self, sock: socket.socket, events: int, handler):
+        self.selector.modify(sock, events, handler)
+
+    def unregister(self, sock: socket.socket):
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def run(self):
+        """Dispatch socket readiness events until stopped"""
+        self.thread_id = threading.get_ident()
+        self.running = True
+        try:
+            while self.running:
+                for key, mask in self.selector.select(timeout=self._select_timeout()):
+                    handler = key.data
+                    if handler is None:
+                        self._drain_wakeup()
+                        continue
+                    handler.handle_events(mask)
+                self._run_callbacks()
+                self._run_timers()
+        finally:
+            self._close()
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _select_timeout(self) -> float:
+        now = time.monotonic()
+        timeout = 1.0
+        if self._timers:
+            timeout = self._timers[0][0] - now
+        next_tick = self.wheel.next_tick()
+        if next_tick is not None:
+            timeout = min(timeout, next_tick - now)
+        return min(1.0, max(0.0, timeout))
+
+    def _run_timers(self):
+        now = time.monotonic()
+        self.wheel.advance(now)
+        timers = self._timers
+        while timers and timers[0][0] <= now:
+            handle = heapq.heappop(timers)[2]
+            if handle.cancelled:
+                continue
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                log.error("[%s] Timer error: %s", self.name, e)
+
+    def _run_callbacks(self):
+        with self._callbacks_lock:
+            callbacks = self._callbacks
+            self._callbacks = deque()
+        for callback, args in callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                log.error("[%s] Callback error: %s", self.name, e)
+
+    def stop(self):
+        self.running = False
+        self._wakeup()
+
+    def _close(self):
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                key.data.close()
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
@@ -1,4 +1,9 @@
 from server.connection_manager import ConnectionManager
+from server.cluster import ClusterMesh, parse_members, run_local_cluster
+from server.workers import run_workers
+from server.send_queue import DROP_POLICIES, DROP_OLDEST_VIDEO
+from server.rate_limit import parse_limit, CLIENT_CONTROL, CLIENT_MEDIA, ROOM_CONTROL, ROOM_MEDIA
+from shared import log
 import argparse
 
 def main():
@@ -7,16 +12,88 @@ def main():
     parser.add_argument('--port', type=int, default=5000, help='Server port')
     parser.add_argument('--cert', default='ssl/cert.pem', help='SSL certificate file')
     parser.add_argument('--key', default='ssl/key.pem', help='SSL key file')
+    parser.add_argument('--loops', type=int, default=1, help='Number of event loop threads')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of server processes sharing the port (SO_REUSEPORT)')
+    parser.add_argument('--queue-depth', type=int, default=256, help='Max queued messages per client')
+    parser.add_argument('--drop-policy', choices=DROP_POLICIES, default=DROP_OLDEST_VIDEO,
+                        help='What to drop when a client send queue is full')
+    parser.add_argument('--handshake-timeout', type=float, default=10.0,
+                        help='Seconds a client gets to finish the TLS handshake')
+    parser.add_argument('--ticket-rotation', type=float, default=12 * 3600,
+                        help='Seconds between TLS session ticket key rotations (0 disables)')
+    parser.add_argument('--udp-port', type=int, default=None,
+                        help='Relay media over UDP on this port (workers use PORT+index)')
+    parser.add_argument('--heartbeat-interval', type=float, default=15.0,
+                        help='Seconds of client silence before the server sends a PING')
+    parser.add_argument('--idle-timeout', type=float, default=45.0,
+                        help='Seconds of client silence before the connection is closed (0 disables)')
+    parser.add_argument('--resume-grace', type=float, default=30.0,
+                        help='Seconds a disconnected session can be resumed (0 disables)')
+    for flag, default, what in (('--client-control-limit', CLIENT_CONTROL, 'control messages from one client'),
+                                ('--client-media-limit', CLIENT_MEDIA, 'media from one client (excess is shed)'),
+                                ('--room-control-limit', ROOM_CONTROL, 'control messages into one room'),
+                                ('--room-media-limit', ROOM_MEDIA, 'media into one room (excess is shed)')):
+        parser.add_argument(flag, type=parse_limit, default=default, metavar='MSGS,BYTES',
+                            help=f"Per-second rate limit on {what}; 0 disables "
+                                 f"(default {default.messages:.0f},{default.bytes:.0f})")
+    parser.add_argument('--record-dir', default=None,
+                        help='Record every room\'s media under this directory (python -m server.recorder reads it)')
+    parser.add_argument('--cluster', default=None, metavar='HOST:PORT,...',
+                        help='Inter-node link addresses of every cluster node, in node order')
+    parser.add_argument('--node', type=int, default=0, help="This node's index in --cluster")
+    parser.add_argument('--local-cluster', type=int, default=0, metavar='N',
+                        help='Run an N-node cluster on this machine (client ports PORT..PORT+N-1)')
+    parser.add_argument('--cluster-port', type=int, default=7000,
+                        help='First inter-node link port for --local-cluster')
+    parser.add_argument('--log', default=None, metavar='LEVEL,PREFIX=LEVEL,...',
+                        help='Log levels per subsystem, e.g. info,server.messages=debug '
+                             '(changeable at runtime: POST /log on the metrics port)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve Prometheus metrics on 127.0.0.1:PORT (workers use PORT+index)')
     
     args = parser.parse_args()
+    if args.log:
+        try:
+            log.configure(args.log)
+        except ValueError as e:
+            parser.error(str(e))
+    if (args.cluster or args.local_cluster) and args.workers > 1:
+        parser.error("--workers cannot be combined with cluster mode; run one node per process")
     
-    server = ConnectionManager(
+    options = dict(
         host=args.host,
         port=args.port,
         certfile=args.cert,
-        keyfile=args.key
+        keyfile=args.key,
+        loops=args.loops,
+        queue_depth=args.queue_depth,
+        drop_policy=args.drop_policy,
+        metrics_port=args.metrics_port,
+        handshake_timeout=args.handshake_timeout,
+        ticket_rotation=args.ticket_rotation,
+        udp_port=args.udp_port,
+        heartbeat_interval=args.heartbeat_interval or None,
+        idle_timeout=args.idle_timeout or None,
+        resume_grace=args.resume_grace or None,
+        client_control_limit=args.client_control_limit,
+        client_media_limit=args.client_media_limit,
+        room_control_limit=args.room_control_limit,
+        room_media_limit=args.room_media_limit,
+        record_dir=args.record_dir
     )
-    
+
+    if args.workers > 1:
+        run_workers(args.workers, **options)
+        return
+    if args.local_cluster:
+        run_local_cluster(args.local_cluster, args.cluster_port, **options)
+        return
+
+    mesh = None
+    if args.cluster:
+        mesh = ClusterMesh(args.node, parse_members(args.cluster), args.cert, args.key)
+    server = ConnectionManager(mesh=mesh, **options)
     server.start()
 
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+from shared import log as logging
+from shared.log import get_logger
+
+log = get_logger('server.metrics')
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Labels, float]
+
+# Seconds; fan-out and handshakes live between ~50us and a few hundred ms
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Shard:
+    """Per-thread metric storage; only its owning thread ever writes it"""
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+
+class Metrics:
+    """Counters and histograms rendered in Prometheus text format
+
+    Each thread updates its own shard, so the hot path takes no locks;
+    shards are summed when the endpoint is scraped. Collectors registered
+    with add_collector report values that already live elsewhere (per-
+    connection counters, queue depths) at scrape time.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        self._lock = threading.Lock()
+        self._descriptions: Dict[str, Tuple[str, str]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def describe(self, name: str, metric_type: str, help_text: str):
+        self._descriptions[name] = (metric_type, help_text)
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        self._collectors.append(collector)
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = _Shard()
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name: str, value: float = 1, labels: Labels = ()):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = (),
+                buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def render(self) -> str:
+        with self._lock:
+            shards = list(self._shards)
+
+        counters: Dict[Tuple[str, Labels], float] = {}
+        histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        for shard in shards:
+            for key, value in list(shard.counters.items()):
+                counters[key] = counters.get(key, 0) + value
+            for key, histogram in list(shard.histograms.items()):
+                total = histograms.get(key)
+                if total is None:
+                    total = histograms[key] = Histogram(histogram.bounds)
+                total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+                total.sum += histogram.sum
+                total.count += histogram.count
+
+        samples: Dict[str, List[str]] = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append(_sample(name, labels, value))
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append(_sample(name, labels, value))
+        for (name, labels), histogram in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(_sample(f"{name}_bucket", labels + (('le', repr(bound)),), cumulative))
+            lines.append(_sample(f"{name}_bucket", labels + (('le', '+Inf'),), histogram.count))
+            lines.append(_sample(f"{name}_sum", labels, histogram.sum))
+            lines.append(_sample(f"{name}_count", labels, histogram.count))
+
+        out = []
+        for name in sorted(samples):
+            description = self._descriptions.get(name)
+            if description:
+                out.append(f"# HELP {name} {description[1]}")
+                out.append(f"# TYPE {name} {description[0]}")
+            out.extend(samples[name])
+        return "\n".join(out) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name: str, labels: Labels, value: float) -> str:
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+        return f"{name}{{{label_text}}} {value}"
+    return f"{name} {value}"
+
+
+def serve_metrics(metrics: Metrics, host: str, port: int) -> Optional[ThreadingHTTPServer]:
+    """Expose metrics at http://host:port/metrics on a daemon thread
+
+    /log on the same port lists log levels, and a POST there changes them.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path == '/log':
+                self._send_levels()
+                return
+            if path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            self._send_text(metrics.render(), 'text/plain; version=0.0.4')
+
+        def do_POST(self):
+            """POST /log?server.messages=debug&root=info switches log levels at runtime"""
+            url = urlsplit(self.path)
+            if url.path != '/log':
+                self.send_error(404)
+                return
+            try:
+                for prefix, level in parse_qsl(url.query):
+                    logging.configure(f"{'' if prefix == 'root' else prefix}={level}")
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            self._send_levels()
+
+        def _send_levels(self):
+            self._send_text("".join(f"{prefix or 'root'} {level}\n"
+                                    for prefix, level in logging.levels().items()), 'text/plain')
+
+        def _send_text(self, text: str, content_type: str):
+            body = text.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name='metrics', daemon=True).start()
+    log.info("Metrics available at http://%s:%d/metrics", host, port)
+    return httpd
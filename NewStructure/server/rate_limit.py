@@ -0,0 +1,139 @@
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# Buckets hold this many seconds of traffic, so short bursts pass untouched
+BURST_SECONDS = 2.0
+
+
+class Limit(NamedTuple):
+    """Sustained rate allowed for one kind of traffic"""
+    messages: float
+    bytes: float
+
+
+# Per client: 3 simulcast layers at 30 fps plus audio stays well inside the
+# media limit; control covers FEEDBACK for a few dozen streams
+CLIENT_MEDIA = Limit(300, 8_000_000)
+CLIENT_CONTROL = Limit(100, 256 * 1024)
+# Per room, summed over its local members: what the room may put into fan-out
+ROOM_MEDIA = Limit(3000, 64_000_000)
+ROOM_CONTROL = Limit(1000, 2 * 1024 * 1024)
+
+
+def parse_limit(spec: str) -> Optional[Limit]:
+    """'MSGS,BYTES' per second -> Limit; '0' -> None (unlimited)"""
+    if spec.strip() == '0':
+        return None
+    messages, _, size = spec.partition(',')
+    try:
+        return Limit(float(messages), float(size))
+    except ValueError:
+        raise ValueError(f"Bad rate limit {spec!r}, expected MSGS,BYTES or 0") from None
+
+
+class TokenBucket:
+    """Classic token bucket; tokens may go negative to record debt"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float = BURST_SECONDS, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = rate * burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def ready(self, amount: float) -> bool:
+        # Anything larger than the whole bucket passes only when it is full
+        return self.tokens >= min(amount, self.capacity)
+
+    def debt_wait(self) -> float:
+        """Seconds until the bucket is out of debt"""
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimiter:
+    """A message-rate bucket and a byte-rate bucket enforced together"""
+
+    __slots__ = ('messages', 'bytes')
+
+    def __init__(self, limit: Limit, now: Optional[float] = None):
+        self.messages = TokenBucket(limit.messages, now=now)
+        self.bytes = TokenBucket(limit.bytes, now=now)
+
+    def allow(self, size: int, now: float) -> bool:
+        """Take tokens for a message if both buckets have them; False means shed it"""
+        self.messages.refill(now)
+        self.bytes.refill(now)
+        if not (self.messages.ready(1) and self.bytes.ready(size)):
+            return False
+        self.messages.tokens -= 1
+        self.bytes.tokens -= size
+        return True
+
+    def charge(self, size: int, now: float) -> float:
+        """Take tokens unconditionally; returns how long the sender should be held off"""
+        self.messages.refill(now)
+        self.bytes.refill(now)
+        self.messages.tokens -= 1
+        self.bytes.tokens -= size
+        return max(self.messages.debt_wait(), self.bytes.debt_wait())
+
+
+class ClientLimits:
+    """One connection's limiters; used from its event loop (and the UDP relay for media)"""
+
+    __slots__ = ('control', 'media', 'shed', 'delayed')
+
+    def __init__(self, control: Optional[Limit] = None, media: Optional[Limit] = None):
+        self.control = RateLimiter(control) if control else None
+        self.media = RateLimiter(media) if media else None
+        # Read by the metrics collector
+        self.shed = 0
+        self.delayed = 0
+
+
+class RoomLimits:
+    """Limiters per room, shared by members on every event loop"""
+
+    def __init__(self, control: Optional[Limit] = None, media: Optional[Limit] = None):
+        self.control_limit = control
+        self.media_limit = media
+        self._rooms: Dict[str, Tuple[threading.Lock, Optional[RateLimiter], Optional[RateLimiter]]] = {}
+        self.lock = threading.Lock()
+
+    def _entry(self, room: str):
+        entry = self._rooms.get(room)
+        if entry is None:
+            with self.lock:
+                entry = self._rooms.get(room)
+                if entry is None:
+                    entry = self._rooms[room] = (
+                        threading.Lock(),
+                        RateLimiter(self.control_limit) if self.control_limit else None,
+                        RateLimiter(self.media_limit) if self.media_limit else None,
+                    )
+        return entry
+
+    def allow_media(self, room: str, size: int, now: float) -> bool:
+        if self.media_limit is None:
+            return True
+        lock, _, media = self._entry(room)
+        with lock:
+            return media.allow(size, now)
+
+    def charge_control(self, room: str, size: int, now: float) -> float:
+        if self.control_limit is None:
+            return 0.0
+        lock, control, _ = self._entry(room)
+        with lock:
+            return control.charge(size, now)
+
+    def forget(self, room: str):
+        with self.lock:
+            self._rooms.pop(room, None)
@@ -0,0 +1,342 @@
+"""Room recording to segmented, append-only files with a sparse time index
+
+Layout: <directory>/<quoted room>/<start_us>-<node>.seg plus a matching
+.idx. A segment is SEGMENT_MAGIC followed by records of RECORD (receive
+time in microseconds, stream id, length) and the frame exactly as relayed.
+The index holds an INDEX_ENTRY (timestamp, offset) every INDEX_INTERVAL_US
+or INDEX_RECORDS records, whichever comes first, so a seek is a bisect
+plus a short forward scan. Each server process (worker or cluster node)
+writes its own series; readers merge them by time.
+"""
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from typing import Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+from shared.log import get_logger
+
+log = get_logger('server.recorder')
+
+SEGMENT_MAGIC = b'VCR1'
+RECORD = struct.Struct('!QII')
+INDEX_ENTRY = struct.Struct('!QQ')
+INDEX_INTERVAL_US = 100_000
+# ...or every this many records, so a seek never scans far in a busy room
+INDEX_RECORDS = 64
+SEGMENT_BYTES = 64 * 1024 * 1024
+SEGMENT_SECONDS = 300.0
+# The writer wakes this often; frames relayed in between form one batch
+FLUSH_INTERVAL = 0.05
+# Frames waiting for the writer beyond this are dropped, never waited on
+MAX_PENDING = 20000
+# A room with no frames for this long has its segment closed
+IDLE_CLOSE_SECONDS = 10.0
+
+
+def room_directory(directory: str, room: str) -> str:
+    """Where a room's segments live; room names come from clients, so '..' must not escape"""
+    return os.path.join(directory, quote(room, safe='').replace('.', '%2E') or '%')
+
+
+class RecordedFrame(NamedTuple):
+    timestamp_us: int
+    stream_id: int
+    data: bytes
+
+
+class _SegmentWriter:
+    """The open segment of one room; used only by the writer thread"""
+
+    def __init__(self, directory: str, start_us: int, node: int):
+        base = os.path.join(directory, f"{start_us:016d}-{node:03d}")
+        self.data = open(base + '.seg', 'ab')
+        self.index = open(base + '.idx', 'ab')
+        self.data.write(SEGMENT_MAGIC)
+        self.start_us = start_us
+        self.size = len(SEGMENT_MAGIC)
+        self.last_indexed = -INDEX_INTERVAL_US
+        self.unindexed = 0
+        self.last_us = start_us
+        self.written_at = time.monotonic()
+
+    def write(self, records: List[Tuple[int, int, bytes]]):
+        chunks = []
+        entries = []
+        size = self.size
+        for timestamp_us, stream_id, frame in records:
+            if timestamp_us - self.last_indexed >= INDEX_INTERVAL_US or self.unindexed >= INDEX_RECORDS:
+                entries.append(INDEX_ENTRY.pack(timestamp_us, size))
+                self.last_indexed = timestamp_us
+                self.unindexed = 0
+            self.unindexed += 1
+            chunks.append(RECORD.pack(timestamp_us, stream_id, len(frame)))
+            chunks.append(frame)
+            size += RECORD.size + len(frame)
+        # One write per file per batch; the index only ever points at flushed data
+        self.data.write(b''.join(chunks))
+        self.data.flush()
+        if entries:
+            self.index.write(b''.join(entries))
+            self.index.flush()
+        self.size = size
+        self.last_us = records[-1][0]
+        self.written_at = time.monotonic()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class Recorder:
+    """Appends every media frame a room relays, from a dedicated writer thread
+
+    record() is called on the forwarding path and only appends to a deque;
+    the writer drains it every FLUSH_INTERVAL and writes each room's frames
+    with one call per file. A writer that falls behind costs recorded
+    frames (record() returns False), never latency for live participants.
+    """
+
+    def __init__(self, directory: str, node: int = 0, segment_bytes: int = SEGMENT_BYTES,
+                 segment_seconds: float = SEGMENT_SECONDS):
+        self.directory = directory
+        self.node = node
+        self.segment_bytes = segment_bytes
+        self.segment_us = int(segment_seconds * 1_000_000)
+        self._pending: Deque[Tuple[str, int, int, bytes]] = deque()
+        self._segments: Dict[str, _SegmentWriter] = {}
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+        # Written only by the writer thread, read by the metrics collector
+        self.frames = 0
+        self.bytes = 0
+        self.write_errors = 0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self._thread.start()
+        log.info("Recording rooms to %s", self.directory)
+
+    def stop(self):
+        """Write out what is pending and close every segment"""
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def record(self, room: str, stream_id: int, frame: bytes) -> bool:
+        """Queue a relayed frame; safe from any thread, never blocks
+
+        Returns False if the frame was dropped because the writer is behind.
+        """
+        if len(self._pending) >= MAX_PENDING:
+            return False
+        self._pending.append((room, stream_id, time.time_ns() // 1000, frame))
+        return True
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _run(self):
+        while True:
+            running = self.running
+            if self._pending:
+                self._write_batch()
+            if not running:
+                break
+            self._close_idle()
+            time.sleep(FLUSH_INTERVAL)
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+
+    def _write_batch(self):
+        pending = self._pending
+        rooms: Dict[str, List[Tuple[int, int, bytes]]] = {}
+        # Only what is queued now; record() keeps appending meanwhile
+        for _ in range(len(pending)):
+            room, stream_id, timestamp_us, frame = pending.popleft()
+            rooms.setdefault(room, []).append((timestamp_us, stream_id, frame))
+        for room, records in rooms.items():
+            try:
+                self._write_room(room, records)
+            except OSError as e:
+                log.error("Recording room %s failed: %s", room, e)
+                self.write_errors += len(records)
+                segment = self._segments.pop(room, None)
+                if segment is not None:
+                    segment.close()
+
+    def _write_room(self, room: str, records: List[Tuple[int, int, bytes]]):
+        segment = self._segments.get(room)
+        start = 0
+        for i, (timestamp_us, stream_id, frame) in enumerate(records):
+            if segment is not None:
+                # The index is bisected, so time may not run backwards within a series
+                if timestamp_us < segment.last_us:
+                    timestamp_us = segment.last_us
+                    records[i] = (timestamp_us, stream_id, frame)
+                if segment.size >= self.segment_bytes or timestamp_us - segment.start_us >= self.segment_us:
+                    if i > start:
+                        segment.write(records[start:i])
+                    segment.close()
+                    segment = None
+                    start = i
+            if segment is None:
+                directory = room_directory(self.directory, room)
+                os.makedirs(directory, exist_ok=True)
+                segment = self._segments[room] = _SegmentWriter(directory, timestamp_us, self.node)
+            segment.last_us = timestamp_us
+            self.frames += 1
+            self.bytes += len(frame)
+        segment.write(records[start:])
+
+    def _close_idle(self):
+        now = time.monotonic()
+        for room, segment in list(self._segments.items()):
+            if now - segment.written_at >= IDLE_CLOSE_SECONDS:
+                segment.close()
+                del self._segments[room]
+
+
+class _IndexTimes:
+    """Timestamps of a memory-mapped index, as a sequence bisect can search"""
+
+    __slots__ = ('buf', 'count')
+
+    def __init__(self, buf, count: int):
+        self.buf = buf
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> int:
+        return INDEX_ENTRY.unpack_from(self.buf, i * INDEX_ENTRY.size)[0]
+
+
+class _SegmentReader:
+    def __init__(self, path: str):
+        self.start_us = int(os.path.basename(path).split('-')[0])
+        self.data = _map(path)
+        self.index = _map(path[:-len('.seg')] + '.idx')
+        count = len(self.index) // INDEX_ENTRY.size if self.index is not None else 0
+        self.times = _IndexTimes(self.index, count)
+
+    def seek(self, timestamp_us: int) -> int:
+        """Offset of the first record at or after timestamp_us"""
+        i = bisect_right(self.times, timestamp_us) - 1
+        offset = INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size)[1] if i >= 0 else len(SEGMENT_MAGIC)
+        for record_offset, frame in self._records(offset):
+            if frame.timestamp_us >= timestamp_us:
+                return record_offset
+        return len(self.data) if self.data is not None else 0
+
+    def frames(self, offset: int = len(SEGMENT_MAGIC)) -> Iterator[RecordedFrame]:
+        for _, frame in self._records(offset):
+            yield frame
+
+    def _records(self, offset: int) -> Iterator[Tuple[int, RecordedFrame]]:
+        data = self.data
+        if data is None or data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            return
+        end = len(data)
+        while offset + RECORD.size <= end:
+            timestamp_us, stream_id, length = RECORD.unpack_from(data, offset)
+            body = offset + RECORD.size
+            if body + length > end:
+                # Torn tail of a segment still being written (or a crash)
+                return
+            yield offset, RecordedFrame(timestamp_us, stream_id, data[body:body + length])
+            offset = body + length
+
+    def close(self):
+        for buf in (self.data, self.index):
+            if buf is not None:
+                buf.close()
+
+
+def _map(path: str) -> Optional[mmap.mmap]:
+    try:
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Missing or still empty
+        return None
+
+
+class RecordingReader:
+    """Plays back a room's recording, merging every server's series by time"""
+
+    def __init__(self, directory: str, room: str):
+        self.room = room
+        path = room_directory(directory, room)
+        names = sorted(name for name in os.listdir(path) if name.endswith('.seg'))
+        self.series: Dict[str, List[_SegmentReader]] = {}
+        for name in names:
+            node = name[:-len('.seg')].split('-')[1]
+            self.series.setdefault(node, []).append(_SegmentReader(os.path.join(path, name)))
+
+    def frames(self, start_us: Optional[int] = None, end_us: Optional[int] = None) -> Iterator[RecordedFrame]:
+        """Frames from start_us (inclusive) to end_us (exclusive), in time order"""
+        merged = heapq.merge(*(self._series_frames(segments, start_us) for segments in self.series.values()))
+        for frame in merged:
+            if end_us is not None and frame.timestamp_us >= end_us:
+                return
+            yield frame
+
+    @staticmethod
+    def _series_frames(segments: List[_SegmentReader], start_us: Optional[int]) -> Iterator[RecordedFrame]:
+        first = 0
+        offset = len(SEGMENT_MAGIC)
+        if start_us is not None:
+            # Last segment starting at or before start_us, then bisect its index
+            first = max(0, bisect_right([segment.start_us for segment in segments], start_us) - 1)
+            offset = segments[first].seek(start_us)
+        for segment in segments[first:]:
+            yield from segment.frames(offset)
+            offset = len(SEGMENT_MAGIC)
+
+    def close(self):
+        for segments in self.series.values():
+            for segment in segments:
+                segment.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise a room recording")
+    parser.add_argument('directory', help='--record-dir the server was given')
+    parser.add_argument('room', help='Room name')
+    parser.add_argument('--start', type=float, default=None, help='Unix time to seek to')
+    parser.add_argument('--seconds', type=float, default=None, help='How much to read from --start')
+    args = parser.parse_args()
+
+    reader = RecordingReader(args.directory, args.room)
+    start_us = int(args.start * 1_000_000) if args.start is not None else None
+    end_us = start_us + int(args.seconds * 1_000_000) if start_us is not None and args.seconds else None
+    streams: Dict[int, int] = {}
+    first = last = None
+    size = 0
+    for frame in reader.frames(start_us, end_us):
+        streams[frame.stream_id] = streams.get(frame.stream_id, 0) + 1
+        size += len(frame.data)
+        first = frame.timestamp_us if first is None else first
+        last = frame.timestamp_us
+    reader.close()
+    if first is None:
+        print("No frames")
+        return
+    print(f"{args.room}: {sum(streams.values())} frames, {size} bytes, "
+          f"{(last - first) / 1e6:.1f}s from {first / 1e6:.3f}")
+    for stream_id, count in sorted(streams.items()):
+        print(f"  stream {stream_id}: {count} frames")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,63 @@
-from typing import Dict, Set
+from typing import Dict, Hashable, Optional, Set, Tuple
 import threading
 
 class RoomManager:
+    """Room membership indexed both by room and by member
+
+    Members are any hashable handle (the relay uses Connection objects), so
+    finding a member's room or a room's members never scans other rooms.
+    """
+
     def __init__(self):
-        self.rooms: Dict[str, Set[str]] = {}
+        self.rooms: Dict[str, Set[Hashable]] = {}
+        self.member_rooms: Dict[Hashable, str] = {}
+        # Immutable per-room member tuples for the fan-out hot path
+        self._snapshots: Dict[str, Tuple[Hashable, ...]] = {}
         self.lock = threading.Lock()
 
-    def add_user(self, room: str, username: str):
+    def add_user(self, room: str, member: Hashable) -> Optional[str]:
+        """Put member in room, returning the room it was moved out of"""
         with self.lock:
-            if room not in self.rooms:
-                self.rooms[room] = set()
-            self.rooms[room].add(username)
+            previous = self.member_rooms.get(member)
+            if previous == room:
+                return None
+            if previous is not None:
+                self._discard(previous, member)
+            self.rooms.setdefault(room, set()).add(member)
+            self.member_rooms[member] = room
+            self._snapshots.pop(room, None)
+            return previous
 
-    def remove_user(self, room: str, username: str):
+    def remove_user(self, member: Hashable) -> Optional[str]:
+        """Take member out of its room, returning the room it left"""
         with self.lock:
-            if room in self.rooms:
-                self.rooms[room].discard(username)
-                if not self.rooms[room]:
-                    del self.rooms[room]
+            room = self.member_rooms.pop(member, None)
+            if room is not None:
+                self._discard(room, member)
+            return room
 
-    def get_users(self, room: str) -> Set[str]:
-        with self.lock:
-            return self.rooms.get(room, set()).copy()
\ No newline at end of file
+    def _discard(self, room: str, member: Hashable):
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(member)
+            if not members:
+                del self.rooms[room]
+        self._snapshots.pop(room, None)
+
+    def room_of(self, member: Hashable) -> Optional[str]:
+        return self.member_rooms.get(member)
+
+    def room_count(self) -> int:
+        return len(self.rooms)
+
+    def get_users(self, room: str) -> Tuple[Hashable, ...]:
+        """Members of room as an immutable tuple, rebuilt only after changes"""
+        snapshot = self._snapshots.get(room)
+        if snapshot is None:
+            with self.lock:
+                members = self.rooms.get(room)
+                if members is None:
+                    return ()
+                snapshot = tuple(members)
+                self._snapshots[room] = snapshot
+        return snapshot
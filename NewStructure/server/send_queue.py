@@ -0,0 +1,117 @@
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+PRIORITY_CONTROL = 0
+PRIORITY_AUDIO = 1
+PRIORITY_VIDEO = 2
+PRIORITY_NAMES = ('control', 'audio', 'video')
+
+# Drop policies applied when a subscriber's queue is full
+DROP_OLDEST_VIDEO = 'oldest-video'
+DROP_NEWEST = 'newest'
+DROP_POLICIES = (DROP_OLDEST_VIDEO, DROP_NEWEST)
+
+
+class SendQueue:
+    """Bounded per-subscriber egress queue served in strict priority order
+
+    Control messages are always admitted. Audio and video count against
+    max_depth/max_bytes; when the queue is full the drop policy decides
+    whether the oldest queued video frame is evicted or the new one refused.
+    """
+
+    def __init__(self, max_depth: int = 256, max_bytes: int = 4 * 1024 * 1024,
+                 drop_policy: str = DROP_OLDEST_VIDEO):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.drop_policy = drop_policy
+        self._queues: List[Deque[bytes]] = [deque(), deque(), deque()]
+        self.depth = 0
+        self.bytes = 0
+        self.high_watermark = 0
+        self.enqueued = [0, 0, 0]
+        self.dropped = [0, 0, 0]
+
+    def __len__(self):
+        return self.depth
+
+    def _full(self, size: int) -> bool:
+        return self.depth >= self.max_depth or self.bytes + size > self.max_bytes
+
+    def push(self, data: bytes, priority: int = PRIORITY_CONTROL) -> bool:
+        """Queue data, returning False if it was dropped"""
+        size = len(data)
+        if priority != PRIORITY_CONTROL:
+            while self._full(size):
+                if not self._evict(priority):
+                    self.dropped[priority] += 1
+                    return False
+        self._queues[priority].append(data)
+        self.depth += 1
+        self.bytes += size
+        self.enqueued[priority] += 1
+        if self.depth > self.high_watermark:
+            self.high_watermark = self.depth
+        return True
+
+    def _evict(self, incoming_priority: int) -> bool:
+        """Make room by dropping queued media no more important than the newcomer"""
+        if self.drop_policy == DROP_NEWEST:
+            return False
+        for priority in (PRIORITY_VIDEO, PRIORITY_AUDIO):
+            if priority < incoming_priority:
+                break
+            queue = self._queues[priority]
+            if queue:
+                stale = queue.popleft()
+                self.depth -= 1
+                self.bytes -= len(stale)
+                self.dropped[priority] += 1
+                return True
+        return False
+
+    def pop(self) -> Optional[bytes]:
+        """Remove and return the most urgent queued message"""
+        for queue in self._queues:
+            if queue:
+                data = queue.popleft()
+                self.depth -= 1
+                self.bytes -= len(data)
+                return data
+        return None
+
+    def pop_batch(self, max_bytes: int) -> List[bytes]:
+        """Remove the most urgent messages that fit in max_bytes together (at least one)"""
+        batch = []
+        size = 0
+        for queue in self._queues:
+            while queue:
+                data = queue[0]
+                if batch and size + len(data) > max_bytes:
+                    return batch
+                queue.popleft()
+                self.depth -= 1
+                self.bytes -= len(data)
+                batch.append(data)
+                size += len(data)
+        return batch
+
+    def clear(self):
+        for queue in self._queues:
+            queue.clear()
+        self.depth = 0
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        stats = {
+            'depth': self.depth,
+            'bytes': self.bytes,
+            'high_watermark': self.high_watermark,
+        }
+        for priority, name in enumerate(PRIORITY_NAMES):
+            stats[f'{name}_depth'] = len(self._queues[priority])
+            stats[f'{name}_enqueued'] = self.enqueued[priority]
+            stats[f'{name}_dropped'] = self.dropped[priority]
+        return stats
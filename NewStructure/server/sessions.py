@@ -0,0 +1,97 @@
+import secrets
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional
+
+# Control messages kept for a disconnected session; the oldest go first
+MAX_MISSED = 64
+
+# What on_disconnect should do with a closed connection
+FORGET = 'forget'
+PARK = 'park'
+REPLACED = 'replaced'
+
+
+class Session:
+    """A client's identity across connections
+
+    The Connection it was issued on keeps the room membership and stream id;
+    while the session is parked that closed Connection stays in place, so a
+    resume just swaps the new connection in.
+    """
+
+    __slots__ = ('token', 'conn', 'parked', 'expiry', 'missed')
+
+    def __init__(self, token: str, conn):
+        self.token = token
+        self.conn = conn
+        self.parked = False
+        self.expiry = None
+        self.missed: Deque[bytes] = deque(maxlen=MAX_MISSED)
+
+
+class SessionStore:
+    """Session tokens issued at JOIN and the transitions between connections"""
+
+    def __init__(self):
+        self.sessions: Dict[str, Session] = {}
+        self.lock = threading.Lock()
+
+    def create(self, conn) -> Session:
+        session = Session(secrets.token_urlsafe(18), conn)
+        with self.lock:
+            self.sessions[session.token] = session
+            conn.session = session
+        return session
+
+    def detach(self, conn) -> str:
+        """Decide the fate of a closed connection: FORGET, PARK or REPLACED"""
+        with self.lock:
+            session = conn.session
+            if session is None:
+                return FORGET
+            if session.conn is not conn:
+                return REPLACED
+            session.parked = True
+            return PARK
+
+    def claim(self, token: str, conn):
+        """Move the session to conn, returning the connection it had; None if unknown
+
+        Works on a live session too: after a network change the client
+        usually reconnects before the server notices the old path is dead.
+        """
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            previous = session.conn
+            if session.expiry is not None:
+                session.expiry.cancel()
+                session.expiry = None
+            session.conn = conn
+            session.parked = False
+            conn.session = session
+            return previous
+
+    def expire(self, session: Session, conn) -> bool:
+        """End a parked session if conn still holds it; False if it was resumed meanwhile"""
+        with self.lock:
+            if not session.parked or session.conn is not conn:
+                return False
+            self.sessions.pop(session.token, None)
+            session.parked = False
+            conn.session = None
+            return True
+
+    def end(self, conn):
+        """Drop conn's session (explicit LEAVE), so closing it later parks nothing"""
+        with self.lock:
+            session = conn.session
+            if session is not None and session.conn is conn:
+                self.sessions.pop(session.token, None)
+            conn.session = None
+
+    def parked(self) -> int:
+        with self.lock:
+            return sum(1 for session in self.sessions.values() if session.parked)
@@ -0,0 +1,163 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+from shared.protocols import FLAG_KEYFRAME, FLAG_LAYER_MASK, MAX_LAYERS
+
+# Rates are recomputed over windows of this many seconds
+WINDOW = 0.5
+# Without congestion for this long, assume the link can do better
+PROBE_AFTER = 2.0
+PROBE_GAIN = 1.25
+# Switch up only when the next layer fits with this much headroom
+UP_MARGIN = 0.8
+# Streams not seen for this long no longer share a subscriber's budget
+STREAM_IDLE = 2.0
+
+
+class DrainMeter:
+    """Estimates how fast one subscriber's socket drains, in bytes/sec
+
+    Rates are only a capacity measurement in windows where the socket
+    pushed back (partial send or WantWrite); otherwise they are a lower
+    bound. capacity is None until the first push-back, meaning no limit
+    has been seen.
+    """
+
+    def __init__(self):
+        self.capacity: Optional[float] = None
+        self._bytes = 0
+        self._window_start = 0.0
+        self._congested = False
+        self._last_congested = 0.0
+
+    def record(self, sent: int, blocked: bool, now: float):
+        self._bytes += sent
+        if blocked:
+            self._congested = True
+        if self._window_start == 0.0:
+            self._window_start = now
+        elif now - self._window_start >= WINDOW:
+            self._roll(now)
+
+    def _roll(self, now: float):
+        rate = self._bytes / (now - self._window_start)
+        if self._congested:
+            self.capacity = rate if self.capacity is None else 0.5 * self.capacity + 0.5 * rate
+            self._last_congested = now
+        elif self.capacity is not None:
+            if rate > self.capacity:
+                self.capacity = rate
+            elif now - self._last_congested >= PROBE_AFTER:
+                self.capacity *= PROBE_GAIN
+        self._bytes = 0
+        self._window_start = now
+        self._congested = False
+
+
+class LayerRates:
+    """Bitrate of each simulcast layer of each publishing stream, measured at ingress"""
+
+    def __init__(self):
+        # stream id -> [window start, bytes per layer, rate per layer]
+        self._streams: Dict[int, list] = {}
+        self.lock = threading.Lock()
+
+    def record(self, stream_id: int, layer: int, size: int, now: float):
+        entry = self._streams.get(stream_id)
+        if entry is None:
+            with self.lock:
+                entry = self._streams.setdefault(stream_id, [now, [0] * MAX_LAYERS, [0.0] * MAX_LAYERS])
+        entry[1][layer] += size
+        elapsed = now - entry[0]
+        if elapsed >= WINDOW:
+            counts, rates = entry[1], entry[2]
+            for i in range(MAX_LAYERS):
+                sample = counts[i] / elapsed
+                rates[i] = sample if rates[i] == 0.0 else 0.5 * rates[i] + 0.5 * sample
+                counts[i] = 0
+            entry[0] = now
+
+    def rates(self, stream_id: int) -> List[float]:
+        entry = self._streams.get(stream_id)
+        return entry[2] if entry is not None else [0.0] * MAX_LAYERS
+
+    def forget(self, stream_id: int):
+        with self.lock:
+            self._streams.pop(stream_id, None)
+
+
+class LayerSelector:
+    """Per-subscriber choice of which simulcast layer to forward from each stream
+
+    The subscriber's drain capacity is split evenly over the simulcast
+    streams it is receiving, and capped by any bandwidth the subscriber
+    reported for a stream in FEEDBACK. A switch happens only on a keyframe
+    of the new layer, so the subscriber's decoder never sees a partial GOP.
+    """
+
+    def __init__(self, meter: DrainMeter):
+        self.meter = meter
+        # stream id -> [current layer, last seen, reported bytes/sec or None,
+        #               seq of the last capture delivered or None]
+        self._streams: Dict[int, list] = {}
+
+    def set_budget(self, stream_id: int, bytes_per_sec: float, now: float):
+        """Bandwidth the subscriber itself estimates for stream_id"""
+        state = self._streams.get(stream_id)
+        if state is None:
+            state = self._streams[stream_id] = [None, now, None, None]
+        state[2] = bytes_per_sec
+
+    def accept(self, stream_id: int, seq: int, flags: int, rates: LayerRates, now: float) -> bool:
+        """Whether a frame with these flags from stream_id goes to this subscriber
+
+        All layers of one capture share its seq and arrive lowest first, and
+        only one of them is delivered. To move up, the current layer's frame
+        of a keyframe capture is skipped so the target layer's can be taken.
+        """
+        layer = flags & FLAG_LAYER_MASK
+        state = self._streams.get(stream_id)
+        if state is None:
+            state = self._streams[stream_id] = [None, now, None, None]
+            self._prune(now)
+        state[1] = now
+        if seq == state[3]:
+            return False
+        current = state[0]
+        if flags & FLAG_KEYFRAME:
+            target = self._target(rates.rates(stream_id), current, state[2])
+            if layer < target and current is not None:
+                return False
+            if layer <= target:
+                # A new subscriber starts on whatever arrives first, then moves up
+                state[0] = layer
+            elif layer != current:
+                return False
+        elif layer != current:
+            return False
+        state[3] = seq
+        return True
+
+    def _target(self, layer_rates: List[float], current: Optional[int],
+                reported: Optional[float]) -> int:
+        capacity = self.meter.capacity
+        top = max((i for i, rate in enumerate(layer_rates) if rate > 0), default=0)
+        if capacity is None and reported is None:
+            return top
+        budget = capacity / max(1, len(self._streams)) if capacity is not None else reported
+        if reported is not None:
+            budget = min(budget, reported)
+        target = 0
+        for layer in range(1, top + 1):
+            needed = layer_rates[layer]
+            if current is None or layer > current:
+                needed /= UP_MARGIN
+            if needed <= budget:
+                target = layer
+        return target
+
+    def _prune(self, now: float):
+        for stream_id in [s for s, state in self._streams.items() if now - state[1] > STREAM_IDLE]:
+            del self._streams[stream_id]
+
+    def layers(self) -> Dict[int, Optional[int]]:
+        return {stream_id: state[0] for stream_id, state in self._streams.items()}
@@ -0,0 +1,202 @@
+import secrets
+import socket
+import struct
+import threading
+from typing import Dict, NamedTuple, Optional, Tuple
+from shared.protocols import (MEDIA_AUDIO, MEDIA_BIND, MEDIA_HEADER, MEDIA_MAGIC, MAX_DATAGRAM,
+                              FLAG_SIMULCAST)
+from server.send_queue import PRIORITY_AUDIO, PRIORITY_VIDEO
+from shared.log import get_logger
+
+log = get_logger('server.udp')
+
+# Offsets into the v2 media header (magic, type, flags, pad, stream, seq, timestamp, length)
+_UINT32 = struct.Struct('!I')
+_STREAM_OFFSET = 4
+_TOKEN = struct.Struct('!Q')
+_TOKEN_OFFSET = 12
+_LENGTH_OFFSET = MEDIA_HEADER.size - 4
+
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class Route(NamedTuple):
+    """Where datagrams from one stream go, precomputed when its room changes"""
+    addr: Tuple[str, int]
+    udp: Tuple[Tuple[str, int], ...]
+    # Room members with no UDP endpoint get the frame over TLS instead
+    tcp: tuple
+    # Everyone else in the room; simulcast needs a per-member layer choice
+    others: tuple
+    room: str
+    # The publishing connection, whose rate limits the stream is charged to
+    source: object
+
+
+class UdpRelay:
+    """Selective forwarding of v2 media datagrams between room members
+
+    A client asks for an endpoint over its TLS connection (MEDIA_REGISTER),
+    then sends a MEDIA_BIND datagram carrying the token it was given. From
+    then on datagrams from that address for its stream id are forwarded,
+    header and all, to the rest of the room without being decoded.
+    """
+
+    def __init__(self, host: str, port: int, manager):
+        self.host = host
+        self.port = port
+        self.manager = manager
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.routes: Dict[int, Route] = {}
+        self._room_streams: Dict[str, Tuple[int, ...]] = {}
+        self._tokens: Dict[int, Tuple[int, object]] = {}
+        self.lock = threading.Lock()
+        self.running = False
+        # Written only by the relay thread
+        self.packets_in = 0
+        self.packets_out = 0
+        self.packets_dropped = 0
+
+    def start(self):
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+            except OSError:
+                pass
+        self.sock.bind((self.host, self.port))
+        self.running = True
+        threading.Thread(target=self._run, name='udp-relay', daemon=True).start()
+        log.info("UDP media relay on %s:%d", self.host, self.port)
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+
+    def register(self, conn) -> int:
+        """Issue the token conn must present in its MEDIA_BIND datagram"""
+        token = secrets.randbits(63)
+        with self.lock:
+            self._tokens[conn.stream_id] = (token, conn)
+        return token
+
+    def unregister(self, conn):
+        with self.lock:
+            entry = self._tokens.get(conn.stream_id)
+            if entry is not None and entry[1] is conn:
+                del self._tokens[conn.stream_id]
+
+    def send_to(self, data: bytes, addr: Tuple[str, int]):
+        """Send one media frame to a bound client; safe from any thread"""
+        try:
+            self.sock.sendto(data, addr)
+        except OSError:
+            pass
+
+    def room_changed(self, room: Optional[str]):
+        """Rebuild the routes of every stream in room after a membership change"""
+        if room is None:
+            return
+        # Parked sessions stay in the room but have nowhere to send to
+        members = [member for member in self.manager.rooms.get_users(room) if not member.closed]
+        with self.lock:
+            streams = []
+            for member in members:
+                if member.udp_addr is None:
+                    continue
+                others = [other for other in members if other is not member]
+                self.routes[member.stream_id] = Route(
+                    member.udp_addr,
+                    tuple(other.udp_addr for other in others if other.udp_addr is not None),
+                    tuple(other for other in others if other.udp_addr is None),
+                    tuple(others),
+                    room,
+                    member,
+                )
+                streams.append(member.stream_id)
+            # New routes go in before stale ones come out, so no packet sees a gap
+            for stream_id in set(self._room_streams.get(room, ())) - set(streams):
+                self.routes.pop(stream_id, None)
+            if streams:
+                self._room_streams[room] = tuple(streams)
+            else:
+                self._room_streams.pop(room, None)
+
+    def _bind(self, stream_id: int, buf: bytearray, addr: Tuple[str, int]) -> bool:
+        token = _TOKEN.unpack_from(buf, _TOKEN_OFFSET)[0]
+        with self.lock:
+            entry = self._tokens.get(stream_id)
+        if entry is None or entry[0] != token or entry[1].closed:
+            return False
+        conn = entry[1]
+        conn.udp_addr = addr
+        self.room_changed(self.manager.rooms.room_of(conn))
+        return True
+
+    def _run(self):
+        buf = bytearray(MAX_DATAGRAM + 1)
+        view = memoryview(buf)
+        recvfrom_into = self.sock.recvfrom_into
+        sendto = self.sock.sendto
+        unpack_u32 = _UINT32.unpack_from
+        routes = self.routes
+        header_size = MEDIA_HEADER.size
+        manager = self.manager
+
+        while self.running:
+            try:
+                n, addr = recvfrom_into(buf)
+            except OSError:
+                continue
+            self.packets_in += 1
+            try:
+                if n < header_size or buf[0] != MEDIA_MAGIC:
+                    self.packets_dropped += 1
+                    continue
+                stream_id = unpack_u32(buf, _STREAM_OFFSET)[0]
+                packet = view[:n]
+
+                if buf[1] == MEDIA_BIND:
+                    # Echo accepted binds so the client knows the path works
+                    if self._bind(stream_id, buf, addr):
+                        self.send_to(packet, addr)
+                    else:
+                        self.packets_dropped += 1
+                    continue
+
+                route = routes.get(stream_id)
+                # Drop unknown streams, spoofed sources and lying length fields
+                if (route is None or route.addr != addr
+                        or unpack_u32(buf, _LENGTH_OFFSET)[0] != n - header_size):
+                    self.packets_dropped += 1
+                    continue
+                if not manager.admit_media(route.source, n):
+                    continue
+
+                if buf[2] & FLAG_SIMULCAST:
+                    # Each member gets only its layer, so go through deliver()
+                    udp_targets = ()
+                    tcp_targets = route.others
+                else:
+                    udp_targets = route.udp
+                    tcp_targets = route.tcp
+                try:
+                    for dest in udp_targets:
+                        sendto(packet, dest)
+                except OSError:
+                    pass
+                self.packets_out += len(udp_targets)
+
+                if tcp_targets or manager.mesh or manager.recorder:
+                    # The receive buffer is reused, so anything kept needs a copy
+                    frame = bytes(packet)
+                    priority = PRIORITY_AUDIO if buf[1] == MEDIA_AUDIO else PRIORITY_VIDEO
+                    if tcp_targets:
+                        manager.deliver(tcp_targets, frame, priority)
+                    if manager.mesh:
+                        manager.mesh.publish(route.room, frame, priority)
+                    if manager.recorder:
+                        manager.record(route.room, stream_id, frame)
+            except Exception as e:
+                # One bad packet (or a failing hook) must not stop UDP media for everyone
+                self.packets_dropped += 1
+                log.error("Error relaying datagram from %s: %s", addr, e)
@@ -0,0 +1,281 @@
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Dict, FrozenSet, List, Optional
+from shared.framing import FrameReader, LengthPrefix
+from server.send_queue import SendQueue, PRIORITY_CONTROL
+from shared.log import get_logger
+
+log = get_logger('server.mesh')
+
+# Body length (room + payload), kind, priority, room name length
+MESH_HEADER = struct.Struct('!IBBH')
+MESH_FRAMING = LengthPrefix(MESH_HEADER.format)
+
+KIND_ROOM_JOIN = 1
+KIND_ROOM_LEAVE = 2
+KIND_MEDIA = 3
+# Control frame for one stream; routed to the worker that owns it
+KIND_STREAM = 4
+STREAM_ID = struct.Struct('!I')
+
+CONNECT_TIMEOUT = 10.0
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytearray]:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return buf
+
+
+class _MeshFrame:
+    """Header and payload kept apart so media is never copied per link"""
+    __slots__ = ('head', 'payload')
+
+    def __init__(self, head: bytes, payload: bytes):
+        self.head = head
+        self.payload = payload
+
+    def __len__(self):
+        return len(self.head) + len(self.payload)
+
+
+class PeerLink:
+    """Stream link to one mesh peer with its own bounded send queue"""
+
+    def __init__(self, mesh: 'WorkerMesh', sock: socket.socket, peer_index: int):
+        self.mesh = mesh
+        self.sock = sock
+        self.peer_index = peer_index
+        self.send_queue = SendQueue(max_depth=1024, max_bytes=16 * 1024 * 1024)
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def start(self):
+        threading.Thread(target=self._write_loop, daemon=True).start()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def send(self, kind: int, room: str = '', payload: bytes = b'',
+             priority: int = PRIORITY_CONTROL):
+        room_bytes = room.encode('utf-8')
+        head = MESH_HEADER.pack(len(room_bytes) + len(payload), kind, priority,
+                                len(room_bytes)) + room_bytes
+        with self.cond:
+            if self.closed:
+                return
+            self.send_queue.push(_MeshFrame(head, payload), priority)
+            self.cond.notify()
+
+    def _write_loop(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.send_queue and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    frame = self.send_queue.pop()
+                self.sock.sendall(frame.head)
+                if frame.payload:
+                    self.sock.sendall(frame.payload)
+        except OSError as e:
+            log.warning("Lost link to peer %d: %s", self.peer_index, e)
+            self.close()
+
+    def _read_loop(self):
+        try:
+            reader = FrameReader(self.sock, MESH_FRAMING, buffer_size=256 * 1024)
+            for frame in reader:
+                if self.closed:
+                    break
+                _, kind, priority, room_len = MESH_HEADER.unpack_from(frame)
+                body = frame[MESH_HEADER.size:]
+                room = str(body[:room_len], 'utf-8')
+                payload = bytes(body[room_len:])
+                self.mesh.handle_frame(self, kind, room, payload, priority)
+        except OSError as e:
+            log.warning("Lost link to peer %d: %s", self.peer_index, e)
+        finally:
+            self.close()
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.mesh.remove_link(self)
+
+
+class WorkerMesh:
+    """Full mesh of unix sockets between the workers of one server
+
+    Workers announce the rooms they have local members in. Media for a room
+    is sent once to each sibling that has members there, which delivers it
+    to its own clients only, so a frame crosses at most one IPC hop.
+    Subclasses change the transport through _listen, _dial and _secure.
+    """
+
+    def __init__(self, index: int, workers: int, socket_dir: str):
+        self.index = index
+        self.workers = workers
+        self.socket_dir = socket_dir
+        self.manager = None
+        self.links: List[PeerLink] = []
+        self.lock = threading.Lock()
+        # room -> links with members there; replaced on change so reads need no lock
+        self.room_peers: Dict[str, FrozenSet[PeerLink]] = {}
+        self.local_rooms: Dict[str, int] = {}
+
+    @property
+    def port_offset(self) -> int:
+        """Added to per-process ports (UDP) so siblings on one host don't collide"""
+        return self.index
+
+    def socket_path(self, index: int) -> str:
+        return os.path.join(self.socket_dir, f"worker-{index}.sock")
+
+    def start(self, manager):
+        self.manager = manager
+        listener = self._listen()
+        threading.Thread(target=self._accept_loop, args=(listener,), daemon=True).start()
+        # Lower-numbered workers accept, higher-numbered ones dial
+        for peer in range(self.index):
+            self._connect(peer)
+
+    def _listen(self) -> socket.socket:
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path(self.index))
+        listener.listen(self.workers)
+        return listener
+
+    def _dial(self, peer: int) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path(peer))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _secure(self, sock: socket.socket, server_side: bool) -> socket.socket:
+        """Hook to authenticate/encrypt a new link; unix sockets need neither"""
+        return sock
+
+    def _connect(self, peer: int, timeout: Optional[float] = CONNECT_TIMEOUT):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                sock = self._secure(self._dial(peer), server_side=False)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05 if deadline is not None else 1.0)
+        sock.sendall(struct.pack('!I', self.index))
+        self._add_link(sock, peer)
+
+    def _accept_loop(self, listener: socket.socket):
+        while True:
+            sock, _ = listener.accept()
+            try:
+                sock = self._secure(sock, server_side=True)
+                hello = _recv_exact(sock, 4)
+            except OSError as e:
+                log.warning("Rejected mesh link: %s", e)
+                sock.close()
+                continue
+            if hello is None:
+                sock.close()
+                continue
+            self._add_link(sock, struct.unpack('!I', hello)[0])
+
+    def _add_link(self, sock: socket.socket, peer: int):
+        link = PeerLink(self, sock, peer)
+        link.start()
+        # Announce under the lock so a concurrent join/leave can't be reordered
+        with self.lock:
+            stale = [old for old in self.links if old.peer_index == peer]
+            self.links.append(link)
+            for room in self.local_rooms:
+                link.send(KIND_ROOM_JOIN, room)
+        # A peer that redials after a restart replaces its half-open old link
+        for old in stale:
+            old.close()
+
+    def remove_link(self, link: PeerLink):
+        with self.lock:
+            if link in self.links:
+                self.links.remove(link)
+            for room, peers in list(self.room_peers.items()):
+                if link in peers:
+                    self._set_peers(room, peers - {link})
+        self._link_lost(link)
+
+    def _link_lost(self, link: PeerLink):
+        """Workers live and die together, so a lost sibling is not redialed"""
+
+    def _set_peers(self, room: str, peers: FrozenSet[PeerLink]):
+        if peers:
+            self.room_peers[room] = peers
+        else:
+            self.room_peers.pop(room, None)
+
+    def room_joined(self, room: str):
+        """A local client joined room"""
+        with self.lock:
+            count = self.local_rooms.get(room, 0)
+            self.local_rooms[room] = count + 1
+            if count == 0:
+                for link in self.links:
+                    link.send(KIND_ROOM_JOIN, room)
+
+    def room_left(self, room: str):
+        """A local client left room"""
+        with self.lock:
+            count = self.local_rooms.get(room, 0) - 1
+            if count > 0:
+                self.local_rooms[room] = count
+                return
+            self.local_rooms.pop(room, None)
+            for link in self.links:
+                link.send(KIND_ROOM_LEAVE, room)
+
+    def publish(self, room: str, frame: bytes, priority: int):
+        """Send a media frame to every sibling with members in room"""
+        for link in self.room_peers.get(room, ()):
+            link.send(KIND_MEDIA, room, frame, priority)
+
+    def send_to_stream(self, stream_id: int, frame: bytes) -> bool:
+        """Hand a control frame to the worker whose client owns stream_id"""
+        owner = stream_id >> 24
+        for link in self.links:
+            if link.peer_index == owner:
+                link.send(KIND_STREAM, '', STREAM_ID.pack(stream_id) + frame)
+                return True
+        return False
+
+    def handle_frame(self, link: PeerLink, kind: int, room: str, payload: bytes, priority: int):
+        if kind == KIND_MEDIA:
+            self.manager.deliver_to_room(room, payload, priority)
+        elif kind == KIND_STREAM:
+            stream_id = STREAM_ID.unpack_from(payload)[0]
+            self.manager.send_to_stream(stream_id, payload[STREAM_ID.size:], local_only=True)
+        elif kind == KIND_ROOM_JOIN:
+            with self.lock:
+                self._set_peers(room, self.room_peers.get(room, frozenset()) | {link})
+        elif kind == KIND_ROOM_LEAVE:
+            with self.lock:
+                self._set_peers(room, self.room_peers.get(room, frozenset()) - {link})
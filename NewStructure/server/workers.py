@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+from shared import ssl_utils
+from server.connection_manager import ConnectionManager
+from server.worker_mesh import WorkerMesh
+from shared.log import get_logger
+
+log = get_logger('server.workers')
+
+
+def run_workers(workers: int, **manager_kwargs):
+    """Fork workers that share the listening port via SO_REUSEPORT
+
+    Workers are linked by a unix-socket mesh in a private temp directory so
+    rooms stay consistent no matter which worker a member lands on.
+    """
+    if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(os, 'fork'):
+        raise RuntimeError("--workers needs fork() and SO_REUSEPORT (Linux/macOS)")
+
+    # Built before forking so every worker inherits the same session ticket
+    # keys and a client can resume on whichever worker accepts it
+    ssl_utils.create_ssl_context(manager_kwargs['certfile'], manager_kwargs['keyfile'], server_side=True)
+
+    socket_dir = tempfile.mkdtemp(prefix='videocall-workers-')
+    context = multiprocessing.get_context('fork')
+    processes = [
+        context.Process(
+            target=_worker_main,
+            args=(index, workers, socket_dir, manager_kwargs),
+            name=f"worker-{index}",
+        )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    log.info("Started %d workers", workers)
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        log.info("Shutting down workers...")
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def _worker_main(index: int, workers: int, socket_dir: str, manager_kwargs: dict):
+    mesh = WorkerMesh(index, workers, socket_dir)
+    if manager_kwargs.get('metrics_port') is not None:
+        # Each worker exposes its own endpoint; scrape them all
+        manager_kwargs = dict(manager_kwargs, metrics_port=manager_kwargs['metrics_port'] + index)
+    server = ConnectionManager(reuse_port=True, mesh=mesh, **manager_kwargs)
+    server.start()
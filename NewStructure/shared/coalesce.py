@@ -0,0 +1,158 @@
+"""Coalesce small writes on a blocking (TLS) socket into fewer, larger sends
+
+Every sendall on a TLS socket becomes at least one record, each with its
+own header, MAC and encryption, plus a syscall. During a join storm most
+messages are a few dozen bytes, so they are better batched: a write()
+buffers the message, and the buffer goes out when it reaches max_bytes or
+when flush_delay has passed since the first message was buffered. Messages
+that must not wait are written with flush=True or followed by flush().
+"""
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+# Long enough to catch a burst, short enough that nobody notices it
+FLUSH_DELAY = 0.002
+# A full TLS record; larger sends are split into records anyway
+MAX_BYTES = 16 * 1024
+TLS_RECORD_SIZE = 16 * 1024
+
+
+class CoalescingWriter:
+    """Buffers messages for one socket and sends them in batches; thread-safe
+
+    on_error is called (on whichever thread was flushing) if a send fails;
+    after that the writer discards everything written to it.
+    """
+
+    def __init__(self, sock, flush_delay: float = FLUSH_DELAY, max_bytes: int = MAX_BYTES,
+                 on_error: Optional[Callable[[Exception], None]] = None):
+        self.sock = sock
+        self.flush_delay = flush_delay
+        self.max_bytes = max_bytes
+        self.on_error = on_error
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._armed = False
+        self.closed = False
+        # Guards the buffer; send_lock keeps batches in order on the socket
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        # messages written, sends (sendall calls) and TLS records they became
+        self.messages = 0
+        self.sends = 0
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, data: bytes, flush: bool = False):
+        """Buffer one message; sends now if flush is set or the buffer is full"""
+        self.write_many((data,), flush)
+
+    def write_many(self, parts: Sequence[bytes], flush: bool = False):
+        """Buffer one message given in parts (a header and a payload, say)
+
+        The parts go in under one lock hold, so no other thread's message
+        can land between them.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self._pending.extend(parts)
+            for part in parts:
+                self._pending_bytes += len(part)
+            self.messages += 1
+            if not flush and self._pending_bytes < self.max_bytes:
+                # A flush in between leaves a stale deadline behind; it only flushes early
+                if not self._armed:
+                    self._armed = True
+                    _flusher.schedule(self)
+                return
+        self.flush()
+
+    def flush(self):
+        """Send everything buffered now, in one sendall"""
+        with self.send_lock:
+            with self.lock:
+                if not self._pending:
+                    self._armed = False
+                    return
+                data = self._pending[0] if len(self._pending) == 1 else b''.join(self._pending)
+                self._pending = []
+                self._pending_bytes = 0
+                self._armed = False
+            try:
+                self.sock.sendall(data)
+            except Exception as e:
+                self._fail(e)
+                return
+            self.sends += 1
+            self.records += -(-len(data) // TLS_RECORD_SIZE)
+            self.bytes += len(data)
+
+    def _fail(self, error: Exception):
+        with self.lock:
+            self.closed = True
+            self._pending = []
+            self._pending_bytes = 0
+        if self.on_error is not None:
+            self.on_error(error)
+
+    def close(self, flush: bool = True):
+        """Stop accepting writes, sending what is buffered first unless flush is False"""
+        if flush and not self.closed:
+            self.flush()
+        with self.lock:
+            self.closed = True
+            self._pending = []
+            self._pending_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            'messages': self.messages,
+            'sends': self.sends,
+            'records': self.records,
+            'bytes': self.bytes,
+            'sends_per_message': self.sends / self.messages if self.messages else 0.0,
+            'records_per_message': self.records / self.messages if self.messages else 0.0,
+        }
+
+
+class _Flusher:
+    """One thread flushing every writer whose deadline has passed"""
+
+    def __init__(self):
+        self._deadlines = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, writer: CoalescingWriter):
+        with self._cond:
+            heapq.heappush(self._deadlines, (time.monotonic() + writer.flush_delay, next(self._seq), writer))
+            if self._thread is None or not self._thread.is_alive():
+                # Started lazily, and again in a forked child
+                self._thread = threading.Thread(target=self._run, name='coalesce-flusher', daemon=True)
+                self._thread.start()
+            elif self._deadlines[0][2] is writer:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._deadlines:
+                        self._cond.wait()
+                        continue
+                    delay = self._deadlines[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                writer = heapq.heappop(self._deadlines)[2]
+            # Outside the condition so writers can keep scheduling meanwhile;
+            # a send blocked on a full socket buffer does delay later deadlines
+            writer.flush()
+
+
+_flusher = _Flusher()
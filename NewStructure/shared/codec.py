@@ -0,0 +1,268 @@
+"""Typed control-message codecs generated from one declaration per type
+
+A message type is declared once as an ordered list of fields:
+
+    JOIN = message('JOIN', 1, username=Str(64), room=Str(64), protocol=U8)
+
+and gets an encoder and a decoder compiled for exactly those fields.
+Encoding is one struct.pack of the type id, every fixed-size field and
+the length of every variable field, followed by the variable fields'
+bytes; decoding is the mirror image and returns a NamedTuple. Decoding
+validates as it goes: unknown type ids, truncated or overlong buffers,
+bad UTF-8, strings or lists past their declared limits and values outside
+a field's choices all raise ValueError, so a handler only ever sees
+well-formed messages.
+
+Bytes fields decode to memoryviews into the buffer, as decode_media does.
+"""
+import struct
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+
+class Field:
+    """One declared field; subclasses say how it is stored"""
+
+    fixed = True
+    fmt = ''
+    default: Any = 0
+
+    def __init__(self, choices: Optional[Iterable] = None):
+        self.choices = frozenset(choices) if choices is not None else None
+
+    def __call__(self, choices: Iterable) -> 'Field':
+        """U8(choices=...) style: a copy of this field restricted to choices"""
+        field = type(self).__new__(type(self))
+        field.__dict__.update(self.__dict__)
+        field.choices = frozenset(choices)
+        return field
+
+
+class _Fixed(Field):
+    def __init__(self, fmt: str, default: Any = 0):
+        super().__init__()
+        self.fmt = fmt
+        self.default = default
+
+
+U8 = _Fixed('B')
+U16 = _Fixed('H')
+U32 = _Fixed('I')
+U64 = _Fixed('Q')
+F64 = _Fixed('d', 0.0)
+BOOL = _Fixed('?', False)
+
+
+class Str(Field):
+    """UTF-8 text, at most max_length characters"""
+
+    fixed = False
+    fmt = 'H'
+    default = ''
+
+    def __init__(self, max_length: int = 255, choices: Optional[Iterable[str]] = None):
+        super().__init__(choices)
+        self.max_length = max_length
+
+
+class Bytes(Field):
+    """Opaque payload, at most max_length bytes"""
+
+    fixed = False
+    fmt = 'I'
+    default = b''
+
+    def __init__(self, max_length: int = 16 * 1024 * 1024):
+        super().__init__()
+        self.max_length = max_length
+
+
+class StrList(Field):
+    """A list of UTF-8 strings, each at most max_length characters
+
+    Sent as an item count and one NUL-separated blob, so encoding and
+    decoding stay in C however long the list is; items may not contain NUL.
+    """
+
+    fixed = False
+    fmt = 'HI'
+    default = ()
+
+    def __init__(self, max_items: int = 65535, max_length: int = 255):
+        super().__init__()
+        self.max_items = max_items
+        self.max_length = max_length
+
+
+class MessageType:
+    """A declared message: its record type, encoder and decoder
+
+    encode(**fields) -> bytes; omitted fields take their defaults, except
+    fields with choices, which must be given. Anything decode() would
+    reject raises ValueError here too.
+    decode(buf) -> record, validating everything (ValueError if not).
+    """
+
+    def __init__(self, name: str, type_id: int, fields: Dict[str, Field]):
+        if not 0 < type_id < 256:
+            raise ValueError(f"Type id for {name} must fit in one byte")
+        self.name = name
+        self.type_id = type_id
+        self.fields = dict(fields)
+        self.record = NamedTuple(name.title().replace('_', '') + 'Message',
+                                 [(field_name, Any) for field_name in self.fields])
+        fixed = [field.fmt for field in self.fields.values() if field.fixed]
+        variable = [field.fmt for field in self.fields.values() if not field.fixed]
+        self.header = struct.Struct('!B' + ''.join(fixed) + ''.join(variable))
+        self.source = self._generate()
+        namespace = {'_pack': self.header.pack, '_unpack_from': self.header.unpack_from,
+                     '_size': self.header.size, '_struct_error': struct.error, '_new': tuple.__new__,
+                     '_record': self.record, '_type_id': type_id, '_name': name}
+        for field_name, field in self.fields.items():
+            if field.choices is not None:
+                namespace[f'_choices_{field_name}'] = field.choices
+        exec(self.source, namespace)
+        self.encode = namespace['encode']
+        self.decode = namespace['decode']
+
+    def _generate(self) -> str:
+        """Python source for encode() and decode(), specialised to the fields"""
+        names = list(self.fields)
+        fixed = [name for name in names if self.fields[name].fixed]
+        variable = [name for name in names if not self.fields[name].fixed]
+        # Keyword-only; a field with choices has no default, so it must be given
+        params = ', '.join(name if self.fields[name].choices is not None else f"{name}={self.fields[name].default!r}"
+                           for name in names)
+
+        enc = [f"def encode(*, {params}):" if names else "def encode():"]
+        # The same limits decode() enforces, so a message that encodes also decodes
+        for name in names:
+            if self.fields[name].choices is not None:
+                enc += [f"    if {name} not in _choices_{name}:",
+                        f"        raise ValueError(f'{name}: unexpected value {{{name}!r}}')"]
+        lengths = []
+        for name in variable:
+            field = self.fields[name]
+            if isinstance(field, Str):
+                enc += [f"    _{name} = {name}.encode()",
+                        f"    if len(_{name}) > {field.max_length} and len({name}) > {field.max_length}:",
+                        f"        raise ValueError('{name}: longer than {field.max_length}')"]
+            elif isinstance(field, Bytes):
+                enc += [f"    _{name} = {name}",
+                        f"    if len(_{name}) > {field.max_length}:",
+                        f"        raise ValueError('{name}: longer than {field.max_length} bytes')"]
+            else:
+                enc += [f"    if len({name}) > {field.max_items}:",
+                        f"        raise ValueError('{name}: more than {field.max_items} items')",
+                        f"    _{name} = '\\x00'.join({name})",
+                        f"    if _{name}.count('\\x00') != max(len({name}) - 1, 0):",
+                        f"        raise ValueError('{name}: items may not contain NUL')",
+                        f"    if len(_{name}) > {field.max_length} and max(map(len, {name})) > {field.max_length}:",
+                        f"        raise ValueError('{name}: item longer than {field.max_length}')",
+                        f"    _{name} = _{name}.encode()"]
+                lengths.append(f"len({name})")
+            lengths.append(f"len(_{name})")
+        # Out-of-range numbers, and strings past what their length field holds
+        enc += ["    try:",
+                f"        _head = _pack(_type_id, {', '.join(fixed + lengths)})",
+                "    except _struct_error as e:",
+                "        raise ValueError(f'{_name}: {e}') from None"]
+        parts = [f"_{name}" for name in variable]
+        enc.append(f"    return b''.join((_head, {', '.join(parts)}))" if parts else "    return _head")
+
+        header_names = fixed[:]
+        for name in variable:
+            if isinstance(self.fields[name], StrList):
+                header_names.append(f"_count_{name}")
+            header_names.append(f"_n_{name}")
+        dec = ["def decode(buf):",
+               "    try:",
+               f"        _type, {', '.join(header_names)} = _unpack_from(buf)",
+               "    except _struct_error:",
+               "        raise ValueError(f'Truncated {_name} message') from None",
+               "    if _type != _type_id:",
+               "        raise ValueError(f'Not a {_name} message (type {_type})')"]
+        # One comparison covers truncation and trailing bytes alike
+        expected = ' + '.join(['_size'] + [f"_n_{name}" for name in variable])
+        dec += [f"    if {expected} != len(buf):",
+                f"        raise ValueError(f'{{_name}} message is {{len(buf)}} bytes, its header says {{{expected}}}')"]
+        if variable:
+            dec.append("    _pos = _size")
+        for i, name in enumerate(variable):
+            field = self.fields[name]
+            end = f"_pos + _n_{name}"
+            if isinstance(field, Str):
+                # Characters never outnumber bytes, so most strings skip len()
+                dec += [f"    {name} = str(buf[_pos:{end}], 'utf-8')",
+                        f"    if _n_{name} > {field.max_length} and len({name}) > {field.max_length}:",
+                        f"        raise ValueError('{name}: longer than {field.max_length}')"]
+            elif isinstance(field, Bytes):
+                dec += [f"    if _n_{name} > {field.max_length}:",
+                        f"        raise ValueError('{name}: longer than {field.max_length} bytes')",
+                        f"    {name} = memoryview(buf)[_pos:{end}]"]
+            else:
+                dec += [f"    if _count_{name} > {field.max_items}:",
+                        f"        raise ValueError('{name}: more than {field.max_items} items')",
+                        f"    {name} = str(buf[_pos:{end}], 'utf-8').split('\\x00') if _count_{name} else []",
+                        f"    if len({name}) != _count_{name}:",
+                        f"        raise ValueError('{name}: item count does not match')",
+                        f"    if _n_{name} > {field.max_length} and max(map(len, {name})) > {field.max_length}:",
+                        f"        raise ValueError('{name}: item longer than {field.max_length}')"]
+            if i < len(variable) - 1:
+                dec.append(f"    _pos += _n_{name}")
+        for name in names:
+            if self.fields[name].choices is not None:
+                dec += [f"    if {name} not in _choices_{name}:",
+                        f"        raise ValueError(f'{name}: unexpected value {{{name}!r}}')"]
+        # UTF-8 errors need no handling: UnicodeDecodeError is a ValueError
+        dec.append(f"    return _new(_record, ({', '.join(names)}{',' if len(names) == 1 else ''}))")
+        return "\n".join(enc) + "\n\n" + "\n".join(dec) + "\n"
+
+
+def message(name: str, type_id: int, **fields: Field) -> MessageType:
+    return MessageType(name, type_id, fields)
+
+
+class Codec:
+    """A set of message types, dispatching decode on the leading type id"""
+
+    def __init__(self, types: Sequence[MessageType]):
+        self.by_id: Dict[int, MessageType] = {}
+        self.by_name: Dict[str, MessageType] = {}
+        for message_type in types:
+            if message_type.type_id in self.by_id:
+                raise ValueError(f"Type id {message_type.type_id} declared twice")
+            self.by_id[message_type.type_id] = message_type
+            self.by_name[message_type.name] = message_type
+
+    def encode(self, name: str, **fields) -> bytes:
+        return self.by_name[name].encode(**fields)
+
+    def decode(self, buf) -> Tuple[MessageType, tuple]:
+        """(type, record) for any declared message; ValueError if unknown or invalid"""
+        if not buf:
+            raise ValueError("Empty message")
+        message_type = self.by_id.get(buf[0])
+        if message_type is None:
+            raise ValueError(f"Unknown message type {buf[0]}")
+        return message_type, message_type.decode(buf)
+
+
+# --- The control messages of the three stacks ---
+
+STATUS = Str(16, choices=('success', 'expired', 'unavailable', 'error'))
+NAME = Str(64)
+ROOM = Str(64)
+SDP = Str(16 * 1024)
+
+JOIN = message('JOIN', 1, username=NAME, room=ROOM, protocol=U8)
+JOIN_ACK = message('JOIN_ACK', 2, status=STATUS, protocol=U8, stream_id=U32, session=Str(64), resume_grace=F64)
+LEAVE = message('LEAVE', 3, username=NAME)
+# Same fields as the v2 media header
+MEDIA = message('MEDIA', 4, kind=U8(choices=(1, 2)), flags=U8, stream=U32, seq=U32, timestamp_us=U64,
+                data=Bytes())
+CALL = message('CALL', 5, caller=NAME, target=NAME, sdp=SDP)
+ANSWER = message('ANSWER', 6, answerer=NAME, target=NAME, sdp=SDP)
+END = message('END', 7, user=NAME, target=NAME)
+USERLIST = message('USERLIST', 8, version=U32, users=StrList(max_items=10000, max_length=64))
+
+CONTROL = Codec([JOIN, JOIN_ACK, LEAVE, MEDIA, CALL, ANSWER, END, USERLIST])
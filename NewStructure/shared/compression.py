@@ -0,0 +1,206 @@
+"""Deflate with a preset dictionary for large, repetitive signalling payloads
+
+Presence updates and WebRTC SDP offers/answers are mostly the same text every
+time: attribute names, codec lines, extension URIs. Priming deflate with
+that text lets even a single message compress well. Compression is per
+connection and negotiated at connect time by DICTIONARY_VERSION; both
+ends must hold byte-identical dictionaries, so any change to it needs a
+new version. Payloads below the threshold, or that would not shrink, are
+sent as they are.
+
+Streams are raw deflate (no zlib header or checksum): the transports are
+already checked, and browsers can inflate raw deflate with a preset
+dictionary by replaying it as a stored block first (static/js/compression.js).
+"""
+import json
+import threading
+import time
+import zlib
+from typing import Optional
+
+DICTIONARY_VERSION = 'zd2'
+# Below this, header and block overhead eat most of the saving
+THRESHOLD = 256
+LEVEL = 6
+# An 8KB window holds the whole dictionary; with a small hash table it
+# also keeps per-message setup at a fraction of the zlib defaults' cost,
+# which mostly goes into clearing and copying 256KB of state
+WBITS = -13
+MEM_LEVEL = 5
+# Inflated size beyond which a payload is refused rather than expanded
+MAX_SIZE = 1024 * 1024
+
+_SDP_AUDIO = (
+    "m=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8 13 110 126",
+    "c=IN IP4 0.0.0.0",
+    "a=rtcp:9 IN IP4 0.0.0.0",
+    "a=ice-ufrag:",
+    "a=ice-pwd:",
+    "a=ice-options:trickle",
+    "a=fingerprint:sha-256 ",
+    "a=setup:actpass",
+    "a=mid:0",
+    "a=extmap:1 urn:ietf:params:rtp-hdrext:ssrc-audio-level",
+    "a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time",
+    "a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01",
+    "a=extmap:4 urn:ietf:params:rtp-hdrext:sdes:mid",
+    "a=sendrecv",
+    "a=msid:",
+    "a=rtcp-mux",
+    "a=rtpmap:111 opus/48000/2",
+    "a=rtcp-fb:111 transport-cc",
+    "a=fmtp:111 minptime=10;useinbandfec=1",
+    "a=rtpmap:63 red/48000/2",
+    "a=fmtp:63 111/111",
+    "a=rtpmap:9 G722/8000",
+    "a=rtpmap:0 PCMU/8000",
+    "a=rtpmap:8 PCMA/8000",
+    "a=rtpmap:13 CN/8000",
+    "a=rtpmap:110 telephone-event/48000",
+    "a=rtpmap:126 telephone-event/8000",
+    "a=ssrc:",
+)
+_SDP_VIDEO = (
+    "m=video 9 UDP/TLS/RTP/SAVPF 96 97 98 99 100 101 102 103 104 105 106 107 108 109 127 125 39 40 45 46 112 113 116 117 118",
+    "c=IN IP4 0.0.0.0",
+    "a=rtcp:9 IN IP4 0.0.0.0",
+    "a=setup:actpass",
+    "a=mid:1",
+    "a=extmap:14 urn:ietf:params:rtp-hdrext:toffset",
+    "a=extmap:13 urn:3gpp:video-orientation",
+    "a=extmap:5 http://www.webrtc.org/experiments/rtp-hdrext/playout-delay",
+    "a=extmap:6 http://www.webrtc.org/experiments/rtp-hdrext/video-content-type",
+    "a=extmap:7 http://www.webrtc.org/experiments/rtp-hdrext/video-timing",
+    "a=extmap:8 http://www.webrtc.org/experiments/rtp-hdrext/color-space",
+    "a=extmap:10 urn:ietf:params:rtp-hdrext:sdes:rtp-stream-id",
+    "a=extmap:11 urn:ietf:params:rtp-hdrext:sdes:repaired-rtp-stream-id",
+    "a=rtcp-rsize",
+    "a=rtpmap:96 VP8/90000",
+    "a=rtcp-fb:96 goog-remb",
+    "a=rtcp-fb:96 transport-cc",
+    "a=rtcp-fb:96 ccm fir",
+    "a=rtcp-fb:96 nack",
+    "a=rtcp-fb:96 nack pli",
+    "a=rtpmap:97 rtx/90000",
+    "a=fmtp:97 apt=96",
+    "a=rtpmap:98 VP9/90000",
+    "a=fmtp:98 profile-id=0",
+    "a=rtpmap:100 VP9/90000",
+    "a=fmtp:100 profile-id=2",
+    "a=rtpmap:102 H264/90000",
+    "a=fmtp:102 level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=42001f",
+    "a=rtpmap:108 H264/90000",
+    "a=fmtp:108 level-asymmetry-allowed=1;packetization-mode=0;profile-level-id=42e01f",
+    "a=rtpmap:45 AV1/90000",
+    "a=fmtp:45 level-idx=5;profile=0;tier=0",
+    "a=rtpmap:116 red/90000",
+    "a=rtpmap:118 ulpfec/90000",
+    "a=ssrc-group:FID ",
+    " cname:",
+    " msid:",
+)
+_SDP_SESSION = (
+    "v=0",
+    "o=- 4611731400430051336 2 IN IP4 127.0.0.1",
+    "s=-",
+    "t=0 0",
+    "a=group:BUNDLE 0 1",
+    "a=extmap-allow-mixed",
+    "a=msid-semantic: WMS ",
+)
+
+
+def _build_dictionary() -> bytes:
+    # zlib favours matches near the end of the dictionary, so the most
+    # repeated text goes last. Payloads travel as JSON (fnew) or plain
+    # text (Newnew), so the SDP appears in both spellings of its line breaks.
+    sdp = "\r\n".join(_SDP_SESSION + _SDP_VIDEO + _SDP_AUDIO) + "\r\n"
+    parts = [
+        # Presence: Newnew's snapshot, delta and re-sync lines, then fnew's JSON
+        "USERS|SYNC|PRESENCE|",
+        json.dumps({'version': 0, 'users': [""]}),
+        json.dumps({'base': 0, 'version': 0, 'changes': [["+", ""], ["-", ""]]}),
+        json.dumps({'candidate': {'candidate': "candidate:1 1 udp 2122260223 192.168.1.2 54321 typ host "
+                                               "generation 0 network-id 1", 'sdpMid': "0", 'sdpMLineIndex': 0}}),
+        sdp,
+        json.dumps({'answerer': "", 'answer': {'type': "answer", 'sdp': sdp.replace("actpass", "active")}}),
+        json.dumps({'caller': "", 'offer': {'type': "offer", 'sdp': sdp}}),
+    ]
+    return "".join(parts).encode()
+
+
+DICTIONARY = _build_dictionary()
+assert len(DICTIONARY) <= 1 << -WBITS, "dictionary no longer fits the deflate window"
+
+
+class Compressor:
+    """Compresses payloads for negotiated connections and counts what it saved
+
+    One instance can serve every connection; the counters are updated
+    under a lock so the numbers hold up with several handler threads.
+    """
+
+    def __init__(self, threshold: int = THRESHOLD, level: int = LEVEL, dictionary: bytes = DICTIONARY):
+        self.threshold = threshold
+        self.level = level
+        self.dictionary = dictionary
+        # Loading the dictionary costs as much as compressing a user list;
+        # each message starts from a copy of a stream that already has it
+        self._primed = zlib.compressobj(level, zlib.DEFLATED, WBITS, MEM_LEVEL, zdict=dictionary)
+        self.lock = threading.Lock()
+        # Messages and bytes offered to compress(), counting each copy sent;
+        # attempted/compressed/cpu_ns count deflate runs
+        self.messages = 0
+        self.attempted = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.cpu_ns = 0
+
+    def compress(self, data: bytes, copies: int = 1) -> Optional[bytes]:
+        """Deflated data, or None if the message should go out as it is
+
+        copies is how many connections the result will be sent to, for the
+        byte counts; a broadcast is compressed once for all of them.
+        """
+        size = len(data)
+        if size < self.threshold:
+            with self.lock:
+                self.messages += copies
+                self.raw_bytes += size * copies
+                self.wire_bytes += size * copies
+            return None
+        start = time.thread_time_ns()
+        deflater = self._primed.copy()
+        out = deflater.compress(data) + deflater.flush()
+        elapsed = time.thread_time_ns() - start
+        smaller = len(out) < size
+        with self.lock:
+            self.messages += copies
+            self.attempted += 1
+            self.raw_bytes += size * copies
+            self.wire_bytes += (len(out) if smaller else size) * copies
+            self.compressed += smaller
+            self.cpu_ns += elapsed
+        return out if smaller else None
+
+    def decompress(self, data: bytes, max_size: int = MAX_SIZE) -> bytes:
+        inflater = zlib.decompressobj(WBITS, zdict=self.dictionary)
+        out = inflater.decompress(data, max_size)
+        if inflater.unconsumed_tail:
+            raise ValueError(f"Compressed payload inflates beyond {max_size} bytes")
+        return out
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'dictionary': DICTIONARY_VERSION,
+                'messages': self.messages,
+                'attempted': self.attempted,
+                'compressed': self.compressed,
+                'raw_bytes': self.raw_bytes,
+                'wire_bytes': self.wire_bytes,
+                'bytes_saved': self.raw_bytes - self.wire_bytes,
+                'cpu_ms': self.cpu_ns / 1e6,
+                'cpu_us_per_attempt': self.cpu_ns / 1e3 / self.attempted if self.attempted else 0.0,
+            }
@@ -0,0 +1,262 @@
+"""Receiver-side bandwidth estimation and sender-side rate control.
+
+A receiver runs one BandwidthEstimator per incoming stream, fed with
+each packet's sequence number and the sender's capture timestamp. Two
+signals drive it:
+- A delay-gradient detector (a trendline over one-way delay variation,
+  in the style of Google Congestion Control) notices queues building
+  before packets are lost.
+- Loss is counted from sequence gaps.
+The receiver reports the estimate in a FEEDBACK message every
+FEEDBACK_INTERVAL. The sender's RateController folds the reports into
+one target bitrate. Encoders read it, e.g. through QualityAdapter.
+"""
+import time
+from collections import deque
+from typing import Deque, Dict, Hashable, Optional, Tuple
+
+FEEDBACK_INTERVAL = 0.5
+MIN_BITRATE = 50_000
+MAX_BITRATE = 8_000_000
+START_BITRATE = 1_000_000
+# Reports older than this no longer constrain the sender
+FEEDBACK_TIMEOUT = 5.0
+
+# Trendline filter and overuse detector constants from the GCC draft
+TRENDLINE_WINDOW = 20
+TRENDLINE_SMOOTHING = 0.9
+TRENDLINE_GAIN = 4.0
+THRESHOLD_INITIAL = 12.5
+THRESHOLD_MIN = 6.0
+THRESHOLD_MAX = 600.0
+THRESHOLD_K_UP = 0.0087
+THRESHOLD_K_DOWN = 0.039
+OVERUSE_TIME_MS = 10.0
+
+OVERUSE = 'overuse'
+UNDERUSE = 'underuse'
+NORMAL = 'normal'
+
+
+class TrendlineFilter:
+    """Slope of the smoothed accumulated delay variation over recent packet groups"""
+
+    def __init__(self, window: int = TRENDLINE_WINDOW):
+        self.samples: Deque[Tuple[float, float]] = deque(maxlen=window)
+        self.accumulated = 0.0
+        self.smoothed = 0.0
+        self.first_arrival: Optional[float] = None
+        self.count = 0
+
+    def update(self, delta_ms: float, arrival_ms: float) -> float:
+        if self.first_arrival is None:
+            self.first_arrival = arrival_ms
+        self.count += 1
+        self.accumulated += delta_ms
+        self.smoothed = TRENDLINE_SMOOTHING * self.smoothed + (1 - TRENDLINE_SMOOTHING) * self.accumulated
+        self.samples.append((arrival_ms - self.first_arrival, self.smoothed))
+        if len(self.samples) < self.samples.maxlen:
+            return 0.0
+        n = len(self.samples)
+        mean_x = sum(x for x, _ in self.samples) / n
+        mean_y = sum(y for _, y in self.samples) / n
+        numerator = sum((x - mean_x) * (y - mean_y) for x, y in self.samples)
+        denominator = sum((x - mean_x) ** 2 for x, _ in self.samples)
+        slope = numerator / denominator if denominator else 0.0
+        return min(self.count, 60) * slope * TRENDLINE_GAIN
+
+
+class OveruseDetector:
+    """Compares the delay trend with an adaptive threshold"""
+
+    def __init__(self):
+        self.threshold = THRESHOLD_INITIAL
+        self.state = NORMAL
+        self._last_update: Optional[float] = None
+        self._overuse_since: Optional[float] = None
+        self._previous_trend = 0.0
+
+    def detect(self, trend: float, now_ms: float) -> str:
+        if trend > self.threshold:
+            if self._overuse_since is None:
+                self._overuse_since = now_ms
+            # Overuse must persist and still be growing
+            if now_ms - self._overuse_since >= OVERUSE_TIME_MS and trend >= self._previous_trend:
+                self.state = OVERUSE
+        elif trend < -self.threshold:
+            self._overuse_since = None
+            self.state = UNDERUSE
+        else:
+            self._overuse_since = None
+            self.state = NORMAL
+        self._previous_trend = trend
+        self._adapt(trend, now_ms)
+        return self.state
+
+    def _adapt(self, trend: float, now_ms: float):
+        if self._last_update is None:
+            self._last_update = now_ms
+        # Ignore spikes far above the threshold (e.g. a route change)
+        if abs(trend) > self.threshold + 15.0:
+            self._last_update = now_ms
+            return
+        k = THRESHOLD_K_DOWN if abs(trend) < self.threshold else THRESHOLD_K_UP
+        elapsed = min(now_ms - self._last_update, 100.0)
+        self.threshold += k * (abs(trend) - self.threshold) * elapsed
+        self.threshold = max(THRESHOLD_MIN, min(THRESHOLD_MAX, self.threshold))
+        self._last_update = now_ms
+
+
+class BandwidthEstimator:
+    """Receiver's estimate of how fast one stream can be delivered to it, in bits/sec"""
+
+    def __init__(self, start_bitrate: float = START_BITRATE):
+        self.estimate = float(start_bitrate)
+        self.trendline = TrendlineFilter()
+        self.detector = OveruseDetector()
+        self.loss = 0.0
+        # Packets of one capture (e.g. simulcast layers) share a send time and form a group
+        self._group_send: Optional[float] = None
+        self._group_arrival = 0.0
+        self._previous_group: Optional[Tuple[float, float]] = None
+        self._bytes = 0
+        self._received = 0
+        self._highest_seq: Optional[int] = None
+        self._interval_start_seq: Optional[int] = None
+        self._interval_start: Optional[float] = None
+        self._last_update: Optional[float] = None
+
+    def on_packet(self, seq: int, send_time_us: int, size: int, arrival: Optional[float] = None):
+        now = time.monotonic() if arrival is None else arrival
+        if self._interval_start is None:
+            self._interval_start = now
+            self._interval_start_seq = seq
+        self._bytes += size
+        self._received += 1
+        if self._highest_seq is None or seq > self._highest_seq:
+            self._highest_seq = seq
+
+        send_ms = send_time_us / 1000.0
+        arrival_ms = now * 1000.0
+        if send_ms == self._group_send:
+            self._group_arrival = arrival_ms
+            return
+        if self._group_send is not None:
+            self._close_group()
+        self._group_send = send_ms
+        self._group_arrival = arrival_ms
+
+    def _close_group(self):
+        group = (self._group_send, self._group_arrival)
+        if self._previous_group is not None and group[0] > self._previous_group[0]:
+            # Positive when this group took longer to arrive than to send: a queue is growing
+            delta = (group[1] - self._previous_group[1]) - (group[0] - self._previous_group[0])
+            trend = self.trendline.update(delta, group[1])
+            self.detector.detect(trend, group[1])
+        self._previous_group = group
+
+    def update(self, now: Optional[float] = None) -> float:
+        """Fold the interval since the last call into the estimate"""
+        now = time.monotonic() if now is None else now
+        if self._interval_start is None or self._received == 0:
+            # Nothing arrived (sender paused): no evidence either way
+            return self.estimate
+        elapsed = max(now - self._interval_start, 1e-3)
+        incoming = self._bytes * 8 / elapsed
+
+        expected = self._highest_seq - self._interval_start_seq + 1
+        if expected > 0:
+            self.loss = max(0.0, 1.0 - self._received / expected)
+
+        # Delay-based AIMD
+        state = self.detector.state
+        since = 0.0 if self._last_update is None else now - self._last_update
+        if state == OVERUSE:
+            self.estimate = min(self.estimate, 0.85 * incoming)
+        elif state == NORMAL:
+            self.estimate *= 1.08 ** max(since, 0.0)
+            # Never run far ahead of what is actually arriving
+            self.estimate = min(self.estimate, 1.5 * incoming + 10_000)
+        # UNDERUSE: hold while the queue drains
+
+        # Loss-based cap
+        if self.loss > 0.10:
+            self.estimate *= 1.0 - 0.5 * self.loss
+
+        self.estimate = max(MIN_BITRATE, min(MAX_BITRATE, self.estimate))
+        self._last_update = now
+        self._interval_start = now
+        self._interval_start_seq = self._highest_seq + 1
+        self._bytes = 0
+        self._received = 0
+        return self.estimate
+
+    def feedback(self, stream_id: int, now: Optional[float] = None) -> dict:
+        """FEEDBACK message reporting this estimate to stream_id's sender"""
+        bitrate = self.update(now)
+        return {
+            'type': 'FEEDBACK',
+            'stream': stream_id,
+            'bitrate': int(bitrate),
+            'loss': round(self.loss, 4),
+            'state': self.detector.state,
+        }
+
+
+class RateController:
+    """Sender-side target bitrate from the receivers' FEEDBACK reports
+
+    With a single encoding every receiver has to be served, so the slowest
+    report wins. With simulcast the relay thins layers per receiver and the
+    top layer only needs to fit the fastest one.
+    """
+
+    def __init__(self, start_bitrate: float = START_BITRATE, min_bitrate: float = MIN_BITRATE,
+                 max_bitrate: float = MAX_BITRATE, simulcast: bool = False):
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.simulcast = simulcast
+        self._target = float(start_bitrate)
+        self._reports: Dict[Hashable, Tuple[float, float]] = {}
+
+    def on_feedback(self, receiver: Hashable, bitrate: float, now: Optional[float] = None):
+        self._reports[receiver] = (float(bitrate), time.monotonic() if now is None else now)
+
+    @property
+    def target_bitrate(self) -> float:
+        now = time.monotonic()
+        live = []
+        for receiver, (bitrate, at) in list(self._reports.items()):
+            if now - at > FEEDBACK_TIMEOUT:
+                del self._reports[receiver]
+            else:
+                live.append(bitrate)
+        if live:
+            self._target = max(live) if self.simulcast else min(live)
+        return max(self.min_bitrate, min(self.max_bitrate, self._target))
+
+    def frame_bytes(self, fps: float) -> int:
+        """Byte budget for one frame at fps"""
+        return max(1, int(self.target_bitrate / 8 / fps))
+
+
+class QualityAdapter:
+    """Steers an encoder quality knob (e.g. JPEG quality) so frames fit the target bitrate"""
+
+    def __init__(self, controller: RateController, fps: float, quality: int = 60,
+                 min_quality: int = 10, max_quality: int = 90):
+        self.controller = controller
+        self.fps = fps
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+
+    def on_frame(self, size: int) -> int:
+        """Report the size of the frame just encoded; returns the quality for the next one"""
+        ratio = size / self.controller.frame_bytes(self.fps)
+        if ratio > 1.1:
+            self.quality -= max(1, int(10 * (ratio - 1)))
+        elif ratio < 0.8:
+            self.quality += 1
+        self.quality = max(self.min_quality, min(self.max_quality, self.quality))
+        return self.quality
@@ -0,0 +1,176 @@
+import socket
+import struct
+from typing import Iterator, Optional
+from shared import protocols
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024 * 1024
+MIN_READ_SIZE = 4096
+
+
+class LengthPrefix:
+    """Frames are a fixed struct header holding the payload length, then the payload"""
+
+    def __init__(self, fmt: str = "!I"):
+        self.header = struct.Struct(fmt)
+
+    def frame_size(self, buf, offset: int, available: int) -> int:
+        """Total size of the frame at offset, or 0 if its header isn't complete yet"""
+        if available < self.header.size:
+            return 0
+        return self.header.size + self.header.unpack_from(buf, offset)[0]
+
+    def payload(self, frame: memoryview) -> memoryview:
+        return frame[self.header.size:]
+
+
+class ProtocolFraming(LengthPrefix):
+    """NewStructure wire format: v1 JSON frames and v2 binary media frames"""
+
+    def __init__(self):
+        super().__init__("!I")
+        self.media_header_size = protocols.Protocol.MEDIA_HEADER_SIZE
+
+    def frame_size(self, buf, offset: int, available: int) -> int:
+        if available and buf[offset] == protocols.MEDIA_MAGIC:
+            if available < self.media_header_size:
+                return 0
+            # Payload length is the last header field
+            length = struct.unpack_from("!I", buf, offset + self.media_header_size - 4)[0]
+            return self.media_header_size + length
+        return super().frame_size(buf, offset, available)
+
+    def payload(self, frame: memoryview) -> memoryview:
+        if frame[0] == protocols.MEDIA_MAGIC:
+            return frame[self.media_header_size:]
+        return frame[self.header.size:]
+
+
+class LineFraming:
+    """Frames end with a newline, for the text signalling protocols"""
+
+    def frame_size(self, buf, offset: int, available: int) -> int:
+        end = buf.find(b'\n', offset, offset + available)
+        if end < 0:
+            # At least one more byte; lets FrameReader enforce max_frame_size
+            return available + 1
+        return end - offset + 1
+
+    def payload(self, frame: memoryview) -> memoryview:
+        return frame[:-1]
+
+
+PROTOCOL_FRAMING = ProtocolFraming()
+LINE_FRAMING = LineFraming()
+
+
+class FrameReader:
+    """Buffered reader for length-prefixed frames on a stream (or TLS) socket
+
+    Data is received with recv_into into one reusable bytearray that only
+    grows when a single frame outgrows it. Frames are handed out as
+    memoryviews into that buffer, so they stay valid only until the next
+    fill(); copy with bytes() anything that must outlive it. Short reads and
+    frames split across TLS records are handled by buffering until the whole
+    frame has arrived.
+    """
+
+    def __init__(self, sock: Optional[socket.socket] = None, framing: LengthPrefix = PROTOCOL_FRAMING,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE):
+        self.sock = sock
+        self.framing = framing
+        self.max_frame_size = max_frame_size
+        self.buffer_size = buffer_size
+        # Allocated on first use so idle connections cost nothing
+        self._buf = bytearray()
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self._needed = 0
+
+    @property
+    def buffered(self) -> int:
+        return self._end - self._start
+
+    def _reserve(self, extra: int):
+        """Make room for extra bytes (and the whole pending frame) after the buffered data"""
+        pending = self._end - self._start
+        wanted = max(self._needed, pending + extra)
+        if self._start + wanted <= len(self._buf):
+            return
+        if wanted > len(self._buf):
+            size = len(self._buf) or self.buffer_size
+            while size < wanted:
+                size *= 2
+            # A fresh buffer keeps views handed out earlier intact
+            new_buf = bytearray(size)
+            new_buf[:pending] = self._view[self._start:self._end]
+            self._buf = new_buf
+            self._view = memoryview(new_buf)
+        else:
+            # memoryview assignment handles the overlapping move
+            self._view[:pending] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    def fill(self) -> int:
+        """Receive once into free buffer space; returns bytes read, 0 on EOF
+
+        Non-blocking sockets propagate BlockingIOError / SSLWantReadError.
+        """
+        self._reserve(MIN_READ_SIZE)
+        n = self.sock.recv_into(self._view[self._end:])
+        self._end += n
+        return n
+
+    def feed(self, data) -> None:
+        """Append bytes obtained elsewhere (e.g. a transport callback)"""
+        size = len(data)
+        self._reserve(size)
+        self._buf[self._end:self._end + size] = data
+        self._end += size
+
+    def next_frame(self) -> Optional[memoryview]:
+        """Pop one complete frame from the buffer, or None if more data is needed"""
+        available = self._end - self._start
+        size = self.framing.frame_size(self._buf, self._start, available)
+        if size == 0 or size > available:
+            if size > self.max_frame_size:
+                raise ValueError(f"Frame of {size} bytes exceeds limit")
+            self._needed = size
+            return None
+        frame = self._view[self._start:self._start + size]
+        self._start += size
+        self._needed = 0
+        if self._start == self._end:
+            self._start = self._end = 0
+        return frame
+
+    def frames(self) -> Iterator[memoryview]:
+        """Yield every complete frame currently buffered"""
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def read_frame(self) -> Optional[memoryview]:
+        """Block until a whole frame is available; None once the peer closes"""
+        while True:
+            frame = self.next_frame()
+            if frame is not None:
+                return frame
+            if self.fill() == 0:
+                return None
+
+    def __iter__(self) -> Iterator[memoryview]:
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def payloads(self) -> Iterator[memoryview]:
+        """Blocking iteration over frame payloads (headers stripped)"""
+        for frame in self:
+            yield self.framing.payload(frame)
@@ -0,0 +1,265 @@
+"""Cheap logging for hot paths
+
+A call below its logger's level is one attribute compare. An enabled call
+appends a tuple to a bounded ring and returns; a background thread formats
+and writes everything queued every FLUSH_INTERVAL, with one write per
+batch. So a slow terminal never stalls an event loop, and threads never
+contend on the stdout lock. If the writer falls behind, records that find
+the ring full are dropped and the writer reports how many.
+
+Levels are set per subsystem by dotted prefix and can be changed at
+runtime with set_level() or configure(); every logger picks the most
+specific prefix that matches its name:
+
+    log = get_logger('server.messages')
+    log.debug("Received %s from %s", msg_type, addr)
+    media_log = log.sampled(1000)     # 1 in 1000 calls gets through
+"""
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, TextIO, Tuple
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR, 'off': OFF}
+_LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARN', ERROR: 'ERROR'}
+
+RING_SIZE = 64 * 1024
+FLUSH_INTERVAL = 0.05
+# Read at import, e.g. VIDEOCALL_LOG="info,server.messages=debug"
+ENV_VAR = 'VIDEOCALL_LOG'
+
+# (time, level, logger name, template, args, fields)
+Record = Tuple[float, int, str, str, tuple, Optional[dict]]
+
+
+class Logger:
+    """Named logger; level is kept current by the module when levels change"""
+
+    __slots__ = ('name', 'level')
+
+    def __init__(self, name: str, level: int):
+        self.name = name
+        self.level = level
+
+    def log(self, level: int, msg: str, *args, **fields):
+        # Formatting happens on the writer thread, so args should not be
+        # mutated afterwards; pass values, not live objects
+        if level >= self.level:
+            if len(_ring) < RING_SIZE:
+                _ring.append((time.time(), level, self.name, msg, args, fields or None))
+            else:
+                _dropped[0] += 1
+
+    def debug(self, msg: str, *args, **fields):
+        if DEBUG >= self.level:
+            if len(_ring) < RING_SIZE:
+                _ring.append((time.time(), DEBUG, self.name, msg, args, fields or None))
+            else:
+                _dropped[0] += 1
+
+    def info(self, msg: str, *args, **fields):
+        if INFO >= self.level:
+            if len(_ring) < RING_SIZE:
+                _ring.append((time.time(), INFO, self.name, msg, args, fields or None))
+            else:
+                _dropped[0] += 1
+
+    def warning(self, msg: str, *args, **fields):
+        if WARNING >= self.level:
+            if len(_ring) < RING_SIZE:
+                _ring.append((time.time(), WARNING, self.name, msg, args, fields or None))
+            else:
+                _dropped[0] += 1
+
+    def error(self, msg: str, *args, **fields):
+        if ERROR >= self.level:
+            if len(_ring) < RING_SIZE:
+                _ring.append((time.time(), ERROR, self.name, msg, args, fields or None))
+            else:
+                _dropped[0] += 1
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def sampled(self, every: int) -> 'SampledLogger':
+        """A view of this logger that lets through one call in every `every`"""
+        return SampledLogger(self, every)
+
+
+class SampledLogger:
+    """Passes one in every N calls to its logger, noting how many it skipped
+
+    For per-frame events: at media rates the first of each run of N is
+    enough to see what is flowing. The counter is not locked, so with
+    several threads the ratio is approximate.
+    """
+
+    __slots__ = ('logger', 'every', 'count')
+
+    def __init__(self, logger: Logger, every: int):
+        self.logger = logger
+        self.every = max(1, every)
+        self.count = 0
+
+    def log(self, level: int, msg: str, *args, **fields):
+        if level >= self.logger.level:
+            count = self.count
+            self.count = count + 1
+            if count % self.every == 0:
+                if self.every > 1:
+                    fields['sampled'] = f"1/{self.every}"
+                self.logger.log(level, msg, *args, **fields)
+
+    def debug(self, msg: str, *args, **fields):
+        if DEBUG >= self.logger.level:
+            self.log(DEBUG, msg, *args, **fields)
+
+    def info(self, msg: str, *args, **fields):
+        if INFO >= self.logger.level:
+            self.log(INFO, msg, *args, **fields)
+
+
+_ring: Deque[Record] = deque()
+# Unlocked, so approximate under contention; only the writer resets it
+_dropped = [0]
+_loggers: Dict[str, Logger] = {}
+_levels: Dict[str, int] = {'': INFO}
+_lock = threading.Lock()
+_writer: Optional['_Writer'] = None
+
+
+def get_logger(name: str) -> Logger:
+    with _lock:
+        logger = _loggers.get(name)
+        if logger is None:
+            logger = _loggers[name] = Logger(name, _effective_level(name))
+            _ensure_writer()
+        return logger
+
+
+def _effective_level(name: str) -> int:
+    while True:
+        level = _levels.get(name)
+        if level is not None:
+            return level
+        if not name:
+            return INFO
+        name = name.rpartition('.')[0]
+
+
+def set_level(prefix: str, level: int):
+    """Set the level of every logger under prefix ('' is the root); takes effect immediately"""
+    with _lock:
+        _levels[prefix] = level
+        for name, logger in _loggers.items():
+            logger.level = _effective_level(name)
+
+
+def configure(spec: str):
+    """Apply levels from 'LEVEL,prefix=LEVEL,...', as in VIDEOCALL_LOG or --log"""
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        prefix, _, name = item.rpartition('=')
+        level = LEVELS.get(name.lower())
+        if level is None:
+            raise ValueError(f"Unknown log level {name!r}, expected one of {', '.join(LEVELS)}")
+        set_level(prefix, level)
+
+
+def levels() -> Dict[str, str]:
+    """Configured prefixes and their level names"""
+    names = {value: key for key, value in LEVELS.items()}
+    with _lock:
+        return {prefix: names[level] for prefix, level in sorted(_levels.items())}
+
+
+def flush():
+    """Write out everything queued so far; for shutdown paths and tests"""
+    writer = _writer
+    if writer is not None:
+        writer.drain()
+
+
+def set_stream(stream: TextIO):
+    with _lock:
+        _ensure_writer()
+        _writer.stream = stream
+
+
+class _Writer:
+    def __init__(self, stream: Optional[TextIO] = None):
+        # None follows sys.stdout, so redirect_stdout() and test capture still work
+        self.stream = stream
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, name='log-writer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            if _ring:
+                self.drain()
+
+    def drain(self):
+        lines = []
+        with self.lock:
+            for _ in range(len(_ring)):
+                lines.append(_format(_ring.popleft()))
+            dropped = _dropped[0]
+            if dropped:
+                _dropped[0] -= dropped
+                lines.append(f"... {dropped} log records dropped (writer behind)")
+            if lines:
+                stream = self.stream or sys.stdout
+                try:
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                except (OSError, ValueError):
+                    pass
+
+
+def _format(record: Record) -> str:
+    when, level, name, msg, args, fields = record
+    if args:
+        try:
+            msg = msg % args
+        except (TypeError, ValueError):
+            msg = f"{msg} {args!r}"
+    if fields:
+        msg = f"{msg} " + " ".join(f"{key}={value}" for key, value in fields.items())
+    stamp = time.strftime('%H:%M:%S', time.localtime(when))
+    return f"{stamp}.{int(when % 1 * 1000):03d} {_LEVEL_NAMES.get(level, level):<5} {name}: {msg}"
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is None:
+        _writer = _Writer()
+
+
+def _after_fork():
+    # The writer thread does not survive fork; workers start their own.
+    # Records still queued are the parent's to write.
+    global _writer, _lock
+    _lock = threading.Lock()
+    _ring.clear()
+    stream = _writer.stream if _writer is not None else None
+    _writer = None
+    if _loggers:
+        _writer = _Writer(stream)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+atexit.register(flush)
+if os.environ.get(ENV_VAR):
+    configure(os.environ[ENV_VAR])
@@ -0,0 +1,98 @@
+"""Versioned presence: one snapshot on connect, then batched join/leave deltas
+
+Broadcasting the whole user list on every join makes a join wave of N
+users cost O(N^2) bytes. Instead every join or leave gets the next
+version number and is queued; the server sends the queue as one Delta per
+BATCH_INTERVAL. A delta names the version it applies on top of (base). A
+client whose version is not the base has missed something and asks for
+the changes since its version, answered from recent history or, if that
+has been trimmed, with a fresh snapshot.
+"""
+import threading
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple, Union
+
+BATCH_INTERVAL = 0.1
+# Changes kept for clients catching up; older gaps get a snapshot
+HISTORY = 4096
+
+JOIN = '+'
+LEAVE = '-'
+
+
+class Snapshot(NamedTuple):
+    version: int
+    users: List[str]
+
+
+class Delta(NamedTuple):
+    base: int
+    version: int
+    # (JOIN or LEAVE, name), in order
+    changes: List[Tuple[str, str]]
+
+
+def parse_version(value) -> int:
+    """A version a client sent, or -1 (answered with a snapshot) if it isn't one"""
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        return -1
+    return version if version >= 0 else -1
+
+
+class Presence:
+    """Published user list and its change history; thread-safe
+
+    Snapshots and deltas only ever show changes that have been flushed, so
+    a client that takes a snapshot is in step with the next delta sent.
+    """
+
+    def __init__(self, history: int = HISTORY):
+        self.version = 0
+        self._users: Dict[str, None] = {}
+        self._history: Deque[Tuple[str, str]] = deque(maxlen=history)
+        self._pending: List[Tuple[str, str]] = []
+        self.lock = threading.Lock()
+
+    def join(self, name: str) -> bool:
+        """Queue a join; True if the caller should schedule a flush"""
+        return self._queue(JOIN, name)
+
+    def leave(self, name: str) -> bool:
+        """Queue a leave; True if the caller should schedule a flush"""
+        return self._queue(LEAVE, name)
+
+    def _queue(self, op: str, name: str) -> bool:
+        with self.lock:
+            self._pending.append((op, name))
+            return len(self._pending) == 1
+
+    def flush(self) -> Optional[Delta]:
+        """Publish everything queued as one delta; None if nothing was"""
+        with self.lock:
+            if not self._pending:
+                return None
+            changes, self._pending = self._pending, []
+            base = self.version
+            for op, name in changes:
+                if op == JOIN:
+                    self._users[name] = None
+                else:
+                    self._users.pop(name, None)
+            self._history.extend(changes)
+            self.version += len(changes)
+            return Delta(base, self.version, changes)
+
+    def snapshot(self) -> Snapshot:
+        with self.lock:
+            return Snapshot(self.version, list(self._users))
+
+    def since(self, version: int) -> Union[Delta, Snapshot]:
+        """What a client at version needs to catch up"""
+        with self.lock:
+            missing = self.version - version
+            if version >= 0 and 0 <= missing <= len(self._history):
+                changes = list(self._history)[len(self._history) - missing:]
+                return Delta(version, self.version, changes)
+            return Snapshot(self.version, list(self._users))
@@ -1,8 +1,52 @@
-import json 
+import base64
+import json
 import struct
+from typing import NamedTuple, Union
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+PROTOCOL_VERSION = PROTOCOL_V2
+
+# v2 media message types
+MEDIA_VIDEO = 1
+MEDIA_AUDIO = 2
+MEDIA_KINDS = {MEDIA_VIDEO: 'video', MEDIA_AUDIO: 'audio'}
+MEDIA_TYPES = {kind: msg_type for msg_type, kind in MEDIA_KINDS.items()}
+# v2 flags: simulcast layer (0 = lowest quality) in the low bits. Every
+# layer of one capture shares its seq and timestamp, so a subscriber sees
+# one continuous stream whichever layer it is switched to.
+FLAG_LAYER_MASK = 0x03
+FLAG_SIMULCAST = 0x04
+FLAG_KEYFRAME = 0x08
+MAX_LAYERS = FLAG_LAYER_MASK + 1
+
+# UDP only: ties a client's datagram address to its stream. The token from
+# MEDIA_ENDPOINT rides in the timestamp field; the server echoes it back.
+MEDIA_BIND = 3
+
+# Largest UDP payload; bigger media frames stay on the TCP connection
+MAX_DATAGRAM = 65507
+
+# v2 media header: magic, message type, flags, pad, stream id, sequence
+# number, capture timestamp (microseconds), payload length
+MEDIA_MAGIC = 0xB2
+MEDIA_HEADER = struct.Struct("!BBBxIIQI")
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class MediaFrame(NamedTuple):
+    msg_type: int
+    flags: int
+    stream_id: int
+    seq: int
+    timestamp_us: int
+    payload: memoryview
+
 
 class Protocol:
     HEADER_SIZE = 4
+    MEDIA_HEADER_SIZE = MEDIA_HEADER.size
 
     @staticmethod
     def encode_message(message:dict):
@@ -16,7 +60,64 @@ class Protocol:
         json_msg = data.decode("utf-8")
         return json.loads(json_msg)
     @staticmethod
+    def decode_frame(frame:bytes):
+        """Decode a full frame (header included) without copying the body"""
+        json_msg = str(memoryview(frame)[Protocol.HEADER_SIZE:], "utf-8")
+        return json.loads(json_msg)
+    @staticmethod
     def create_control_message(msg_type:str, **kwargs)->bytes:
         """Create standard control message"""
         message = {"type":msg_type, **kwargs}
-        return Protocol.encode_message(message)
\ No newline at end of file
+        return Protocol.encode_message(message)
+
+    # --- v2 binary media framing ---
+
+    @staticmethod
+    def is_media_frame(frame:Buffer)->bool:
+        """v1 frames start with a length byte that can never equal the magic"""
+        return len(frame) > 0 and frame[0] == MEDIA_MAGIC
+    @staticmethod
+    def encode_media_header(msg_type:int, stream_id:int, seq:int, timestamp_us:int,
+                            payload_length:int, flags:int = 0)->bytes:
+        """Pack the fixed v2 header; the payload is sent after it as-is"""
+        return MEDIA_HEADER.pack(MEDIA_MAGIC, msg_type, flags, stream_id,
+                                 seq & 0xFFFFFFFF, timestamp_us, payload_length)
+    @staticmethod
+    def encode_media(msg_type:int, stream_id:int, seq:int, timestamp_us:int,
+                     payload:Buffer, flags:int = 0)->bytes:
+        """Header plus payload as one buffer, for callers without scatter-gather"""
+        header = Protocol.encode_media_header(msg_type, stream_id, seq, timestamp_us,
+                                              len(payload), flags)
+        return header + payload
+    @staticmethod
+    def decode_media(frame:Buffer)->MediaFrame:
+        """Parse a v2 frame; the payload is a memoryview into frame, not a copy"""
+        magic, msg_type, flags, stream_id, seq, timestamp_us, length = \
+            MEDIA_HEADER.unpack_from(frame)
+        if magic != MEDIA_MAGIC:
+            raise ValueError("Not a v2 media frame")
+        start = MEDIA_HEADER.size
+        payload = memoryview(frame)[start:start + length]
+        if len(payload) != length:
+            raise ValueError("Truncated v2 media frame")
+        return MediaFrame(msg_type, flags, stream_id, seq, timestamp_us, payload)
+    @staticmethod
+    def encode_bind(stream_id:int, token:int)->bytes:
+        """UDP datagram claiming stream_id with the token issued over TLS"""
+        return Protocol.encode_media_header(MEDIA_BIND, stream_id, 0, token, 0)
+    @staticmethod
+    def media_to_message(media:MediaFrame)->dict:
+        """v1 JSON representation of a media frame (payload base64'd)"""
+        return {
+            "type": "MEDIA",
+            "kind": MEDIA_KINDS.get(media.msg_type, "video"),
+            "stream": media.stream_id,
+            "seq": media.seq,
+            "timestamp": media.timestamp_us / 1e6,
+            "data": base64.b64encode(media.payload).decode("ascii"),
+        }
+    @staticmethod
+    def media_to_legacy(frame:Buffer)->bytes:
+        """Transcode a v2 media frame for a client that only speaks v1"""
+        media = Protocol.decode_media(frame)
+        return Protocol.encode_message(Protocol.media_to_message(media))
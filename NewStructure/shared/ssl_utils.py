@@ -1,26 +1,100 @@
-import ssl 
+import ssl
 import socket
+import threading
+from functools import lru_cache
 from pathlib import Path
+from typing import Dict, Hashable, Optional
 
+@lru_cache(maxsize=None)
 def create_ssl_context(certfile:str, keyfile:str, server_side:bool = False):
+    """Shared SSL Context for these settings, built once per process
+
+    Reusing one context keeps the cert chain from being reloaded on every
+    connect and is what lets clients resume sessions (a saved session only
+    works with the context that created it).
+    """
+    return new_ssl_context(certfile, keyfile, server_side)
+
+def new_ssl_context(certfile:str, keyfile:str, server_side:bool = False):
     """Create and configure SSL Context"""
     context = ssl.create_default_context(
         ssl.Purpose.CLIENT_AUTH if server_side else ssl.Purpose.SERVER_AUTH
     )
-    context.load_cert_chain(certfile= certfile, keyfile=keyfile)
+    # Clients present no certificate unless given a key to go with it
+    if server_side or keyfile:
+        context.load_cert_chain(certfile= certfile, keyfile=keyfile)
     context.check_hostname = False
     context.verify_mode = ssl.CERT_NONE
     return context
 
 def wrap_socket(
-        sock:socket.socket, 
-        ssl_context:ssl.SSLContext, 
-        server_side:bool = False
+        sock:socket.socket,
+        ssl_context:ssl.SSLContext,
+        server_side:bool = False,
+        do_handshake_on_connect:bool = True,
+        session:Optional[ssl.SSLSession] = None
 )->ssl.SSLSocket:
-    """Wrap socket with SSL"""
+    """Wrap socket with SSL, resuming session if one is given"""
     return ssl_context.wrap_socket(
-        sock, 
-        server_side = server_side, 
-        do_handshake_on_connect= True, 
-        suppress_ragged_eofs=True
-    )
\ No newline at end of file
+        sock,
+        server_side = server_side,
+        do_handshake_on_connect= do_handshake_on_connect,
+        suppress_ragged_eofs=True,
+        session=session
+    )
+
+class SessionCache:
+    """Client-side TLS sessions keyed by server address
+
+    With TLS 1.3 the ticket arrives after the handshake, so save the
+    session once the server has sent something (or at disconnect).
+    """
+
+    def __init__(self):
+        self._sessions: Dict[Hashable, ssl.SSLSession] = {}
+        self._lock = threading.Lock()
+
+    def get(self, address:Hashable)->Optional[ssl.SSLSession]:
+        with self._lock:
+            return self._sessions.get(address)
+
+    def save(self, address:Hashable, ssl_socket:ssl.SSLSocket):
+        try:
+            session = ssl_socket.session
+        except (ValueError, OSError):
+            return
+        if session is not None and session.has_ticket:
+            with self._lock:
+                self._sessions[address] = session
+
+    def forget(self, address:Hashable):
+        with self._lock:
+            self._sessions.pop(address, None)
+
+SESSION_CACHE = SessionCache()
+
+class RotatingContext:
+    """Server context replaced every rotate_after seconds
+
+    Python has no API to set session ticket keys, and each SSLContext
+    generates its own at creation. Swapping in a fresh context therefore
+    rotates the keys. Tickets issued under the old keys fall back to a full
+    handshake.
+    """
+
+    def __init__(self, certfile:str, keyfile:str, rotate_after:Optional[float] = None):
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.rotate_after = rotate_after
+        # Start from the process-wide context so forked workers share ticket keys
+        self.context = create_ssl_context(certfile, keyfile, server_side=True)
+        self._created = None
+
+    def current(self, now:float)->ssl.SSLContext:
+        if self.rotate_after:
+            if self._created is None:
+                self._created = now
+            elif now - self._created >= self.rotate_after:
+                self.context = new_ssl_context(self.certfile, self.keyfile, server_side=True)
+                self._created = now
+        return self.context
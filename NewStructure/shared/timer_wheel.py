@@ -0,0 +1,93 @@
+import math
+import time
+from typing import Callable, List, Optional
+from shared.log import get_logger
+
+log = get_logger('shared.timer_wheel')
+
+# Defaults suit connection timeouts: quarter-second resolution, and one
+# revolution covers two minutes so most timers need no extra rounds
+TICK = 0.25
+SLOTS = 512
+
+
+class WheelTimer:
+    """A callback scheduled on a TimerWheel"""
+
+    __slots__ = ('callback', 'args', 'rounds', 'cancelled')
+
+    def __init__(self, callback: Callable, args: tuple, rounds: int):
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """Hashed timing wheel: O(1) schedule and cancel for large numbers of timeouts
+
+    Timers land in the slot their deadline hashes to and fire when advance()
+    passes that slot, at most one tick late. Cancelled timers are dropped
+    lazily when their slot comes round. Not thread-safe; the owner schedules
+    and advances from one thread.
+    """
+
+    def __init__(self, tick: float = TICK, slots: int = SLOTS, now: Optional[float] = None):
+        self.tick = tick
+        self._slots: List[List[WheelTimer]] = [[] for _ in range(slots)]
+        self._cursor = 0
+        # Time the slot under the cursor was reached
+        self._time = time.monotonic() if now is None else now
+        self.pending = 0
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def schedule(self, delay: float, callback: Callable, *args, now: Optional[float] = None) -> WheelTimer:
+        """Run callback(*args) from advance() once delay seconds have passed"""
+        now = time.monotonic() if now is None else now
+        ticks = max(1, math.ceil((now + delay - self._time) / self.tick))
+        slots = len(self._slots)
+        timer = WheelTimer(callback, args, (ticks - 1) // slots)
+        self._slots[(self._cursor + ticks) % slots].append(timer)
+        self.pending += 1
+        return timer
+
+    def next_tick(self) -> Optional[float]:
+        """When advance() next has work to look at; None if nothing is scheduled"""
+        return self._time + self.tick if self.pending else None
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """Fire every timer that is due by now; returns how many ran"""
+        now = time.monotonic() if now is None else now
+        fired = 0
+        slots = self._slots
+        if not self.pending:
+            # Nothing to find in the slots; skip straight to the current tick
+            self._time += math.floor((now - self._time) / self.tick) * self.tick
+            return 0
+        while self._time + self.tick <= now:
+            self._time += self.tick
+            self._cursor = (self._cursor + 1) % len(slots)
+            bucket = slots[self._cursor]
+            if not bucket:
+                continue
+            # Callbacks may schedule into this same slot; they go in the new list
+            slots[self._cursor] = keep = []
+            for timer in bucket:
+                if timer.cancelled:
+                    self.pending -= 1
+                elif timer.rounds:
+                    timer.rounds -= 1
+                    keep.append(timer)
+                else:
+                    self.pending -= 1
+                    fired += 1
+                    try:
+                        timer.callback(*timer.args)
+                    except Exception as e:
+                        log.error("Timer error: %s", e)
+        return fired
@@ -1,6 +1,6 @@
 from flask import Flask, render_template_string, request, jsonify
 from video_stream import send_video, receive_video
-from common import create_ssl_context
+from common import create_ssl_context, FrameReader, LINE_FRAMING, Compressor, DICTIONARY_VERSION, read_line
 import cryptography
 from flask_socketio import SocketIO
 import socket, threading, ssl
@@ -10,6 +10,7 @@ from flask_socketio import SocketIO
 import socket
 import ssl
 import threading
+import time
 import logging
 
 # Disable verbose logging
@@ -22,6 +23,17 @@ socketio = SocketIO(app)
 client_socket = None
 client_name = None
 server_ip = None
+quitting = False
+# Inflates what the server compressed with the dictionary offered at connect
+compressor = Compressor()
+# Users online as of presence_version; kept current by the server's deltas
+users = {}
+presence_version = -1
+presence_syncing = False
+
+# Match RESUME_GRACE in server.py
+RESUME_GRACE = 30.0
+RECONNECT_DELAY = 0.25
 
 HTML = """
 <!DOCTYPE html>
@@ -108,48 +120,119 @@ def index():
 
 @app.route("/connect", methods=["POST"])
 def connect_to_server():
-    global client_socket, client_name, server_ip
+    global client_socket, client_name, server_ip, quitting
     data = request.json
     client_name = data["name"]
     server_ip = data["server_ip"]
+    quitting = False
 
     try:
-        context = ssl.create_default_context()
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        client_socket = context.wrap_socket(
-            socket.socket(socket.AF_INET),
-            server_hostname=server_ip
-        )
-        client_socket.connect((server_ip, 5000))
-        client_socket.send(client_name.encode())
+        open_server_connection()
         threading.Thread(target=listen_to_server, daemon=True).start()
         return jsonify({"status": "connected"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+def open_server_connection():
+    global client_socket
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    client_socket = context.wrap_socket(
+        socket.socket(socket.AF_INET),
+        server_hostname=server_ip
+    )
+    client_socket.connect((server_ip, 5000))
+    # Offer the preset dictionary; the server compresses large messages only if it knows it
+    send_line(f"{client_name}|{DICTIONARY_VERSION}")
+
+def send_line(text):
+    # The server splits messages on newlines
+    client_socket.sendall(text.encode() + b"\n")
+
+def reconnect():
+    # The server holds our name for RESUME_GRACE seconds after a drop
+    delay = RECONNECT_DELAY
+    deadline = time.monotonic() + RESUME_GRACE
+    while time.monotonic() < deadline:
+        try:
+            open_server_connection()
+            # Presence changes are not queued for us while we are away
+            send_line(f"SYNC|{presence_version}")
+            print("[SERVER] reconnected")
+            return True
+        except OSError:
+            time.sleep(delay)
+            delay = min(delay * 2, 4.0)
+    return False
+
+@app.route("/users")
+def list_users():
+    return jsonify(list(users))
+
 @app.route("/call", methods=["POST"])
 def call_user():
     if not client_socket:
         return jsonify({"error": "Not connected"}), 400
-    client_socket.send(f"CALL|{request.json['target']}".encode())
+    send_line(f"CALL|{request.json['target']}")
     return jsonify({"status": "calling"})
 
 @app.route("/quit", methods=["POST"])
 def quit_app():
+    global quitting
     if client_socket:
+        quitting = True
+        try:
+            send_line("QUIT")
+        except OSError:
+            pass
         client_socket.close()
     return jsonify({"status": "quit"})
 
+def handle_presence(fields):
+    global users, presence_version, presence_syncing
+    if fields[0] == "USERS":
+        users = dict.fromkeys(fields[2:])
+        presence_version = int(fields[1])
+    else:
+        base, version = int(fields[1]), int(fields[2])
+        if presence_version < 0 or version <= presence_version:
+            return
+        if base != presence_version:
+            # Missed a delta; ask once for what we lack
+            if not presence_syncing:
+                presence_syncing = True
+                send_line(f"SYNC|{presence_version}")
+            return
+        for change in fields[3:]:
+            if change[0] == "+":
+                users[change[1:]] = None
+            else:
+                users.pop(change[1:], None)
+        presence_version = version
+    presence_syncing = False
+    print(f"[SERVER] users: {', '.join(users)}")
+
 def listen_to_server():
+    reader = FrameReader(client_socket, framing=LINE_FRAMING, buffer_size=4096)
     while True:
         try:
-            data = client_socket.recv(1024).decode()
-            if not data:
-                break
-            print(f"[SERVER] {data}")
+            frame = reader.read_frame()
         except:
-            break
+            frame = None
+        if frame is None:
+            if quitting or not reconnect():
+                break
+            reader = FrameReader(client_socket, framing=LINE_FRAMING, buffer_size=4096)
+            continue
+        data = read_line(frame, compressor)
+        if data == "PING":
+            send_line("PONG")
+            continue
+        if data.startswith(("USERS|", "PRESENCE|")):
+            handle_presence(data.split("|"))
+            continue
+        print(f"[SERVER] {data}")
 
 if __name__ == "__main__":
     socketio.run(app, host="0.0.0.0", port=8080, debug=True)
\ No newline at end of file
@@ -1,4 +1,28 @@
-import ssl, socket
+import os, sys, ssl, socket
+
+# Reuse the shared stream-framing reader from NewStructure
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NewStructure"))
+from shared.framing import FrameReader, LengthPrefix, LINE_FRAMING
+from shared.compression import Compressor, DICTIONARY_VERSION
+from shared.congestion import BandwidthEstimator, RateController, QualityAdapter, FEEDBACK_INTERVAL
+
+# Native unsigned long length prefix, as written by send_video
+VIDEO_FRAMING = LengthPrefix("L")
+
+# A compressed message is this prefix and the deflated text, with ESC and
+# newline bytes stuffed so the result is still one line
+COMPRESSED_PREFIX = b"Z|"
+
+def pack_compressed(deflated):
+    return COMPRESSED_PREFIX + deflated.replace(b"\x1b", b"\x1b1").replace(b"\n", b"\x1b2")
+
+def read_line(frame, compressor=None):
+    # Text of a line frame; compressor is set once compression was negotiated
+    data = bytes(LINE_FRAMING.payload(frame))
+    if compressor is not None and data.startswith(COMPRESSED_PREFIX):
+        deflated = data[len(COMPRESSED_PREFIX):].replace(b"\x1b2", b"\n").replace(b"\x1b1", b"\x1b")
+        data = compressor.decompress(deflated)
+    return data.decode()
 
 def create_ssl_context(server=False):
     context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER if server else ssl.PROTOCOL_TLS_CLIENT)
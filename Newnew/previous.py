@@ -2,6 +2,7 @@ import tkinter as tk
 from tkinter import simpledialog, messagebox
 import socket, ssl, threading, cv2, pickle, struct
 import numpy as np
+from common import FrameReader, VIDEO_FRAMING, LINE_FRAMING
 
 # ---- Control Socket (for JOIN/CALL/END) ----
 class ControlClient:
@@ -14,19 +15,22 @@ class ControlClient:
         self.context.verify_mode = ssl.CERT_NONE
         self.sock = self.context.wrap_socket(socket.socket(socket.AF_INET), server_hostname=host)
         self.sock.connect((host, port))
-        self.sock.send(name.encode())
+        self.send(name)
 
         self.running = True
         threading.Thread(target=self.listen_server, daemon=True).start()
 
     def send(self, msg):
-        self.sock.send(msg.encode())
+        # The server splits messages on newlines
+        self.sock.sendall(msg.encode() + b"\n")
 
     def listen_server(self):
+        reader = FrameReader(self.sock, LINE_FRAMING, buffer_size=4096)
         while self.running:
             try:
-                data = self.sock.recv(4096).decode()
-                if data:
+                frame = reader.read_frame()
+                if frame is not None:
+                    data = bytes(LINE_FRAMING.payload(frame)).decode()
                     print("[SERVER]", data)
                     if data.startswith("INCOMING|"):
                         caller = data.split("|")[1]
@@ -81,21 +85,8 @@ def receive_video():
     conn, _ = server.accept()
     conn = context.wrap_socket(conn, server_side=True)
 
-    data = b""
-    payload_size = struct.calcsize("L")
-
-    while True:
-        while len(data) < payload_size:
-            data += conn.recv(4096)
-        packed_size = data[:payload_size]
-        data = data[payload_size:]
-        msg_size = struct.unpack("L", packed_size)[0]
-
-        while len(data) < msg_size:
-            data += conn.recv(4096)
-        frame_data = data[:msg_size]
-        data = data[msg_size:]
-
+    reader = FrameReader(conn, VIDEO_FRAMING)
+    for frame_data in reader.payloads():
         frame = pickle.loads(frame_data)
         frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
         cv2.imshow('Video', frame)
@@ -203,24 +194,10 @@ class VideoCallApp:
         conn, _ = server.accept()
         conn = context.wrap_socket(conn, server_side=True)
 
-        data = b""
-        payload_size = struct.calcsize("L")
-
-        while self.running:
-            while len(data) < payload_size:
-                packet = conn.recv(4096)
-                if not packet:
-                    return
-                data += packet
-            packed_size = data[:payload_size]
-            data = data[payload_size:]
-            msg_size = struct.unpack("L", packed_size)[0]
-
-            while len(data) < msg_size:
-                data += conn.recv(4096)
-            frame_data = data[:msg_size]
-            data = data[msg_size:]
-
+        reader = FrameReader(conn, VIDEO_FRAMING)
+        for frame_data in reader.payloads():
+            if not self.running:
+                break
             frame = pickle.loads(frame_data)
             frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
             img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
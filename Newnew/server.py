@@ -1,51 +1,199 @@
-import socket, ssl, threading
-from common import create_ssl_context
+import socket, ssl, threading, time
+from common import create_ssl_context, FrameReader, LINE_FRAMING, Compressor, DICTIONARY_VERSION, pack_compressed
+from shared.coalesce import CoalescingWriter
+from shared.presence import Presence, Snapshot, BATCH_INTERVAL, parse_version
+from shared.timer_wheel import TimerWheel
+
+# A silent client is sent PING after HEARTBEAT_INTERVAL and dropped after IDLE_TIMEOUT
+HEARTBEAT_INTERVAL = 15.0
+IDLE_TIMEOUT = 45.0
+# A dropped client keeps its name (and gets missed messages) if it reconnects within this
+RESUME_GRACE = 30.0
+# How often the compression savings are printed, when there were any
+STATS_INTERVAL = 60.0
 
 clients = {}
+last_seen = {}
+# name -> messages sent while the client was away; a key here means disconnected
+missed = {}
 lock = threading.Lock()
+# Guarded by lock; one reaper thread advances it for every client
+wheel = TimerWheel()
+# conn -> CoalescingWriter; messages are newline-terminated so several can share a TLS record
+writers = {}
+# Connections that offered the preset dictionary when they joined
+compressing = set()
+compressor = Compressor()
+# Joining clients get "USERS|version|names..." once, then everyone gets
+# batched "PRESENCE|base|version|+name|-name..." deltas; "SYNC|version" re-syncs
+presence = Presence()
+
+def pack(text, copies=1):
+    # The compressed line for text, or None when it goes out as it is
+    deflated = compressor.compress(text.encode(), copies)
+    return pack_compressed(deflated) if deflated is not None else None
+
+def write(conn, text, packed=None, flush=False):
+    writer = writers.get(conn)
+    if writer is not None:
+        writer.write((packed if packed is not None else text.encode()) + b"\n", flush)
+
+def send(conn, text, flush=False):
+    write(conn, text, pack(text) if conn in compressing else None, flush)
+
+def send_to(name, text, flush=False):
+    # Caller holds lock
+    if name in missed:
+        missed[name].append(text)
+    else:
+        send(clients[name], text, flush)
+
+def format_presence(update):
+    if isinstance(update, Snapshot):
+        return "|".join(["USERS", str(update.version)] + update.users)
+    return "|".join(["PRESENCE", str(update.base), str(update.version)] + [op + name for op, name in update.changes])
+
+def queue_presence(first):
+    # Caller holds lock; the first change of a batch starts its window
+    if first:
+        wheel.schedule(BATCH_INTERVAL, flush_presence)
 
-def broadcast_user_list():
-    user_list = "|".join(clients.keys())
-    for conn in clients.values():
+def flush_presence():
+    # Runs on the reaper thread with lock held
+    delta = presence.flush()
+    if delta is not None:
+        broadcast(format_presence(delta))
+
+def broadcast(text):
+    # Clients that are away re-sync when they come back instead
+    online = [conn for name, conn in clients.items() if name not in missed]
+    # Compressed once for everyone who negotiated it
+    copies = sum(conn in compressing for conn in online)
+    packed = pack(text, copies) if copies else None
+    for conn in online:
+        write(conn, text, packed if conn in compressing else None)
+
+def check_idle(conn):
+    # Runs on the reaper thread with lock held
+    if conn not in last_seen:
+        return
+    idle = time.monotonic() - last_seen[conn]
+    if idle >= IDLE_TIMEOUT:
+        print(f"Closing idle client: silent for {idle:.0f}s")
         try:
-            conn.send(f"USERLIST|{user_list}".encode())
-        except:
+            # Wakes the handler thread blocked in recv, which cleans up
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
             pass
+        return
+    if idle >= HEARTBEAT_INTERVAL:
+        send(conn, "PING", flush=True)
+        delay = min(HEARTBEAT_INTERVAL, IDLE_TIMEOUT - idle)
+    else:
+        delay = HEARTBEAT_INTERVAL - idle
+    wheel.schedule(delay, check_idle, conn)
+
+def expire(name, conn):
+    # Runs on the reaper thread with lock held
+    if clients.get(name) is conn and name in missed:
+        del clients[name]
+        del missed[name]
+        print(f"{name} did not come back")
+        queue_presence(presence.leave(name))
+
+def report_compression(last_saved=0):
+    # Runs on the reaper thread with lock held
+    stats = compressor.stats()
+    if stats['bytes_saved'] != last_saved:
+        print(f"Compression: {stats['bytes_saved']} of {stats['raw_bytes']} bytes saved, "
+              f"{stats['compressed']}/{stats['attempted']} compressed, {stats['cpu_ms']:.1f}ms CPU")
+    wheel.schedule(STATS_INTERVAL, report_compression, stats['bytes_saved'])
+
+def reap_idle():
+    while True:
+        time.sleep(wheel.tick)
+        with lock:
+            wheel.advance()
 
 def handle_client(conn, addr):
+    leaving = False
+    name = None
+    reader = FrameReader(conn, framing=LINE_FRAMING, buffer_size=4096)
     try:
-        name = conn.recv(1024).decode()
+        # Nothing is tracked until the name arrives, so bound the wait for it
+        conn.settimeout(IDLE_TIMEOUT)
+        frame = reader.read_frame()
+        conn.settimeout(None)
+        if frame is None:
+            return
+        # "name" or "name|capabilities"; compression only for a client that offers our dictionary
+        name, _, offered = bytes(LINE_FRAMING.payload(frame)).decode().partition("|")
         with lock:
+            writers[conn] = CoalescingWriter(conn)
+            if DICTIONARY_VERSION in offered.split(","):
+                compressing.add(conn)
             clients[name] = conn
-            print(f"{name} joined from {addr}")
-            broadcast_user_list()
+            last_seen[conn] = time.monotonic()
+            wheel.schedule(HEARTBEAT_INTERVAL, check_idle, conn)
+            if name in missed:
+                # Same name back within the grace period: resume quietly
+                print(f"{name} reconnected from {addr}")
+                for text in missed.pop(name):
+                    send(conn, text)
+            else:
+                print(f"{name} joined from {addr}")
+                # Published state so far; this join arrives with the next delta
+                send(conn, format_presence(presence.snapshot()))
+                queue_presence(presence.join(name))
 
-        while True:
-            msg = conn.recv(4096).decode()
-            if not msg:
+        for frame in reader:
+            msg = bytes(LINE_FRAMING.payload(frame)).decode()
+            last_seen[conn] = time.monotonic()
+            if msg == "PONG":
+                continue
+            if msg == "QUIT":
+                leaving = True
                 break
+            if msg == "PING":
+                send(conn, "PONG", flush=True)
+                continue
+            if msg.startswith("SYNC|"):
+                # A version gap on the client: what it missed, or a new snapshot
+                version = parse_version(msg[len("SYNC|"):])
+                send(conn, format_presence(presence.since(version)), flush=True)
+                continue
             print(f"[{name}] {msg}")
 
             if msg.startswith("CALL|"):
                 target = msg.split("|")[1]
                 with lock:
                     if target in clients:
-                        clients[target].send(f"INCOMING|{name}".encode())
+                        send_to(target, f"INCOMING|{name}", flush=True)
 
             elif msg.startswith("ACCEPT|"):
                 caller = msg.split("|")[1]
                 with lock:
                     if caller in clients:
-                        clients[caller].send(f"ACCEPTED|{name}".encode())
+                        send_to(caller, f"ACCEPTED|{name}", flush=True)
 
     except Exception as e:
         print("Error:", e)
 
     finally:
         with lock:
-            if name in clients:
-                del clients[name]
-                broadcast_user_list()
+            last_seen.pop(conn, None)
+            writer = writers.pop(conn, None)
+            compressing.discard(conn)
+            if writer is not None:
+                writer.close(flush=False)
+            if name in clients and clients[name] is conn:
+                if leaving:
+                    del clients[name]
+                    queue_presence(presence.leave(name))
+                else:
+                    # Dropped, not quit: hold the name for a while instead of announcing a leave
+                    missed[name] = []
+                    wheel.schedule(RESUME_GRACE, expire, name, conn)
         conn.close()
 
 def start_server(host='0.0.0.0', port=5000):
@@ -54,6 +202,9 @@ def start_server(host='0.0.0.0', port=5000):
     sock.bind((host, port))
     sock.listen(5)
     print(f"[SERVER] Running on {host}:{port}")
+    with lock:
+        wheel.schedule(STATS_INTERVAL, report_compression)
+    threading.Thread(target=reap_idle, daemon=True).start()
 
     while True:
         client_sock, addr = sock.accept()
@@ -1,22 +1,52 @@
-import cv2, socket, ssl, pickle, struct
-from common import create_ssl_context
+import cv2, json, socket, ssl, pickle, struct, threading, time
+from common import (create_ssl_context, FrameReader, VIDEO_FRAMING,
+                    BandwidthEstimator, RateController, QualityAdapter, FEEDBACK_INTERVAL)
+
+FPS = 30
+
+def _send_frame(sock, obj):
+    data = pickle.dumps(obj)
+    sock.sendall(struct.pack("L", len(data)) + data)
+
+def _send_report(sock, report):
+    # JSON, not pickle: the sender must never unpickle what the peer sends
+    data = json.dumps(report).encode()
+    sock.sendall(struct.pack("L", len(data)) + data)
+
+def _read_feedback(sock, controller):
+    # The receiver reports its bandwidth estimate on the same connection
+    try:
+        for payload in FrameReader(sock, VIDEO_FRAMING).payloads():
+            try:
+                report = json.loads(bytes(payload))
+                controller.on_feedback('receiver', float(report['bitrate']))
+            except (ValueError, KeyError, TypeError):
+                # A malformed report is skipped, not trusted
+                continue
+    except (OSError, ValueError):
+        pass
 
 def send_video(target_ip, port=6000):
     context = create_ssl_context()
     sock = context.wrap_socket(socket.socket(socket.AF_INET))
     sock.connect((target_ip, port))
 
+    controller = RateController()
+    adapter = QualityAdapter(controller, FPS)
+    threading.Thread(target=_read_feedback, args=(sock, controller), daemon=True).start()
+
     cap = cv2.VideoCapture(0)
+    seq = 0
     while True:
         ret, frame = cap.read()
         if not ret: break
-        _, buffer = cv2.imencode('.jpg', frame)
-        data = pickle.dumps(buffer)
-        size = struct.pack("L", len(data))
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, adapter.quality])
+        adapter.on_frame(len(buffer))
         try:
-            sock.sendall(size + data)
+            _send_frame(sock, (seq, int(time.time() * 1e6), buffer))
         except:
             break
+        seq += 1
     cap.release()
     sock.close()
 
@@ -28,22 +58,21 @@ def receive_video(port=6000):
     conn, _ = sock.accept()
     conn = context.wrap_socket(conn, server_side=True)
 
-    data = b""
-    payload_size = struct.calcsize("L")
-    while True:
-        while len(data) < payload_size:
-            data += conn.recv(4096)
-        packed_size = data[:payload_size]
-        data = data[payload_size:]
-        msg_size = struct.unpack("L", packed_size)[0]
-        while len(data) < msg_size:
-            data += conn.recv(4096)
-        frame_data = data[:msg_size]
-        data = data[msg_size:]
-
-        frame = pickle.loads(frame_data)
+    estimator = BandwidthEstimator()
+    last_feedback = time.monotonic()
+    reader = FrameReader(conn, VIDEO_FRAMING)
+    for frame_data in reader.payloads():
+        seq, timestamp_us, frame = pickle.loads(frame_data)
+        now = time.monotonic()
+        estimator.on_packet(seq, timestamp_us, len(frame_data), now)
+        if now - last_feedback >= FEEDBACK_INTERVAL:
+            last_feedback = now
+            try:
+                _send_report(conn, estimator.feedback(0, now))
+            except OSError:
+                break
         frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
         cv2.imshow('Group Video Room', frame)
         if cv2.waitKey(1) == 27: break
     conn.close()
-    cv2.destroyAllWindows()
\ No newline at end of file
+    cv2.destroyAllWindows()
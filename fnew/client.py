@@ -6,20 +6,28 @@ eventlet.monkey_patch()  # Must be called before any other imports
 import os
 import ssl
 from flask import Flask, render_template, request, jsonify, session
-from flask_socketio import SocketIO, emit, disconnect
+from flask_socketio import SocketIO, emit, disconnect, join_room
+import sys
 import threading
 import webbrowser
 import cv2
 import base64
 from utils.ssl_helper import get_local_ip, generate_self_signed_cert
 
+# Presence tracking is shared with the other servers, in NewStructure
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NewStructure"))
+from shared.presence import Presence, Snapshot, BATCH_INTERVAL, parse_version
+
 # Initialize Flask and get local IP
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)  # Generate a random secret key
+# Socket.IO/Engine.IO logging writes a line per packet, i.e. per video
+# frame; only turn it on to debug signalling
+SOCKETIO_DEBUG = os.environ.get('SOCKETIO_DEBUG') == '1'
 socketio = SocketIO(app, 
                    cors_allowed_origins='*', 
-                   logger=True, 
-                   engineio_logger=True,
+                   logger=SOCKETIO_DEBUG, 
+                   engineio_logger=SOCKETIO_DEBUG,
                    ping_timeout=60,
                    ping_interval=25)
 
@@ -27,6 +35,9 @@ socketio = SocketIO(app,
 connected_users = {}  # {username: sid}
 user_sessions = {}   # {sid: username}
 active_calls = {}    # {caller_sid: callee_sid}
+# Registered users get a snapshot, then batched join/leave deltas in this room
+PRESENCE_ROOM = 'presence'
+presence = Presence()
 
 with app.app_context():
     local_ip = get_local_ip()
@@ -76,8 +87,7 @@ def handle_disconnect():
         del connected_users[username]
         del user_sessions[sid]
         print(f"👋 User disconnected: {username}")
-        # Notify all clients about updated user list
-        emit('user_list', list(connected_users.keys()), broadcast=True)
+        queue_presence(presence.leave(username))
 
 @socketio.on('register')
 def handle_register(data):
@@ -87,8 +97,28 @@ def handle_register(data):
         connected_users[username] = request.sid
         user_sessions[request.sid] = username
         print(f"✨ User registered: {username}")
-        # Send updated user list to all clients
-        emit('user_list', list(connected_users.keys()), broadcast=True)
+        join_room(PRESENCE_ROOM)
+        # Published state so far; this join arrives with the next delta
+        emit('presence', presence.snapshot()._asdict())
+        queue_presence(presence.join(username))
+
+@socketio.on('presence_sync')
+def handle_presence_sync(data):
+    # The client saw a version gap: the changes it missed, or a new snapshot
+    version = parse_version(data.get('version') if isinstance(data, dict) else None)
+    reply = presence.since(version)
+    emit('presence' if isinstance(reply, Snapshot) else 'presence_delta', reply._asdict())
+
+def flush_presence():
+    # Everything that joined or left during the window goes out as one delta
+    socketio.sleep(BATCH_INTERVAL)
+    delta = presence.flush()
+    if delta is not None:
+        socketio.emit('presence_delta', delta._asdict(), room=PRESENCE_ROOM)
+
+def queue_presence(first):
+    if first:
+        socketio.start_background_task(flush_presence)
 
 @socketio.on('call_user')
 def handle_call_user(data):
@@ -1,30 +1,57 @@
+import os
 import socket
 import ssl
+import sys
 import threading
 
+# Reuse the coalescing writer and stream framing from NewStructure
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NewStructure"))
+from shared.coalesce import CoalescingWriter
+from shared.framing import FrameReader, LINE_FRAMING
+
+# Call setup is waited on by a person; everything else may be batched
+URGENT_SIGNALS = {'CALL', 'ANSWER', 'END'}
+
 class ControlProtocol:
     def __init__(self):
         self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
         self.context.check_hostname = False
         self.context.verify_mode = ssl.CERT_NONE
         self.secure_sock = None  # Initialize here to be safe
+        self.writer = None
+        self.reader = None
 
     def connect(self, server_ip, port=5000):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.secure_sock = self.context.wrap_socket(sock)
         self.secure_sock.connect((server_ip, port))
+        self.writer = CoalescingWriter(self.secure_sock)
+        self.reader = FrameReader(self.secure_sock, LINE_FRAMING, buffer_size=1024)
         return self  # ✅ Return self instead of the socket
 
-    def send_signal(self, signal_type, payload):
-        message = f"{signal_type}|{payload}"
-        self.secure_sock.sendall(message.encode())
+    def send_signal(self, signal_type, payload, flush=None):
+        # One signal per line, so signals batched into one write stay separable
+        message = f"{signal_type}|{payload}\n"
+        if flush is None:
+            flush = signal_type in URGENT_SIGNALS
+        self.writer.write(message.encode(), flush=flush)
+
+    def flush(self):
+        self.writer.flush()
 
     def receive_signal(self):
-        return self.secure_sock.recv(1024).decode()
-    
+        frame = self.reader.read_frame()
+        return bytes(LINE_FRAMING.payload(frame)).decode() if frame is not None else ''
+
     def register(self, name):
         self.send_signal('REGISTER', name)
 
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.secure_sock is not None:
+            self.secure_sock.close()
+
     def listen_for_signals(self, on_signal):
         def loop():
             while True:
@@ -37,4 +64,4 @@ class ControlProtocol:
                 except Exception as e:
                     print(f"❌ Signal listener error: {e}")
                     break
-        threading.Thread(target=loop, daemon=True).start()
\ No newline at end of file
+        threading.Thread(target=loop, daemon=True).start()
@@ -1,21 +1,84 @@
 # server.py
 
-from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, request, jsonify, Response, abort
+from flask_socketio import SocketIO, emit, join_room
+import json
 import os
+import sys
 from utils.ssl_helper import get_local_ip
 
+# Reuse the preset-dictionary compressor and presence tracking from NewStructure
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "NewStructure"))
+from shared.compression import Compressor, DICTIONARY, DICTIONARY_VERSION
+from shared.presence import Presence, Snapshot, BATCH_INTERVAL, parse_version
+
 local_ip = get_local_ip()
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins='*')
+# Engine.IO heartbeats: a client that misses pings for
+# PING_INTERVAL + PING_TIMEOUT seconds is disconnected, which runs
+# handle_disconnect and frees its connected_clients entry
+PING_INTERVAL = 15
+PING_TIMEOUT = 30
+socketio = SocketIO(app, cors_allowed_origins='*',
+                    ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT)
 
 # Store connected clients
 connected_clients = {}  # username -> sid
+# sids that offered our dictionary at register; they get large payloads
+# as {'deflated': <raw deflate of the JSON>} (see static/js/compression.js)
+compressing = set()
+compressor = Compressor()
+# Registered clients get a presence snapshot, then batched join/leave
+# deltas in this room (see static/js/presence.js)
+PRESENCE_ROOM = 'presence'
+presence = Presence()
 
 @app.route('/')
 def index():
     return render_template('client.html')
 
+@app.route('/compression/<version>')
+def compression_dictionary(version):
+    if version != DICTIONARY_VERSION:
+        abort(404)
+    return Response(DICTIONARY, mimetype='application/octet-stream')
+
+@app.route('/compression')
+def compression_stats():
+    # Bytes saved and CPU spent on compression so far
+    return jsonify(compressor.stats())
+
+def send(event, payload, sid):
+    # Large payloads are deflated for clients that negotiated it
+    if sid in compressing:
+        deflated = compressor.compress(json.dumps(payload).encode())
+        if deflated is not None:
+            payload = {'deflated': deflated}
+    socketio.emit(event, payload, room=sid)
+
+def broadcast(event, payload):
+    # To every registered client; compressed once for all that negotiated it
+    targets = list(compressing)
+    if targets:
+        deflated = compressor.compress(json.dumps(payload).encode(), len(targets))
+        if deflated is not None:
+            for sid in targets:
+                socketio.emit(event, {'deflated': deflated}, room=sid)
+            socketio.emit(event, payload, room=PRESENCE_ROOM, skip_sid=targets)
+            return
+    socketio.emit(event, payload, room=PRESENCE_ROOM)
+
+def flush_presence():
+    # Everything that joined or left during the window goes out as one delta
+    socketio.sleep(BATCH_INTERVAL)
+    delta = presence.flush()
+    if delta is not None:
+        broadcast('presence_delta', delta._asdict())
+
+def queue_presence(first):
+    if first:
+        socketio.start_background_task(flush_presence)
+
 @socketio.on('connect')
 def handle_connect():
     print(f"🔌 Client connected: {request.sid}")
@@ -25,12 +88,24 @@ def handle_register(data):
     username = data.get('username')
     if username:
         connected_clients[username] = request.sid
-        # Broadcast updated user list to all clients
-        emit('user_list', list(connected_clients.keys()), broadcast=True)
+        if DICTIONARY_VERSION in data.get('compression', []):
+            compressing.add(request.sid)
+        join_room(PRESENCE_ROOM)
+        # Published state so far; this join arrives with the next delta
+        send('presence', presence.snapshot()._asdict(), request.sid)
+        queue_presence(presence.join(username))
         print(f"✅ User registered: {username}")
 
+@socketio.on('presence_sync')
+def handle_presence_sync(data):
+    # The client saw a version gap: the changes it missed, or a new snapshot
+    version = parse_version(data.get('version') if isinstance(data, dict) else None)
+    reply = presence.since(version)
+    send('presence' if isinstance(reply, Snapshot) else 'presence_delta', reply._asdict(), request.sid)
+
 @socketio.on('disconnect')
 def handle_disconnect():
+    compressing.discard(request.sid)
     # Remove user from connected clients
     username = None
     for user, sid in connected_clients.items():
@@ -40,8 +115,7 @@ def handle_disconnect():
     
     if username:
         del connected_clients[username]
-        # Broadcast updated user list
-        emit('user_list', list(connected_clients.keys()), broadcast=True)
+        queue_presence(presence.leave(username))
         print(f"❌ User disconnected: {username}")
 
 @socketio.on('call_user')
@@ -57,10 +131,10 @@ def handle_call_user(data):
         if caller:
             # Forward the call request to target
             target_sid = connected_clients[target]
-            emit('incoming_call', {
+            send('incoming_call', {
                 'caller': caller,
                 'offer': data.get('offer')  # Forward WebRTC offer
-            }, room=target_sid)
+            }, target_sid)
             print(f"📞 Video call request: {caller} -> {target}")
 
 @socketio.on('make_answer')
@@ -76,10 +150,10 @@ def handle_make_answer(data):
         if answerer:
             # Forward the answer to the caller
             target_sid = connected_clients[target]
-            emit('call_answered', {
+            send('call_answered', {
                 'answerer': answerer,
                 'answer': data.get('answer')  # Forward WebRTC answer
-            }, room=target_sid)
+            }, target_sid)
             print(f"📞 Call answered: {answerer} -> {target}")
 
 @socketio.on('ice_candidate')
@@ -88,9 +162,9 @@ def handle_ice_candidate(data):
     if target in connected_clients:
         # Forward ICE candidate to the target peer
         target_sid = connected_clients[target]
-        emit('ice_candidate', {
+        send('ice_candidate', {
             'candidate': data.get('candidate')
-        }, room=target_sid)
+        }, target_sid)
 
 @socketio.on('end_call')
 def handle_end_call(data):
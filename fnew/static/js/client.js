@@ -45,28 +45,28 @@ function initializeSocket() {
         showToast('Disconnected from server', 'error');
     });
 
-    socket.on('user_list', (users) => {
-        console.log('Received user list:', users);
+    PresenceTracker.attach(socket, (users) => {
+        console.log('User list now:', users);
         updateUserList(users);
     });
 
-    socket.on('incoming_call', async (data) => {
+    SignalCompression.on(socket, 'incoming_call', async (data) => {
         handleIncomingCall(data);
     });
 
-    socket.on('call_answered', async (data) => {
+    SignalCompression.on(socket, 'call_answered', async (data) => {
         handleCallAnswered(data);
     });
 
-    socket.on('call_rejected', (data) => {
+    SignalCompression.on(socket, 'call_rejected', (data) => {
         handleCallRejected(data);
     });
 
-    socket.on('call_ended', () => {
+    SignalCompression.on(socket, 'call_ended', () => {
         handleCallEnded();
     });
 
-    socket.on('ice_candidate', (data) => {
+    SignalCompression.on(socket, 'ice_candidate', (data) => {
         handleIceCandidate(data);
     });
 }
@@ -83,8 +83,9 @@ registerBtn.addEventListener('click', async () => {
             });
             localVideo.srcObject = localStream;
 
-            // Register with server
-            socket.emit('register', { username });
+            // Register with server, offering compression if this browser can inflate it
+            const compression = await SignalCompression.load();
+            socket.emit('register', { username, compression });
             
             // Update UI
             document.getElementById('registration').style.display = 'none';
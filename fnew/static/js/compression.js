@@ -0,0 +1,52 @@
+// Negotiated compression for signalling payloads (see NewStructure/shared/compression.py).
+// The server deflates large payloads with a preset dictionary and sends them
+// as { deflated: <bytes> }. DecompressionStream has no dictionary option, so
+// the dictionary is replayed as a stored deflate block ahead of the data and
+// its bytes are dropped from the output.
+const SignalCompression = (() => {
+    const VERSION = 'zd2';
+    let prefix = null;
+    let dictionaryLength = 0;
+    // Handlers run one at a time in arrival order, even while one inflates
+    let queue = Promise.resolve();
+
+    // Fetches the dictionary; resolves to the versions to offer at register
+    async function load() {
+        try {
+            new DecompressionStream('deflate-raw');
+            const response = await fetch(`/compression/${VERSION}`);
+            if (!response.ok) return [];
+            const dictionary = new Uint8Array(await response.arrayBuffer());
+            const length = dictionary.length;
+            // Header byte (not final, stored), then LEN and its complement, little-endian
+            prefix = new Uint8Array(5 + length);
+            prefix.set([0, length & 0xff, length >> 8, ~length & 0xff, (~length >> 8) & 0xff]);
+            prefix.set(dictionary, 5);
+            dictionaryLength = length;
+            return [VERSION];
+        } catch (err) {
+            console.log('Signalling compression unavailable:', err);
+            return [];
+        }
+    }
+
+    async function inflate(data) {
+        const stream = new Blob([prefix, data]).stream().pipeThrough(new DecompressionStream('deflate-raw'));
+        const bytes = new Uint8Array(await new Response(stream).arrayBuffer());
+        return JSON.parse(new TextDecoder().decode(bytes.subarray(dictionaryLength)));
+    }
+
+    // socket.on for events that may arrive compressed
+    function on(socket, event, handler) {
+        socket.on(event, (data) => {
+            queue = queue.then(async () => {
+                if (data && data.deflated !== undefined) {
+                    data = await inflate(data.deflated);
+                }
+                await handler(data);
+            }).catch(err => console.error(`Error handling ${event}:`, err));
+        });
+    }
+
+    return { VERSION, load, on };
+})();
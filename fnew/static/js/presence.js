@@ -0,0 +1,38 @@
+// Versioned presence (see NewStructure/shared/presence.py): one snapshot at
+// register, then batched join/leave deltas. A delta applies only on top of
+// the version it names; any other base means one was missed, so the client
+// asks for a re-sync instead of drifting.
+const PresenceTracker = (() => {
+    // onChange gets the full user list after every snapshot or applied delta
+    function attach(socket, onChange) {
+        const users = new Set();
+        let version = -1;
+        let syncing = false;
+
+        SignalCompression.on(socket, 'presence', (snapshot) => {
+            users.clear();
+            snapshot.users.forEach(name => users.add(name));
+            version = snapshot.version;
+            syncing = false;
+            onChange(Array.from(users));
+        });
+
+        SignalCompression.on(socket, 'presence_delta', (delta) => {
+            // Before our snapshot, or already covered by it
+            if (version < 0 || delta.version <= version) return;
+            if (delta.base !== version) {
+                if (!syncing) {
+                    syncing = true;
+                    socket.emit('presence_sync', { version });
+                }
+                return;
+            }
+            delta.changes.forEach(([op, name]) => op === '+' ? users.add(name) : users.delete(name));
+            version = delta.version;
+            syncing = false;
+            onChange(Array.from(users));
+        });
+    }
+
+    return { attach };
+})();